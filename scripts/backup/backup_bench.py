@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный стенд скриптов бэкапа: mysqldump, pg_dump и mongodump подменяются синтетическими генераторами
+(--mysqldump, --pg-dump, --mongodump), которые выдают N ГБ данных с заданной скоростью. Данные похожи на настоящие:
+SQL с INSERT пачками (mysqldump), custom-формат с блоками COPY, сжатыми как у pg_dump --compress (pg_dump -Fc),
+архив mongodump --archive из BSON-документов. Так измеряется сам путь бэкапа — сжатие, хеш, запись,
+ротация, — без сервера БД и без шума от него.
+Для каждого скрипта и кодека: сквозная скорость (МБ/с входных данных, без подготовки генератора), CPU на ГБ, пиковый RSS и усиление
+записи на диск. CPU — дерево процессов бэкапа (os.wait4) минус CPU генератора. RSS — сумма по процессам
+бэкапа (без генератора), замер каждые 0,2 с. Усиление записи — записанные на диск байты (write_bytes
+из /proc/self/io, включают дождавшихся потомков) к размеру результата. --rotate-files N: в каталог заранее
+кладутся N старых артефактов, и бэкап идёт с --rotate-days 1, так что в замер попадает и ротация.
+Результат — JSON (--out): версия (git describe), хост, параметры, по строке на прогон. compare сравнивает два
+таких файла (медиана повторов) и возвращает 2, если метрика ухудшилась больше порога.
+Каталог --work должен лежать на том диске, куда пишутся бэкапы: замер записи идёт по нему.
+Использование:
+  python3 backup_bench.py run --work /backup/bench --size 2 --out bench-$(git describe).json
+  python3 backup_bench.py run --work /backup/bench --scripts mysql,mongo --codecs zstd,lz4 --rate 200 --repeat 3
+  python3 backup_bench.py run --work /backup/bench --size 1 --rotate-files 5000
+  python3 backup_bench.py compare bench-old.json bench-new.json [--threshold 10]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import stat
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import backup_codecs as codecs
+import backup_metrics as metrics
+from backup_common import log, run_capture
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+# Скрипт бэкапа, подменяемая утилита, формат генератора, аргументы, префикс имени артефакта (для --rotate-files)
+SCRIPTS = {
+    "mysql": ("backup_mysql.py", "mysqldump", "sql", ["--database", "bench"], "mysql_bench_"),
+    "pg": ("backup_postgres.py", "pg_dump", "custom", ["--database", "bench"], "pg_bench_"),
+    "mongo": ("backup_mongodb.py", "mongodump", "archive", ["--archive"], "mongo_"),
+}
+# Переменные окружения генератора: объём, скорость (байт/с), зерно, файл статистики
+ENV_BYTES = "BENCH_GEN_BYTES"
+ENV_RATE = "BENCH_GEN_RATE"
+ENV_SEED = "BENCH_GEN_SEED"
+ENV_STATS = "BENCH_GEN_STATS"
+# Генератор повторяет пул разных блоков; пул больше окна любого кодека (zstd -19 — 8 МБ),
+# иначе повтор сжимался бы в ссылку и степень сжатия была бы нереальной
+GEN_BLOCK = 1 << 20
+GEN_POOL_BLOCKS = 16
+RSS_INTERVAL = 0.2
+# compare: какие метрики сравнивать и что считается ухудшением (+1 — рост, -1 — падение)
+COMPARE_METRICS = (("mb_per_s", -1), ("cpu_s_per_gb", 1), ("peak_rss_mb", 1), ("write_amplification", 1))
+PG_VERSION = "pg_dump (PostgreSQL) 16.4"
+ARCHIVE_MAGIC = 0x8199E26D
+ARCHIVE_COLLECTIONS = 4
+
+_FIRST = ("Иван", "Мария", "Алексей", "Ольга", "Дмитрий", "Анна", "Сергей", "Елена", "Павел", "Наталья", "John", "Emma")
+_LAST = ("Иванов", "Петрова", "Смирнов", "Кузнецова", "Попов", "Соколова", "Лебедев", "Новикова", "Smith", "Brown")
+_CITIES = ("Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Самара", "Berlin", "London")
+_STATUSES = ("new", "paid", "shipped", "delivered", "cancelled", "refunded")
+_WORDS = ("доставка", "курьером", "до", "двери", "позвонить", "заранее", "подъезд", "код", "оплата", "картой",
+          "при", "получении", "подарочная", "упаковка", "без", "звонка", "оставить", "у", "соседей", "срочно",
+          "gift", "wrap", "leave", "at", "door", "please", "call", "before", "delivery")
+
+
+# --- генераторы -------------------------------------------------------------------------------------------------
+
+
+def _rows(rng: random.Random, start_id: int, size: int):
+    """Строки заказов (id, клиент, имя, город, статус, сумма, время, комментарий) общим объёмом ~size байт."""
+    base = datetime(2023, 1, 1)
+    total, row_id = 0, start_id
+    while total < size:
+        comment = " ".join(rng.choices(_WORDS, k=rng.randint(0, 14)))
+        created = base + timedelta(seconds=rng.randint(0, 60_000_000))
+        row = (row_id, rng.randint(1, 2_000_000), f"{rng.choice(_FIRST)} {rng.choice(_LAST)}", rng.choice(_CITIES),
+               rng.choice(_STATUSES), round(rng.uniform(1, 250_000), 2), created.strftime("%Y-%m-%d %H:%M:%S"), comment)
+        total += 60 + len(comment) * 2
+        row_id += 1
+        yield row
+
+
+def _sql_value(v) -> str:
+    if isinstance(v, str):
+        return "'" + v.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    return str(v)
+
+
+def _gen_sql(rng: random.Random) -> tuple[bytes, list[bytes], bytes]:
+    """mysqldump: заголовок и CREATE TABLE, блоки extended INSERT (~1 МБ, как --net-buffer-length), хвост."""
+    head = (
+        "-- MySQL dump 10.13  Distrib 8.0.36, for Linux (x86_64)\n--\n-- Host: bench    Database: bench\n"
+        "-- ------------------------------------------------------\n"
+        "/*!40101 SET NAMES utf8mb4 */;\n/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;\n\n"
+        "DROP TABLE IF EXISTS `orders`;\nCREATE TABLE `orders` (\n  `id` bigint NOT NULL AUTO_INCREMENT,\n"
+        "  `customer_id` int NOT NULL,\n  `name` varchar(100) NOT NULL,\n  `city` varchar(64) NOT NULL,\n"
+        "  `status` varchar(16) NOT NULL,\n  `amount` decimal(12,2) NOT NULL,\n  `created_at` datetime NOT NULL,\n"
+        "  `comment` text,\n  PRIMARY KEY (`id`),\n  KEY `ix_customer` (`customer_id`)\n"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;\n\nLOCK TABLES `orders` WRITE;\n"
+    ).encode()
+    blocks, row_id = [], 1
+    for _ in range(GEN_POOL_BLOCKS):
+        values = []
+        for row in _rows(rng, row_id, GEN_BLOCK):
+            values.append("(" + ",".join(_sql_value(v) for v in row) + ")")
+        row_id += len(values)
+        blocks.append(("INSERT INTO `orders` VALUES " + ",".join(values) + ";\n").encode())
+    tail = f"UNLOCK TABLES;\n\n-- Dump completed on {datetime.now():%Y-%m-%d %H:%M:%S}\n".encode()
+    return head, blocks, tail
+
+
+def _gen_custom(rng: random.Random, compressed: bool) -> tuple[bytes, list[bytes], bytes]:
+    """
+    pg_dump -Fc: сигнатура PGDMP и заголовок, блоки данных COPY (текст с табуляцией) — сжатые zlib, как
+    pg_dump --compress (для zstd/lz4 на 16+ — тоже zlib: цель — поток той же энтропии), или сырые с --compress=0.
+    """
+    head = b"PGDMP" + bytes((1, 15, 0, 4, 8, 1)) + struct.pack("<i", 0) + b"bench\x00"
+    blocks, row_id = [], 1
+    for _ in range(GEN_POOL_BLOCKS):
+        lines = []
+        for row in _rows(rng, row_id, GEN_BLOCK):
+            lines.append("\t".join(str(v) if v != "" else "\\N" for v in row))
+        row_id += len(lines)
+        data = ("\n".join(lines) + "\n").encode()
+        if compressed:
+            data = zlib.compress(data, 6)
+        # блок данных: тип (1 — BLK_DATA), id записи TOC, длина, данные
+        blocks.append(b"\x01" + struct.pack("<ii", 3000 + len(blocks), len(data)) + data)
+    return head, blocks, b"\x00" * 8
+
+
+def _bson(fields: list[tuple[str, object]]) -> bytes:
+    """Плоский BSON-документ: bool, int32/int64, double, строка."""
+    body = bytearray()
+    for name, value in fields:
+        key = name.encode() + b"\x00"
+        if isinstance(value, bool):
+            body += b"\x08" + key + (b"\x01" if value else b"\x00")
+        elif isinstance(value, int):
+            body += (b"\x10" + key + struct.pack("<i", value)) if -2**31 <= value < 2**31 else \
+                (b"\x12" + key + struct.pack("<q", value))
+        elif isinstance(value, float):
+            body += b"\x01" + key + struct.pack("<d", value)
+        else:
+            enc = str(value).encode()
+            body += b"\x02" + key + struct.pack("<i", len(enc) + 1) + enc + b"\x00"
+    return struct.pack("<i", len(body) + 5) + bytes(body) + b"\x00"
+
+
+def _gen_archive(rng: random.Random) -> tuple[bytes, list[bytes], bytes]:
+    """
+    mongodump --archive: пролог (сигнатура, заголовок, метаданные коллекций, терминатор), блоки «заголовок
+    коллекции, документы, терминатор» по коллекциям по кругу, в конце — заголовки EOF всех коллекций.
+    """
+    term = struct.pack("<I", 0xFFFFFFFF)
+    names = [f"orders_{i}" for i in range(ARCHIVE_COLLECTIONS)]
+    head = struct.pack("<I", ARCHIVE_MAGIC) + _bson([
+        ("concurrent_collections", 4), ("version", "0.1"), ("server_version", "7.0.5"), ("tool_version", "100.9.4")])
+    for name in names:
+        meta = json.dumps({"indexes": [{"v": 2, "key": {"_id": 1}, "name": "_id_"}], "uuid": "", "collectionName": name})
+        head += _bson([("db", "bench"), ("collection", name), ("metadata", meta), ("size", 0), ("type", "collection")])
+    head += term
+    blocks, row_id = [], 1
+    for i in range(GEN_POOL_BLOCKS):
+        docs = []
+        for r in _rows(rng, row_id, GEN_BLOCK):
+            docs.append(_bson([("_id", r[0]), ("customer_id", r[1]), ("name", r[2]), ("city", r[3]), ("status", r[4]),
+                               ("amount", r[5]), ("created_at", r[6]), ("comment", r[7]), ("gift", not r[0] % 7)]))
+        row_id += len(docs)
+        ns = _bson([("db", "bench"), ("collection", names[i % len(names)]), ("EOF", False), ("CRC", 0)])
+        blocks.append(ns + b"".join(docs) + term)
+    tail = b"".join(_bson([("db", "bench"), ("collection", n), ("EOF", True), ("CRC", 0)]) + term for n in names)
+    return head, blocks, tail
+
+
+def generate(kind: str, argv: list[str]) -> int:
+    """
+    Режим генератора (вызывается обёрткой вместо mysqldump/pg_dump/mongodump). Аргументы утилиты: для pg_dump —
+    --version, -f файл, --compress; для mongodump нужен --archive (в stdout). Остальное игнорируется.
+    """
+    if kind == "custom" and "--version" in argv:
+        print(PG_VERSION)
+        return 0
+    if kind == "archive" and "--archive" not in argv:
+        print("Генератор mongodump: поддерживается только --archive", file=sys.stderr)
+        return 1
+    setup_started = time.monotonic()
+    total = int(os.environ.get(ENV_BYTES, 1 << 30))
+    rate = float(os.environ.get(ENV_RATE, 0))
+    rng = random.Random(int(os.environ.get(ENV_SEED, 1)))
+    if kind == "sql":
+        head, blocks, tail = _gen_sql(rng)
+    elif kind == "custom":
+        compress = next((a.split("=", 1)[1] for a in argv if a.startswith("--compress=")), "6")
+        head, blocks, tail = _gen_custom(rng, compress not in ("0", "none"))
+    else:
+        head, blocks, tail = _gen_archive(rng)
+    out_path = argv[argv.index("-f") + 1] if "-f" in argv else None
+
+    started = time.monotonic()
+    sent, i = 0, 0
+    try:
+        with (open(out_path, "wb") if out_path else open(sys.stdout.fileno(), "wb", closefd=False)) as out:
+            out.write(head)
+            sent = len(head)
+            while sent < total:
+                block = blocks[i % len(blocks)]
+                i += 1
+                out.write(block)
+                sent += len(block)
+                if rate > 0:
+                    delay = sent / rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+            out.write(tail)
+            sent += len(tail)
+    except BrokenPipeError:
+        return 1
+    stats = os.environ.get(ENV_STATS)
+    if stats:
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        with open(stats, "a") as f:
+            f.write(json.dumps({"bytes": sent, "cpu_seconds": ru.ru_utime + ru.ru_stime,
+                                "seconds": time.monotonic() - started, "setup_seconds": started - setup_started,
+                                "max_rss_kb": ru.ru_maxrss}) + "\n")
+    return 0
+
+
+# --- замеры -----------------------------------------------------------------------------------------------------
+
+
+def _write_wrappers(bin_dir: Path) -> None:
+    """Обёртки с именами утилит: exec этого скрипта в режиме gen с нужным форматом."""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for _, tool, kind, _, _ in SCRIPTS.values():
+        path = bin_dir / tool
+        path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{Path(__file__).resolve()}" gen {kind} "$@"\n')
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def _proc_io() -> dict:
+    """/proc/self/io: после wait включает ввод-вывод дождавшихся потомков."""
+    try:
+        return {k: int(v) for k, v in (line.split(": ") for line in Path("/proc/self/io").read_text().splitlines())}
+    except (OSError, ValueError):
+        return {}
+
+
+class _RssSampler:
+    """Пиковая сумма RSS процессов дерева root (без генератора) — опрос /proc каждые RSS_INTERVAL."""
+
+    def __init__(self, root: int):
+        self.root = root
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page = os.sysconf("SC_PAGE_SIZE")
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _sample(self) -> int:
+        children: dict[int, list[int]] = {}
+        rss: dict[int, int] = {}
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                data = Path(entry.path, "stat").read_text()
+            except OSError:
+                continue
+            # после «(comm)»: state ppid ... rss — 22-е поле после comm
+            fields = data[data.rindex(")") + 2:].split()
+            pid = int(entry.name)
+            children.setdefault(int(fields[1]), []).append(pid)
+            rss[pid] = int(fields[21]) * self._page
+        total, stack = 0, [self.root]
+        while stack:
+            pid = stack.pop()
+            try:
+                if b"backup_bench.py\x00gen\x00" in Path(f"/proc/{pid}/cmdline").read_bytes():
+                    continue
+            except OSError:
+                continue
+            total += rss.get(pid, 0)
+            stack.extend(children.get(pid, ()))
+        return total
+
+    def _loop(self) -> None:
+        while not self._stop.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, self._sample())
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+
+def _seed_old(dest: Path, prefix: str, count: int) -> None:
+    """count старых артефактов (по минуте в прошлое от года назад) — работа для --rotate-days 1."""
+    start = datetime.now() - timedelta(days=365)
+    for i in range(count):
+        when = start - timedelta(minutes=i)
+        path = dest / f"{prefix}{when:%Y-%m-%d_%H-%M}.old"
+        path.write_bytes(b"\x00" * 4096)
+        os.utime(path, (when.timestamp(), when.timestamp()))
+
+
+def _dir_size(path: Path) -> int:
+    """Размер результата прогона: всё в каталоге, кроме подложенных старых артефактов."""
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file() and not f.name.endswith(".old"))
+
+
+def run_one(args: argparse.Namespace, script: str, codec: str, bin_dir: Path, work: Path, index: int) -> dict:
+    """Один прогон: свежий каталог, бэкап подсистемы script с кодеком codec, замеры."""
+    name, tool, _, extra, prefix = SCRIPTS[script]
+    dest = work / f"{script}_{codec}"
+    shutil.rmtree(dest, ignore_errors=True)
+    dest.mkdir(parents=True)
+    if args.rotate_files:
+        _seed_old(dest, prefix, args.rotate_files)
+    stats = work / "gen_stats.jsonl"
+    stats.unlink(missing_ok=True)
+
+    cmd = [sys.executable, str(SCRIPT_DIR / name), "--dest", str(dest), f"--{tool.replace('_', '-')}",
+           str(bin_dir / tool), "--codec", codec] + extra
+    if args.level is not None:
+        cmd += ["--level", str(args.level)]
+    if args.threads:
+        cmd += ["--threads", str(args.threads)]
+    if args.rotate_files:
+        cmd += ["--rotate-days", "1"]
+    env = {**os.environ, ENV_BYTES: str(int(args.size * 1e9)), ENV_RATE: str(args.rate * 1e6),
+           ENV_SEED: str(args.seed), ENV_STATS: str(stats)}
+    # История метрик продакшена не засоряется прогонами стенда
+    env.pop(metrics.METRICS_DIR_ENV, None)
+    env.pop(metrics.METRICS_JSONL_ENV, None)
+
+    log_path = work / f"{script}_{codec}.log"
+    os.sync()
+    io0 = _proc_io()
+    started = time.monotonic()
+    with open(log_path, "wb") as err:
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=err)
+        sampler = _RssSampler(proc.pid)
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        peak_rss = sampler.stop()
+    elapsed = max(time.monotonic() - started, 1e-6)
+    # Грязные страницы учитываются в write_bytes при записи; sync — чтобы прогон не «унёс» запись в следующий
+    os.sync()
+    io1 = _proc_io()
+
+    gen = [json.loads(line) for line in stats.read_text().splitlines()] if stats.exists() else []
+    in_bytes = sum(g["bytes"] for g in gen)
+    gen_cpu = sum(g["cpu_seconds"] for g in gen)
+    # Пока генератор строит пул блоков, бэкап простаивает: в скорость это время не входит
+    setup = sum(g.get("setup_seconds", 0) for g in gen)
+    busy = max(elapsed - setup, 1e-6)
+    cpu = max(ru.ru_utime + ru.ru_stime - gen_cpu, 0.0)
+    out_bytes = _dir_size(dest)
+    written = io1.get("write_bytes", 0) - io0.get("write_bytes", 0) \
+        - (io1.get("cancelled_write_bytes", 0) - io0.get("cancelled_write_bytes", 0)) if io0 else None
+    left = sum(1 for f in dest.iterdir() if f.name.endswith(".old")) if args.rotate_files else 0
+    result = {
+        "script": script,
+        "codec": codec,
+        "level": args.level,
+        "run": index,
+        "exit_code": proc.returncode,
+        "seconds": round(elapsed, 3),
+        "input_bytes": in_bytes,
+        "output_bytes": out_bytes,
+        "ratio": round(in_bytes / out_bytes, 3) if out_bytes else None,
+        "generator_setup_seconds": round(setup, 3),
+        "mb_per_s": round(in_bytes / busy / 1e6, 1),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_s_per_gb": round(cpu / (in_bytes / 1e9), 2) if in_bytes else None,
+        "peak_rss_mb": round(peak_rss / 1e6, 1),
+        "generator_cpu_seconds": round(gen_cpu, 3),
+        "write_bytes": written,
+        "write_amplification": round(written / out_bytes, 3) if written is not None and out_bytes else None,
+        "rotated": args.rotate_files - left if args.rotate_files else None,
+    }
+    if proc.returncode != 0:
+        tail = log_path.read_text(errors="replace").strip().splitlines()[-5:]
+        log(f"  {script}/{codec}: код {proc.returncode}, лог {log_path}:\n    " + "\n    ".join(tail))
+    if not args.keep:
+        shutil.rmtree(dest, ignore_errors=True)
+    return result
+
+
+def _label() -> str:
+    code, out = run_capture(["git", "-C", str(SCRIPT_DIR), "describe", "--always", "--dirty"], timeout=10)
+    return out.strip() if code == 0 and out.strip() else "unknown"
+
+
+def _row(r: dict) -> str:
+    amp = f"{r['write_amplification']:.2f}" if r["write_amplification"] is not None else "—"
+    cpu = f"{r['cpu_s_per_gb']:.1f}" if r["cpu_s_per_gb"] is not None else "—"
+    ratio = f"{r['ratio']:.2f}" if r["ratio"] else "—"
+    return (f"{r['script']:<6} {r['codec']:<5} {r['mb_per_s']:>8.1f} {cpu:>9} {r['peak_rss_mb']:>8.1f} "
+            f"{ratio:>6} {amp:>6} {r['exit_code']:>4}")
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    scripts = [s.strip() for s in args.scripts.split(",") if s.strip()]
+    wanted = [c.strip() for c in args.codecs.split(",") if c.strip()]
+    for s in scripts:
+        if s not in SCRIPTS:
+            log(f"Ошибка: неизвестный скрипт {s} (есть: {', '.join(SCRIPTS)})")
+            return 1
+    selected = []
+    for c in wanted:
+        if c not in codecs.CODECS:
+            log(f"Ошибка: неизвестный кодек {c} (есть: {', '.join(codecs.CODECS)})")
+            return 1
+        if not codecs.available(c):
+            log(f"Кодек {c} недоступен на этом хосте — пропущен")
+            continue
+        selected.append(c)
+    work = Path(args.work)
+    work.mkdir(parents=True, exist_ok=True)
+    bin_dir = work / "bin"
+    _write_wrappers(bin_dir)
+
+    log(f"Стенд: {args.size:g} ГБ на прогон, скорость генератора {f'{args.rate:g} МБ/с' if args.rate else 'без ограничения'}, "
+        f"{len(scripts)} скр. × {len(selected)} код. × {args.repeat}")
+    log(f"{'скрипт':<6} {'кодек':<5} {'МБ/с':>8} {'CPU с/ГБ':>9} {'RSS МБ':>8} {'сжатие':>6} {'запись':>6} {'код':>4}")
+    results = []
+    failed = 0
+    for index in range(args.repeat):
+        for script in scripts:
+            for codec in selected:
+                r = run_one(args, script, codec, bin_dir, work, index)
+                results.append(r)
+                failed += r["exit_code"] != 0
+                log(_row(r))
+    report = {
+        "label": args.label or _label(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "params": {"size_gb": args.size, "rate_mbps": args.rate, "seed": args.seed, "level": args.level,
+                   "threads": args.threads, "rotate_files": args.rotate_files, "repeat": args.repeat,
+                   "work": str(work.resolve())},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        tmp = Path(args.out).with_name(f".{Path(args.out).name}.tmp")
+        tmp.write_text(text + "\n")
+        os.replace(tmp, args.out)
+        log(f"Результат: {args.out}")
+    else:
+        print(text)
+    if not args.keep:
+        shutil.rmtree(bin_dir, ignore_errors=True)
+        (work / "gen_stats.jsonl").unlink(missing_ok=True)
+    return 1 if failed else 0
+
+
+def _medians(report: dict) -> dict[tuple[str, str], dict]:
+    """(скрипт, кодек) -> медианы метрик по успешным повторам."""
+    groups: dict[tuple[str, str], list[dict]] = {}
+    for r in report.get("results", []):
+        if r.get("exit_code") == 0:
+            groups.setdefault((r["script"], r["codec"]), []).append(r)
+    out = {}
+    for key, rows in groups.items():
+        out[key] = {}
+        for metric, _ in COMPARE_METRICS:
+            values = sorted(r[metric] for r in rows if r.get(metric) is not None)
+            out[key][metric] = values[len(values) // 2] if values else None
+    return out
+
+
+def cmd_compare(args: argparse.Namespace) -> int:
+    try:
+        old, new = (json.loads(Path(p).read_text()) for p in (args.old, args.new))
+    except (OSError, ValueError) as e:
+        log(f"Ошибка чтения результатов: {e}")
+        return 1
+    before, after = _medians(old), _medians(new)
+    log(f"{old.get('label')} -> {new.get('label')}, порог {args.threshold:g}%")
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        parts = []
+        for metric, worse in COMPARE_METRICS:
+            a, b = before[key][metric], after[key][metric]
+            if a is None or b is None or a == 0:
+                continue
+            change = (b - a) / a * 100
+            bad = change * worse > args.threshold
+            regressions += bad
+            parts.append(f"{metric} {a:g} -> {b:g} ({change:+.1f}%){' РЕГРЕССИЯ' if bad else ''}")
+        log(f"  {key[0]}/{key[1]}: " + "; ".join(parts))
+    for key in sorted(before.keys() ^ after.keys()):
+        log(f"  {key[0]}/{key[1]}: есть только в {'старом' if key in before else 'новом'} прогоне")
+    if regressions:
+        log(f"Регрессий: {regressions}")
+        return 2
+    log("Регрессий нет")
+    return 0
+
+
+def main() -> int:
+    if len(sys.argv) > 2 and sys.argv[1] == "gen":
+        # Режим генератора: аргументы подменяемой утилиты произвольные, argparse здесь не подходит
+        return generate(sys.argv[2], sys.argv[3:])
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд скриптов бэкапа (синтетические дамперы)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="Прогнать скрипты бэкапа с кодеками и записать результат в JSON")
+    p.add_argument("--work", required=True, help="Рабочий каталог на диске бэкапов (артефакты, логи)")
+    p.add_argument("--size", type=float, default=1.0, help="Объём данных на прогон, ГБ")
+    p.add_argument("--rate", type=float, default=0, help="Скорость генератора, МБ/с (0 — сколько примет бэкап)")
+    p.add_argument("--scripts", default=",".join(SCRIPTS), help="Скрипты через запятую (mysql, pg, mongo)")
+    p.add_argument("--codecs", default="zstd,lz4,gzip,none", help="Кодеки через запятую")
+    p.add_argument("--level", type=int, default=None, help="Уровень сжатия (по умолчанию — кодека)")
+    p.add_argument("--threads", type=int, default=0, help="Потоки сжатия (--threads скриптов)")
+    p.add_argument("--repeat", type=int, default=1, help="Повторов каждого прогона (compare берёт медиану)")
+    p.add_argument("--rotate-files", type=int, default=0, help="Старых артефактов для ротации в каждом прогоне")
+    p.add_argument("--seed", type=int, default=1, help="Зерно генератора (одинаковые данные между версиями)")
+    p.add_argument("--label", default=None, help="Метка версии (по умолчанию git describe)")
+    p.add_argument("--keep", action="store_true", help="Не удалять артефакты прогонов")
+    p.add_argument("--out", default=None, help="Файл JSON (по умолчанию — stdout)")
+    p = sub.add_parser("compare", help="Сравнить два результата и найти регрессии")
+    p.add_argument("old", help="JSON прошлой версии")
+    p.add_argument("new", help="JSON новой версии")
+    p.add_argument("--threshold", type=float, default=10.0, help="Порог ухудшения метрики, %%")
+    args = parser.parse_args()
+    if args.command == "run":
+        return cmd_run(args)
+    return cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
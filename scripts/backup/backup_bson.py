@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Потоковая проверка каталога mongodump: в каждом <db>/<коллекция>.bson[.gz] проходится разметка документов
+(int32 длина + завершающий 0x00) без разбора полей, считаются документы, ловится обрезка файла и битая длина.
+Каждая коллекция сверяется со своим .metadata.json[.gz]: у представлений (view) данных быть не должно,
+у обычных коллекций .bson обязан быть. Файлы проверяются параллельно в пуле процессов, крупные первыми.
+.bson читается через mmap: у крупных документов страницы с телом не читаются вовсе.
+Архив mongodump --archive (файл mongo_<дата>.archive[.zst|.lz4|.gz], backup_mongodb.py --archive) проверяется
+одним потоком с распаковкой на лету: сигнатура, заголовок, метаданные коллекций (пролог), блоки документов
+каждой коллекции и их завершение (EOF-заголовок). CRC коллекций из архива не пересчитывается.
+Использование:
+  python3 backup_bson.py /backup/mongo/mongo_2025-02-11_12-00 [--workers 8] [--json]
+  python3 backup_bson.py /backup/mongo/mongo_2025-02-11_12-00.archive.zst
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import backup_codecs as codecs
+from backup_common import STREAM_BUFFER, log
+
+# Максимальный размер документа в дампе: 16 МБ + служебный запас сервера (BSONObjMaxInternalSize)
+MAX_DOC = 16 * 1024 * 1024 + 16 * 1024
+# Допустимые типы первого элемента документа (0 — пустой документ)
+_ELEMENT_TYPES = frozenset(range(0x00, 0x14)) | {0x7F, 0xFF}
+_INT32 = struct.Struct("<i")
+# Архив mongodump --archive: сигнатура в начале и терминатор блока (int32 -1 на месте длины документа)
+ARCHIVE_MAGIC = 0x8199E26D
+_TERMINATOR = -1
+
+
+class BsonError(Exception):
+    pass
+
+
+def _walk(buf, start: int, end: int) -> tuple[int, int]:
+    """Разметка документов в buf[start:end]. Возвращает (документов, позиция первого неполного документа)."""
+    pos, docs = start, 0
+    unpack = _INT32.unpack_from
+    while end - pos >= 4:
+        size = unpack(buf, pos)[0]
+        if size < 5 or size > MAX_DOC:
+            raise BsonError(f"неверная длина документа {size} на смещении {pos}")
+        if pos + size > end:
+            break
+        if buf[pos + size - 1] != 0 or buf[pos + 4] not in _ELEMENT_TYPES:
+            raise BsonError(f"повреждён документ на смещении {pos} (длина {size})")
+        pos += size
+        docs += 1
+    return docs, pos
+
+
+def _scan_plain(path: Path) -> tuple[int, int]:
+    size = path.stat().st_size
+    if size == 0:
+        return 0, 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        docs, pos = _walk(mm, 0, size)
+    if pos != size:
+        raise BsonError(f"файл обрезан: неполный документ на смещении {pos}, до конца {size - pos} байт")
+    return docs, size
+
+
+def _scan_gzip(path: Path) -> tuple[int, int]:
+    """.bson.gz: распаковка zlib блоками, разметка по распакованному потоку с переносом хвоста."""
+    docs = total = 0
+    tail = b""
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    in_member = False
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(STREAM_BUFFER)
+            if not chunk:
+                break
+            while chunk:
+                data = d.decompress(chunk)
+                in_member = True
+                chunk = b""
+                if d.eof:  # следующий gzip-член, если есть
+                    in_member = False
+                    chunk = d.unused_data
+                    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if not data:
+                    continue
+                buf = tail + data if tail else data
+                n, pos = _walk(buf, 0, len(buf))
+                docs += n
+                total += pos
+                tail = buf[pos:]
+    if in_member:
+        raise BsonError("gzip-поток обрезан")
+    if tail:
+        raise BsonError(f"файл обрезан: неполный документ в конце ({len(tail)} байт)")
+    return docs, total
+
+
+def scan_file(path: str | Path) -> dict:
+    """Проверка одного .bson/.bson.gz: {path, docs, bytes, seconds} или {path, error}."""
+    path = Path(path)
+    started = time.monotonic()
+    try:
+        if path.name.endswith(".gz"):
+            docs, size = _scan_gzip(path)
+        else:
+            docs, size = _scan_plain(path)
+    except (OSError, BsonError, zlib.error) as e:
+        return {"path": str(path), "error": str(e)}
+    return {"path": str(path), "docs": docs, "bytes": size, "seconds": round(time.monotonic() - started, 3)}
+
+
+def _collection_name(f: Path, root: Path, suffixes: tuple[str, ...]) -> str | None:
+    name = f.name
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            rel = f.parent.relative_to(root)
+            coll = name[: -len(suffix)]
+            return f"{rel.as_posix()}.{coll}" if rel.parts else coll
+    return None
+
+
+def _read_metadata(f: Path) -> dict:
+    opener = gzip.open if f.name.endswith(".gz") else open
+    with opener(f, "rt", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def validate_dump(directory: str | Path, workers: int = 0) -> dict:
+    """
+    Проверка каталога mongodump. Возвращает отчёт: коллекции (документы, байты, время), ошибки, предупреждения.
+    """
+    root = Path(directory)
+    if not root.is_dir():
+        raise BsonError(f"каталог не найден: {root}")
+    started = time.monotonic()
+    data: dict[str, Path] = {}
+    meta: dict[str, Path] = {}
+    for f in root.rglob("*"):
+        if not f.is_file():
+            continue
+        coll = _collection_name(f, root, (".bson", ".bson.gz"))
+        if coll is not None:
+            data[coll] = f
+            continue
+        coll = _collection_name(f, root, (".metadata.json", ".metadata.json.gz"))
+        if coll is not None:
+            meta[coll] = f
+
+    errors: list[str] = []
+    warnings: list[str] = []
+    collections: dict[str, dict] = {}
+    if not data and not meta:
+        errors.append("нет файлов BSON/metadata")
+
+    for coll, f in sorted(meta.items()):
+        try:
+            is_view = _read_metadata(f).get("type") == "view"
+        except (OSError, ValueError) as e:
+            errors.append(f"{coll}: не читается {f.name}: {e}")
+            continue
+        if is_view:
+            collections[coll] = {"view": True}
+            if coll in data and data[coll].stat().st_size > 0:
+                errors.append(f"{coll}: представление, но есть данные {data[coll].name}")
+        elif coll not in data:
+            errors.append(f"{coll}: есть {f.name}, но нет файла данных .bson")
+    for coll in sorted(set(data) - set(meta)):
+        if coll != "oplog":  # oplog.bson (--oplog) пишется без метаданных
+            warnings.append(f"{coll}: нет файла метаданных")
+
+    # Крупные файлы первыми: время проверки определяет самая большая коллекция
+    todo = sorted((c for c in data if not collections.get(c, {}).get("view")), key=lambda c: -data[c].stat().st_size)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            results = list(pool.map(scan_file, [str(data[c]) for c in todo]))
+    else:
+        results = [scan_file(data[c]) for c in todo]
+
+    total_bytes = 0
+    for coll, res in zip(todo, results):
+        if "error" in res:
+            errors.append(f"{coll}: {res['error']}")
+            collections[coll] = {"error": res["error"]}
+            continue
+        collections[coll] = {"docs": res["docs"], "bytes": res["bytes"], "seconds": res["seconds"]}
+        total_bytes += res["bytes"]
+    elapsed = max(time.monotonic() - started, 1e-6)
+    return {
+        "path": str(root),
+        "collections": dict(sorted(collections.items())),
+        "docs": sum(c.get("docs", 0) for c in collections.values()),
+        "bytes": total_bytes,
+        "errors": errors,
+        "warnings": warnings,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(total_bytes / elapsed / 1e6, 1),
+    }
+
+
+def _decode_flat(doc: bytes) -> dict:
+    """Плоский BSON-документ (заголовки архива): строки, bool, целые, double; вложенные документы — None."""
+    out: dict = {}
+    pos, end = 4, len(doc) - 1
+    try:
+        while pos < end:
+            t = doc[pos]
+            nul = doc.index(b"\x00", pos + 1)
+            name = doc[pos + 1:nul].decode(errors="replace")
+            pos = nul + 1
+            if t == 0x02:
+                n = _INT32.unpack_from(doc, pos)[0]
+                out[name] = doc[pos + 4:pos + 3 + n].decode(errors="replace")
+                pos += 4 + n
+            elif t == 0x08:
+                out[name] = doc[pos] != 0
+                pos += 1
+            elif t == 0x10:
+                out[name] = _INT32.unpack_from(doc, pos)[0]
+                pos += 4
+            elif t in (0x12, 0x11, 0x09):
+                out[name] = struct.unpack_from("<q", doc, pos)[0]
+                pos += 8
+            elif t == 0x01:
+                out[name] = struct.unpack_from("<d", doc, pos)[0]
+                pos += 8
+            elif t in (0x03, 0x04):
+                out[name] = None
+                pos += _INT32.unpack_from(doc, pos)[0]
+            elif t == 0x0A:
+                out[name] = None
+            else:
+                raise BsonError(f"неожиданный тип 0x{t:02x} в заголовке архива")
+    except (ValueError, struct.error, IndexError) as e:
+        raise BsonError(f"повреждён заголовок архива: {e}") from None
+    return out
+
+
+class _ArchiveReader:
+    """Буферизованное чтение распакованного потока архива с учётом смещения."""
+
+    def __init__(self, f) -> None:
+        self._f = f
+        self._buf = b""
+        self._pos = 0
+        self.offset = 0
+
+    def read(self, n: int) -> bytes:
+        """n байт или меньше — только в конце потока."""
+        while len(self._buf) - self._pos < n:
+            chunk = self._f.read(STREAM_BUFFER)
+            if not chunk:
+                break
+            self._buf = self._buf[self._pos:] + chunk
+            self._pos = 0
+        out = self._buf[self._pos:self._pos + n]
+        self._pos += len(out)
+        self.offset += len(out)
+        return out
+
+    def block(self) -> bytes | None:
+        """Следующий документ целиком; None — терминатор; b"" — конец потока на границе."""
+        head = self.read(4)
+        if not head:
+            return b""
+        if len(head) < 4:
+            raise BsonError(f"архив обрезан на смещении {self.offset - len(head)}")
+        size = _INT32.unpack(head)[0]
+        if size == _TERMINATOR:
+            return None
+        if size < 5 or size > MAX_DOC:
+            raise BsonError(f"неверная длина документа {size} на смещении {self.offset - 4}")
+        body = self.read(size - 4)
+        if len(body) < size - 4:
+            raise BsonError(f"архив обрезан: неполный документ на смещении {self.offset - len(body) - 4}")
+        if body[-1] != 0 or body[0] not in _ELEMENT_TYPES:
+            raise BsonError(f"повреждён документ на смещении {self.offset - size} (длина {size})")
+        return head + body
+
+
+def validate_archive(path: str | Path) -> dict:
+    """
+    Проверка архива mongodump --archive (сжатого любым кодеком backup_codecs). Отчёт — как у validate_dump.
+    Пролог: сигнатура, заголовок (версии), метаданные коллекций, терминатор. Тело: блоки «заголовок коллекции,
+    документы, терминатор»; последний блок коллекции — заголовок с EOF. Каждая коллекция пролога должна
+    завершиться, документы без метаданных в прологе — ошибка (кроме oplog).
+    """
+    path = Path(path)
+    if not path.is_file():
+        raise BsonError(f"файл не найден: {path}")
+    started = time.monotonic()
+    errors: list[str] = []
+    warnings: list[str] = []
+    collections: dict[str, dict] = {}
+    with codecs.open_reader(path) as f:
+        r = _ArchiveReader(f)
+        magic = r.read(4)
+        if len(magic) < 4 or struct.unpack("<I", magic)[0] != ARCHIVE_MAGIC:
+            raise BsonError("нет сигнатуры архива mongodump")
+        header = r.block()
+        if not header:
+            raise BsonError("нет заголовка архива")
+        header = _decode_flat(header)
+        while True:
+            doc = r.block()
+            if doc is None:
+                break
+            if not doc:
+                raise BsonError("архив обрезан в прологе")
+            meta = _decode_flat(doc)
+            ns = f"{meta.get('db')}.{meta.get('collection')}"
+            view = meta.get("type") == "view"
+            collections[ns] = {"view": True} if view else {"docs": 0, "bytes": 0, "done": False}
+
+        current = None
+        while True:
+            doc = r.block()
+            if doc == b"":
+                if current is not None:
+                    raise BsonError(f"архив обрезан: блок {current} без терминатора")
+                break
+            if doc is None:
+                if current is None:
+                    raise BsonError(f"терминатор без заголовка блока на смещении {r.offset - 4}")
+                current = None
+                continue
+            if current is None:
+                ns_header = _decode_flat(doc)
+                current = f"{ns_header.get('db')}.{ns_header.get('collection')}"
+                c = collections.get(current)
+                if c is None:
+                    if ns_header.get("collection") != "oplog":
+                        errors.append(f"{current}: данные без метаданных в прологе")
+                    c = collections[current] = {"docs": 0, "bytes": 0, "done": False}
+                if c.get("view"):
+                    errors.append(f"{current}: представление, но в архиве есть данные")
+                    c.update(docs=0, bytes=0, done=False)
+                    c.pop("view")
+                if ns_header.get("EOF"):
+                    if c["done"]:
+                        errors.append(f"{current}: повторный конец коллекции")
+                    c["done"] = True
+                elif c["done"]:
+                    errors.append(f"{current}: данные после конца коллекции")
+                continue
+            c = collections[current]
+            c["docs"] += 1
+            c["bytes"] += len(doc)
+
+    for ns, c in collections.items():
+        if not c.get("view") and not c.pop("done"):
+            errors.append(f"{ns}: нет конца коллекции (архив обрезан?)")
+    total_bytes = sum(c.get("bytes", 0) for c in collections.values())
+    elapsed = max(time.monotonic() - started, 1e-6)
+    if not collections:
+        warnings.append("в архиве нет коллекций")
+    return {
+        "path": str(path),
+        "format": "archive",
+        "server_version": header.get("server_version"),
+        "tool_version": header.get("tool_version"),
+        "collections": dict(sorted(collections.items())),
+        "docs": sum(c.get("docs", 0) for c in collections.values()),
+        "bytes": total_bytes,
+        "archive_bytes": r.offset,
+        "errors": errors,
+        "warnings": warnings,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(r.offset / elapsed / 1e6, 1),
+    }
+
+
+def validate(path: str | Path, workers: int = 0) -> dict:
+    """Каталог mongodump — validate_dump, файл (архив) — validate_archive."""
+    return validate_dump(path, workers) if Path(path).is_dir() else validate_archive(path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Потоковая проверка каталога или архива mongodump (разметка BSON)")
+    parser.add_argument("path", help="Каталог mongodump или файл архива (--archive)")
+    parser.add_argument("--workers", type=int, default=0, help="Процессов (по умолчанию — число CPU)")
+    parser.add_argument("--json", action="store_true", help="Отчёт в JSON")
+    args = parser.parse_args()
+
+    try:
+        report = validate(args.path, args.workers)
+    except (BsonError, OSError) as e:
+        log(f"Ошибка: {e}")
+        return 1
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for coll, c in report["collections"].items():
+            if c.get("view"):
+                print(f"  {coll}: представление")
+            elif "docs" in c:
+                print(f"  {coll}: документов {c['docs']}, {c['bytes']} байт" + (f", {c['seconds']} с" if "seconds" in c else ""))
+        for w in report["warnings"]:
+            log(f"[WARN] {w}")
+        for e in report["errors"]:
+            log(f"[ERROR] {e}")
+        print(f"Итого: документов {report['docs']}, {report['bytes']} байт, {report['seconds']} с, "
+              f"{report['mb_per_s']} МБ/с")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
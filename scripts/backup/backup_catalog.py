@@ -0,0 +1,238 @@
+# Каталог бэкапов: SQLite-файл рядом с бэкапами (.backup_catalog.sqlite). Каждый backup_*.py записывает
+# туда артефакт (тип, источник, размер, контрольная сумма, длительность, время). Ротация считается
+# индексными запросами вместо обхода каталога и stat() каждого файла (на NFS с десятками тысяч файлов
+# это минуты). reconcile — сверка каталога с диском.
+from __future__ import annotations
+
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+from backup_common import CATALOG_NAME, SIDECAR_SUFFIX, log, read_sidecar, remove_artifact
+
+# Удаление пачками: файлы пачки удаляются, затем их строки — одной транзакцией
+DELETE_BATCH = 500
+
+# Имя артефакта: prefix_YYYY-MM-DD_HH-MM[suffix] (см. backup_common.dated_path)
+_NAME_RE = re.compile(r"^(?P<prefix>.+_)(?P<stamp>\d{4}-\d{2}-\d{2}_\d{2}-\d{2})")
+_TYPES = (("pg_", "pg"), ("mysql_", "mysql"), ("mongo_", "mongo"), ("redis_", "redis"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    name TEXT PRIMARY KEY,
+    type TEXT,
+    source TEXT,
+    size INTEGER,
+    checksum TEXT,
+    duration REAL,
+    started REAL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_artifacts_finished ON artifacts(finished);
+"""
+
+
+def artifact_type(name: str) -> str | None:
+    for prefix, t in _TYPES:
+        if name.startswith(prefix):
+            return t
+    return None
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+def _prefix_range(prefix: str) -> tuple[str, str]:
+    """Диапазон имён с префиксом prefix для индекса: name >= lo AND name < hi."""
+    if not prefix:
+        return "", "\U0010ffff"
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def catalog_path(directory: str | Path) -> Path:
+    return Path(directory) / CATALOG_NAME
+
+
+def has_catalog(directory: str | Path) -> bool:
+    return catalog_path(directory).is_file()
+
+
+def open_catalog(directory: str | Path) -> sqlite3.Connection:
+    """Открыть (создать) каталог. Новый каталог сразу заполняется по текущему содержимому директории."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    is_new = not has_catalog(directory)
+    # journal_mode по умолчанию (DELETE): WAL на NFS не работает
+    conn = sqlite3.connect(str(catalog_path(directory)), timeout=60)
+    conn.executescript(_SCHEMA)
+    if is_new:
+        reconcile(directory, conn)
+    return conn
+
+
+def register(
+    directory: str | Path,
+    path: str | Path,
+    source: str | None = None,
+    started: float | None = None,
+    checksum: str | None = None,
+) -> None:
+    """
+    Записать готовый артефакт в каталог. Контрольная сумма по умолчанию берётся из манифеста артефакта.
+    Ошибки каталога не валят бэкап — только лог.
+    """
+    path = Path(path)
+    finished = time.time()
+    if checksum is None:
+        manifest = read_sidecar(path)
+        if manifest and "digest" in manifest:
+            checksum = f"{manifest['algorithm']}:{manifest['digest']}"
+    try:
+        conn = open_catalog(directory)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (name, type, source, size, checksum, duration, started, finished) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path.name,
+                    artifact_type(path.name),
+                    source,
+                    _size(path),
+                    checksum,
+                    finished - started if started else None,
+                    started,
+                    finished,
+                ),
+            )
+        conn.close()
+    except (OSError, sqlite3.Error) as e:
+        log(f"Ошибка записи в каталог бэкапов {directory}: {e}")
+
+
+def _delete_names(directory: Path, conn: sqlite3.Connection, names: list[str]) -> int:
+    """Удалить артефакты с диска и из каталога пачками. Возвращает количество удалённых."""
+    deleted = 0
+    for i in range(0, len(names), DELETE_BATCH):
+        batch = names[i:i + DELETE_BATCH]
+        done = []
+        for name in batch:
+            f = directory / name
+            try:
+                log(f"Ротация: удаление {f}")
+                remove_artifact(f)
+                done.append(name)
+            except FileNotFoundError:
+                done.append(name)
+            except OSError as e:
+                log(f"Ошибка удаления {f}: {e}")
+        with conn:
+            conn.executemany("DELETE FROM artifacts WHERE name = ?", [(n,) for n in done])
+        deleted += len(done)
+    return deleted
+
+
+def _select(conn: sqlite3.Connection, prefix: str, where: str = "", params: tuple = ()) -> list[tuple[str, float]]:
+    lo, hi = _prefix_range(prefix)
+    sql = f"SELECT name, finished FROM artifacts WHERE name >= ? AND name < ? {where} ORDER BY finished DESC"
+    return conn.execute(sql, (lo, hi) + params).fetchall()
+
+
+def rotate_by_days(directory: str | Path, prefix: str, days: int) -> int:
+    """Удалить артефакты с префиксом prefix, завершённые раньше чем days дней назад."""
+    if days <= 0:
+        return 0
+    directory = Path(directory)
+    conn = open_catalog(directory)
+    try:
+        rows = _select(conn, prefix, "AND finished < ?", (time.time() - days * 86400,))
+        return _delete_names(directory, conn, [name for name, _ in rows])
+    finally:
+        conn.close()
+
+
+def rotate_keep_n(directory: str | Path, prefix: str, keep: int) -> int:
+    """Оставить последние keep артефактов с префиксом prefix."""
+    if keep <= 0:
+        return 0
+    directory = Path(directory)
+    conn = open_catalog(directory)
+    try:
+        rows = _select(conn, prefix)
+        return _delete_names(directory, conn, [name for name, _ in rows[keep:]])
+    finally:
+        conn.close()
+
+
+def gfs_keep_set(rows: list[tuple[str, float]], daily: int, weekly: int, monthly: int) -> set[str]:
+    """
+    Дед-отец-сын: самый свежий артефакт каждого из последних daily дней, weekly недель (ISO) и monthly месяцев.
+    rows — (имя, время завершения), от новых к старым.
+    """
+    keep: set[str] = set()
+    for limit, key in (
+        (daily, lambda d: d.strftime("%Y-%m-%d")),
+        (weekly, lambda d: "%d-W%02d" % d.isocalendar()[:2]),
+        (monthly, lambda d: d.strftime("%Y-%m")),
+    ):
+        if limit <= 0:
+            continue
+        seen: set[str] = set()
+        for name, finished in rows:
+            period = key(datetime.fromtimestamp(finished))
+            if period in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.add(period)
+            keep.add(name)
+    return keep
+
+
+def rotate_gfs(directory: str | Path, prefix: str, daily: int, weekly: int, monthly: int) -> int:
+    """Ротация по политике дед-отец-сын: всё, что не попало ни в одну из корзин, удаляется."""
+    directory = Path(directory)
+    conn = open_catalog(directory)
+    try:
+        rows = _select(conn, prefix)
+        keep = gfs_keep_set(rows, daily, weekly, monthly)
+        return _delete_names(directory, conn, [name for name, _ in rows if name not in keep])
+    finally:
+        conn.close()
+
+
+def reconcile(directory: str | Path, conn: sqlite3.Connection | None = None) -> tuple[int, int]:
+    """
+    Сверка с диском: строки без файла удаляются, артефакты на диске без строки добавляются
+    (время — mtime, тип — по префиксу имени). Возвращает (добавлено, удалено).
+    """
+    directory = Path(directory)
+    own = conn is None
+    if own:
+        conn = open_catalog(directory)
+    try:
+        known = {name for (name,) in conn.execute("SELECT name FROM artifacts")}
+        on_disk = {}
+        for f in directory.iterdir():
+            if f.name.startswith(".") or f.name.endswith(SIDECAR_SUFFIX) or not _NAME_RE.match(f.name):
+                continue
+            try:
+                st = f.stat()
+                on_disk[f.name] = (artifact_type(f.name), _size(f), st.st_mtime)
+            except OSError:
+                continue
+        added = [(n, t, s, m) for n, (t, s, m) in on_disk.items() if n not in known]
+        missing = [(n,) for n in known if n not in on_disk]
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO artifacts (name, type, size, finished) VALUES (?, ?, ?, ?)", added)
+            conn.executemany("DELETE FROM artifacts WHERE name = ?", missing)
+    finally:
+        if own:
+            conn.close()
+    if added or missing:
+        log(f"Каталог {directory}: добавлено {len(added)}, удалено записей без файла {len(missing)}")
+    return len(added), len(missing)
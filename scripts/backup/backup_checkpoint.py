@@ -0,0 +1,104 @@
+# Журнал контрольных точек долгих бэкапов (--resume): JSON lines, первая строка — план запуска (что выгружать,
+# кодек, снимок), дальше по строке на готовую единицу (кусок таблицы, БД, файл схемы) с размером и SHA-256.
+# Строка пишется после fsync данных единицы и каталога и сама fsync-ается: после сбоя или перезагрузки
+# журнал отражает только то, что уже лежит на диске. Оборванная последняя строка (сбой посреди записи)
+# отбрасывается. Повторный запуск с --resume читает план и готовые единицы, сверяет их с диском (размер,
+# контрольная сумма) и выгружает только остальное; единица, не прошедшая сверку, выгружается заново.
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+from backup_common import DEFAULT_CHECKSUM, hash_file, log
+
+JOURNAL_NAME = "checkpoint.jsonl"
+
+
+def fsync_dir(path: Path) -> None:
+    """fsync каталога: запись о новом файле (rename, create) переживает сбой питания."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def partials(directory: Path, prefix: str, suffix: str) -> list[Path]:
+    """Незавершённые артефакты .<prefix><дата><suffix>.tmp в directory (старые первыми)."""
+    pattern = re.compile(rf"^\.{re.escape(prefix)}\d{{4}}-\d{{2}}-\d{{2}}_\d{{2}}-\d{{2}}{re.escape(suffix)}\.tmp$")
+    if not directory.is_dir():
+        return []
+    return sorted(p for p in directory.iterdir() if pattern.match(p.name))
+
+
+def load(path: str | Path) -> tuple[dict | None, dict[str, dict]]:
+    """(план, {ключ единицы: запись}) из журнала; нет журнала — (None, {})."""
+    path = Path(path)
+    if not path.is_file():
+        return None, {}
+    plan = None
+    done: dict[str, dict] = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # оборванная запись — сбой посреди строки
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if "plan" in entry:
+                plan = entry["plan"]
+            elif "key" in entry:
+                done[entry["key"]] = entry
+    return plan, done
+
+
+class Journal:
+    """Дозапись в журнал из нескольких потоков; каждая строка — fsync."""
+
+    def __init__(self, path: str | Path, plan: dict | None = None) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._f = open(self.path, "ab")
+        if plan is not None:
+            self._write({"plan": plan})
+            fsync_dir(self.path.parent)
+
+    def _write(self, entry: dict) -> None:
+        with self._lock:
+            self._f.write(json.dumps(entry, ensure_ascii=False).encode() + b"\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def done(self, key: str, **info) -> None:
+        """Единица key готова и уже на диске (файл и каталог прошли fsync)."""
+        self._write({"key": key, **info})
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def verify(base: Path, done: dict[str, dict]) -> dict[str, dict]:
+    """
+    Готовые единицы, чьи файлы (запись "file" — путь от base) на месте, того же размера и с той же контрольной
+    суммой. Остальные — в лог, их надо выгрузить заново. Единицы без файла принимаются как есть.
+    """
+    ok: dict[str, dict] = {}
+    for key, entry in done.items():
+        if "file" not in entry:
+            ok[key] = entry
+            continue
+        path = base / entry["file"]
+        try:
+            digest, size = hash_file(path, entry.get("algorithm", DEFAULT_CHECKSUM))
+        except OSError:
+            log(f"Продолжение: {entry['file']} нет на диске — выгружается заново")
+            continue
+        if size != entry.get("size") or (entry.get("digest") and digest != entry["digest"]):
+            log(f"Продолжение: {entry['file']} не совпадает с журналом (размер или контрольная сумма) — выгружается заново")
+            continue
+        ok[key] = entry
+    return ok
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Кодеки сжатия для всех скриптов бэкапа: zstd, lz4, gzip, none. Запись — потоковый писатель поверх файла
+(многопоточно, где можно: zstd — модуль zstandard или утилита zstd -T, gzip — pigz -p, иначе zlib в процессе;
+lz4 — модуль lz4 или утилита lz4), чтение — файлоподобный объект или команда распаковки для pipe.
+Кодек записывается в имя артефакта суффиксом (.gz, .zst, .lz4) — verify и restore определяют его по имени,
+а при отсутствии суффикса — по сигнатуре в начале файла.
+--codec auto: образец потока (первые 8 МБ) сжимается каждым кандидатом в один поток; выбирается наилучшее
+сжатие среди тех, кто с учётом потоков (--threads) успевает за --auto-min-mbps; если не успевает никто —
+самый быстрый. Модуль без зависимостей от backup_common: его импортируют backup_common и restore_*.py.
+Использование (замер на своём файле):
+  python3 backup_codecs.py bench /backup/mysql/sample.sql [--auto-min-mbps 200] [--threads 8]
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+
+# Размер блока записи/чтения (как STREAM_BUFFER в backup_common)
+BLOCK = 1 << 20
+
+CODECS = ("zstd", "lz4", "gzip", "none")
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "lz4": ".lz4", "none": ""}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3, "lz4": 1, "none": 0}
+_MAGIC = ((b"\x1f\x8b", "gzip"), (b"\x28\xb5\x2f\xfd", "zstd"), (b"\x04\x22\x4d\x18", "lz4"))
+
+# --codec auto: кандидаты (кодек, уровень), размер образца и целевая скорость на входе, МБ/с
+AUTO_CANDIDATES = (("lz4", 1), ("zstd", 1), ("zstd", 3), ("zstd", 6), ("gzip", 1), ("gzip", 6))
+AUTO_SAMPLE = 8 << 20
+AUTO_MIN_MBPS = 100.0
+
+
+def _threads(threads: int) -> int:
+    return threads if threads > 0 else os.cpu_count() or 1
+
+
+def _module(name: str):
+    try:
+        if name == "zstd":
+            import zstandard
+            return zstandard
+        if name == "lz4":
+            import lz4.frame
+            return lz4.frame
+    except ImportError:
+        return None
+    return None
+
+
+def available(codec: str) -> bool:
+    """Есть ли чем сжимать: модуль или утилита."""
+    if codec in ("none", "gzip"):
+        return True
+    return _module(codec) is not None or shutil.which(codec) is not None
+
+
+def multithreaded(codec: str) -> bool:
+    """Масштабируется ли кодек по потокам (для оценки скорости в auto)."""
+    return codec == "zstd" or (codec == "gzip" and shutil.which("pigz") is not None)
+
+
+class _GzipWriter:
+    """Сжатие gzip в процессе (zlib), запись в открытый файл."""
+
+    def __init__(self, f, level: int) -> None:
+        self._f = f
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = формат gzip
+
+    def write(self, data: bytes) -> None:
+        out = self._z.compress(data)
+        if out:
+            self._f.write(out)
+
+    def close(self) -> None:
+        self._f.write(self._z.flush())
+
+
+class _PipeWriter:
+    """Сжатие внешней утилитой: данные в stdin, её stdout отдельный поток пишет в файл."""
+
+    def __init__(self, cmd: list[str], f) -> None:
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=BLOCK)
+        self._error: BaseException | None = None
+        self._reader = threading.Thread(target=self._drain, args=(f,), daemon=True)
+        self._reader.start()
+
+    def _drain(self, f) -> None:
+        try:
+            while True:
+                chunk = self._proc.stdout.read(BLOCK)
+                if not chunk:
+                    break
+                f.write(chunk)
+        except BaseException as e:  # передаём в close(), чтобы не потерять ошибку записи
+            self._error = e
+            self._proc.kill()
+
+    def write(self, data: bytes) -> None:
+        self._proc.stdin.write(data)
+
+    def close(self) -> None:
+        self._proc.stdin.close()
+        self._reader.join()
+        if self._error is not None:
+            raise OSError(f"ошибка записи вывода компрессора: {self._error}")
+        if self._proc.wait() != 0:
+            raise OSError(f"компрессор завершился с кодом {self._proc.returncode}")
+
+
+class _Lz4FrameWriter:
+    """lz4 через модуль lz4.frame (формат кадра, совместим с утилитой lz4)."""
+
+    def __init__(self, module, f, level: int) -> None:
+        self._f = f
+        self._c = module.LZ4FrameCompressor(compression_level=level)
+        self._f.write(self._c.begin())
+
+    def write(self, data: bytes) -> None:
+        out = self._c.compress(data)
+        if out:
+            self._f.write(out)
+
+    def close(self) -> None:
+        self._f.write(self._c.flush())
+
+
+class _PlainWriter:
+    def __init__(self, f) -> None:
+        self._f = f
+
+    def write(self, data: bytes) -> None:
+        self._f.write(data)
+
+    def close(self) -> None:
+        pass
+
+
+def open_writer(f, compress: str, level: int | None = None, threads: int = 0):
+    """
+    Писатель для кодека поверх файла f (write/close; close не закрывает f). threads — потоков сжатия, 0 — все CPU.
+    zstd: модуль zstandard или утилита zstd -T; gzip: pigz -p при threads != 1, иначе zlib; lz4: модуль или утилита.
+    """
+    if compress == "none":
+        return _PlainWriter(f)
+    if compress not in SUFFIXES:
+        raise ValueError(f"неизвестное сжатие: {compress}")
+    level = DEFAULT_LEVELS[compress] if level is None else level
+    n = _threads(threads)
+    if compress == "gzip":
+        if n > 1 and shutil.which("pigz"):
+            return _PipeWriter(["pigz", "-c", "-p", str(n), f"-{level}"], f)
+        return _GzipWriter(f, level)
+    if compress == "zstd":
+        zstandard = _module("zstd")
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=level, threads=n if n > 1 else 0).stream_writer(f, closefd=False)
+        return _PipeWriter(["zstd", "-q", "-c", f"-T{n}"] + (["--ultra"] if level > 19 else []) + [f"-{level}"], f)
+    lz4 = _module("lz4")
+    if lz4 is not None:
+        return _Lz4FrameWriter(lz4, f, level)
+    return _PipeWriter(["lz4", "-q", "-c", f"-{level}"], f)
+
+
+class _PipeReader:
+    """
+    Распаковка внешней утилитой: её stdout читается как файл; close() после EOF проверяет код выхода.
+    source — открытый файл, который подаётся утилите в stdin отдельным потоком (иначе путь — в cmd).
+    """
+
+    def __init__(self, cmd: list[str], source=None) -> None:
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if source is not None else None,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=BLOCK)
+        self._eof = False
+        if source is not None:
+            threading.Thread(target=self._feed, args=(source,), daemon=True).start()
+
+    def _feed(self, source) -> None:
+        try:
+            while True:
+                block = source.read(BLOCK)
+                if not block:
+                    break
+                self._proc.stdin.write(block)
+        except (BrokenPipeError, ValueError, OSError):
+            pass  # утилита завершилась или чтение закрыто раньше конца — ошибку покажет close()
+        finally:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+
+    def read(self, n: int = -1) -> bytes:
+        data = self._proc.stdout.read(n)
+        if not data or n < 0:
+            self._eof = True
+        return data
+
+    def close(self) -> None:
+        self._proc.stdout.close()
+        if not self._eof:
+            self._proc.kill()  # закрыли раньше конца — код выхода утилиты не важен
+        err = self._proc.stderr.read().decode(errors="replace").strip()
+        self._proc.stderr.close()
+        if self._proc.wait() != 0 and self._eof:
+            raise OSError(f"распаковка завершилась с кодом {self._proc.returncode}: {err}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def detect(path: str | Path) -> str:
+    """Кодек по суффиксу имени; без суффикса — по сигнатуре в начале файла (none, если не узнали)."""
+    name = Path(path).name
+    for codec, suffix in SUFFIXES.items():
+        if suffix and name.endswith(suffix):
+            return codec
+    try:
+        with open(path, "rb") as f:
+            head = f.read(4)
+    except (IsADirectoryError, FileNotFoundError):
+        return "none"
+    for magic, codec in _MAGIC:
+        if head.startswith(magic):
+            return codec
+    return "none"
+
+
+def strip_suffix(path: str | Path) -> Path:
+    """Путь без суффикса кодека: x.sql.zst -> x.sql."""
+    path = Path(path)
+    for suffix in SUFFIXES.values():
+        if suffix and path.name.endswith(suffix):
+            return path.with_name(path.name[: -len(suffix)])
+    return path
+
+
+def with_codec(path: str | Path, codec: str) -> Path:
+    """Путь с суффиксом кодека вместо прежнего: x.sql.gz + zstd -> x.sql.zst."""
+    base = strip_suffix(path)
+    return base.with_name(base.name + SUFFIXES[codec])
+
+
+def decompress_cmd(codec: str) -> list[str] | None:
+    """Команда распаковки stdin/файла в stdout (для pipe в mysql, psql, mongorestore); None — не сжато."""
+    if codec == "gzip":
+        return ["pigz", "-d", "-c"] if shutil.which("pigz") else ["gzip", "-d", "-c"]
+    if codec == "zstd":
+        return ["zstd", "-q", "-d", "-c"]
+    if codec == "lz4":
+        return ["lz4", "-q", "-d", "-c"]
+    return None
+
+
+def test_cmd(codec: str) -> list[str] | None:
+    """Команда проверки целостности сжатого файла (путь — последним аргументом)."""
+    return {"gzip": ["gzip", "-t"], "zstd": ["zstd", "-q", "-t"], "lz4": ["lz4", "-q", "-t"]}.get(codec)
+
+
+def open_reader(path: str | Path, codec: str | None = None):
+    """Файлоподобный объект (read/close, контекстный менеджер) с распакованными данными."""
+    codec = codec or detect(path)
+    if codec == "none":
+        return open(path, "rb")
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    module = _module(codec)
+    if codec == "zstd" and module is not None:
+        return module.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    if codec == "lz4" and module is not None:
+        return module.open(path, "rb")
+    return _PipeReader(decompress_cmd(codec) + [str(path)])
+
+
+def open_stream_reader(f, codec: str):
+    """
+    Распаковка из уже открытого двоичного файла f (f не закрывается). Позиция f.tell() — сколько сжатых
+    байт прочитано: по ней считают прогресс. Для none возвращается сам f.
+    """
+    if codec == "none":
+        return f
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    module = _module(codec)
+    if codec == "zstd" and module is not None:
+        return module.ZstdDecompressor().stream_reader(f, read_size=BLOCK, closefd=False)
+    if codec == "lz4" and module is not None:
+        return module.LZ4FrameFile(f, "rb")
+    return _PipeReader(decompress_cmd(codec), source=f)
+
+
+class _Counter:
+    def __init__(self) -> None:
+        self.size = 0
+
+    def write(self, data) -> None:
+        self.size += len(data)
+
+
+def benchmark(sample: bytes, codec: str, level: int) -> dict:
+    """Сжатие образца в один поток: {codec, level, ratio, mb_per_s} (скорость — по входу)."""
+    sink = _Counter()
+    started = time.perf_counter()
+    writer = open_writer(sink, codec, level, threads=1)
+    for i in range(0, len(sample), BLOCK):
+        writer.write(sample[i:i + BLOCK])
+    writer.close()
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    return {
+        "codec": codec,
+        "level": level,
+        "ratio": round(len(sample) / max(sink.size, 1), 3),
+        "mb_per_s": round(len(sample) / elapsed / 1e6, 1),
+    }
+
+
+def choose(
+    sample: bytes,
+    min_mbps: float = AUTO_MIN_MBPS,
+    threads: int = 0,
+    candidates=AUTO_CANDIDATES,
+) -> tuple[str, int, list[dict]]:
+    """
+    --codec auto: (кодек, уровень, замеры). Скорость многопоточных кодеков оценивается как замер в один поток,
+    умноженный на число потоков: на образце в 8 МБ многопоточный zstd не успевает разогнаться.
+    """
+    if not sample:
+        return "zstd" if available("zstd") else "gzip", DEFAULT_LEVELS["zstd"], []
+    n = _threads(threads)
+    results = []
+    for codec, level in candidates:
+        if not available(codec):
+            continue
+        r = benchmark(sample, codec, level)
+        r["estimated_mb_per_s"] = round(r["mb_per_s"] * (n if multithreaded(codec) else 1), 1)
+        results.append(r)
+    fit = [r for r in results if r["estimated_mb_per_s"] >= min_mbps]
+    if fit:
+        best = max(fit, key=lambda r: (r["ratio"], r["estimated_mb_per_s"]))
+    else:
+        best = max(results, key=lambda r: r["estimated_mb_per_s"])
+    return best["codec"], best["level"], results
+
+
+def describe(codec: str, level: int, results: list[dict], min_mbps: float) -> str:
+    """Строка для лога: выбор и замеры всех кандидатов."""
+    table = ", ".join(f"{r['codec']}-{r['level']} x{r['ratio']} {r['estimated_mb_per_s']:g} МБ/с" for r in results)
+    return f"Кодек auto: {codec}-{level} (цель {min_mbps:g} МБ/с; {table})"
+
+
+def add_codec_args(parser, default: str = "gzip") -> None:
+    """--codec (он же --compress), --level, --threads, --auto-min-mbps."""
+    parser.add_argument("--codec", "--compress", dest="codec", choices=("auto",) + CODECS, default=default,
+                        help=f"Сжатие: auto (замер на образце), zstd, lz4, gzip, none (по умолчанию {default})")
+    parser.add_argument("--level", type=int, default=None, help="Уровень сжатия (gzip 1-9, zstd 1-19, lz4 1-12)")
+    parser.add_argument("--threads", type=int, default=0, help="Потоков сжатия (0 — все CPU)")
+    parser.add_argument("--auto-min-mbps", type=float, default=AUTO_MIN_MBPS,
+                        help=f"--codec auto: минимальная скорость сжатия на входе, МБ/с (по умолчанию {AUTO_MIN_MBPS:g})")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер кодеков на образце файла (как --codec auto)")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("path", help="Файл-образец (несжатый дамп или RDB)")
+    parser.add_argument("--sample", type=int, default=AUTO_SAMPLE >> 20, help="Размер образца, МБ")
+    parser.add_argument("--threads", type=int, default=0, help="Потоков сжатия (0 — все CPU)")
+    parser.add_argument("--auto-min-mbps", type=float, default=AUTO_MIN_MBPS, help="Минимальная скорость, МБ/с")
+    args = parser.parse_args()
+
+    with open_reader(args.path) as f:
+        sample = f.read(args.sample << 20)
+    codec, level, results = choose(sample, args.auto_min_mbps, args.threads)
+    print(json.dumps({"choice": {"codec": codec, "level": level}, "sample_bytes": len(sample), "results": results},
+                     ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,46 @@
-# Общие утилиты для скриптов бэкапа: пути с датой, ротация, вызов команд, логирование в stderr.
+# Общие утилиты для скриптов бэкапа: пути с датой, ротация, вызов команд, потоковое сжатие, логирование в stderr.
 from __future__ import annotations
 
+import errno
+import fcntl
+import hashlib
+import json
+import mmap
 import os
+import select
+import shutil
+import socket
 import subprocess
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import backup_codecs as codecs
+import backup_metrics as metrics
+from backup_codecs import open_writer
+
+# Размер блока при чтении stdout дампера и записи в файл (крупные блоки — меньше системных вызовов)
+STREAM_BUFFER = 1 << 20
+
+# Кодеки сжатия и их суффиксы — в backup_codecs.py
+COMPRESS_SUFFIXES = codecs.SUFFIXES
+
+# Манифест артефакта рядом с ним: <имя>.manifest.json (алгоритм, хеш, размер; для каталога — по файлам)
+SIDECAR_SUFFIX = ".manifest.json"
+CHECKSUM_ALGOS = ("sha256", "blake2b")
+DEFAULT_CHECKSUM = "sha256"
+
+# SQLite-каталог бэкапов (backup_catalog.py) в каталоге назначения
+CATALOG_NAME = ".backup_catalog.sqlite"
+
+# ioctl FICLONE (linux/fs.h): reflink — файл-копия делит блоки с исходным (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+# Ошибки «способ не поддерживается здесь» — переходим к следующему способу копирования
+_COPY_FALLBACK_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.EBADF}
+
 
 def dated_path(directory: str | Path, prefix: str, suffix: str) -> Path:
     """Путь к файлу бэкапа: directory/prefix_YYYY-MM-DD_HH-MM suffix."""
@@ -17,15 +50,18 @@ def dated_path(directory: str | Path, prefix: str, suffix: str) -> Path:
     return directory / f"{prefix}_{stamp}{suffix}"
 
 
-def run(cmd: list[str], env: dict | None = None, log_prefix: str = "") -> int:
-    """Запуск команды. Логирует команду в stderr. Возвращает код выхода."""
+def run(cmd: list[str], env: dict | None = None, log_prefix: str = "", timeout: float | None = None) -> int:
+    """
+    Запуск команды. Логирует команду в stderr. Возвращает код выхода.
+    timeout — предел, с; None или 0 — без ограничения (дамп большой БД идёт часами).
+    """
     full_env = os.environ.copy()
     if env:
         full_env.update(env)
     msg = f"{log_prefix}Выполняется: {' '.join(cmd)}"
     print(msg, file=sys.stderr)
     try:
-        r = subprocess.run(cmd, env=full_env, timeout=3600)
+        r = subprocess.run(cmd, env=full_env, timeout=timeout or None)
         return r.returncode
     except subprocess.TimeoutExpired:
         print("Ошибка: таймаут команды", file=sys.stderr)
@@ -38,39 +74,668 @@ def run(cmd: list[str], env: dict | None = None, log_prefix: str = "") -> int:
         return -1
 
 
+def run_capture(cmd: list[str], env: dict | None = None, timeout: int = 60) -> tuple[int, str]:
+    """Запуск команды с захватом stdout (для коротких запросов: список БД, INFO и т.п.). Возвращает (код, stdout)."""
+    full_env = os.environ.copy()
+    if env:
+        full_env.update(env)
+    try:
+        r = subprocess.run(cmd, env=full_env, capture_output=True, text=True, timeout=timeout)
+        if r.returncode != 0 and r.stderr:
+            print(r.stderr.strip(), file=sys.stderr)
+        return (r.returncode, r.stdout or "")
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return (-1, "")
+
+
 def log(msg: str) -> None:
     print(msg, file=sys.stderr)
 
 
+class _HashingFile:
+    """
+    Обёртка над файлом: всё, что пишется, одновременно хешируется и считается (один проход).
+    tee — второй получатель тех же байт (потоковая загрузка в S3, backup_s3.MultipartUpload).
+    """
+
+    def __init__(self, f, algo: str, tee=None) -> None:
+        self._f = f
+        self._tee = tee
+        self.hasher = hashlib.new(algo)
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.hasher.update(data)
+        self.size += len(data)
+        if self._tee is not None:
+            self._tee.write(data)
+        return self._f.write(data)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+
+class Throttle:
+    """
+    Ограничение скорости потока (token bucket), байт/с. consume(n) спит, если поток обгоняет лимит.
+    С probe (функция -> задержка источника в секундах или None; QueryProbe, tcp_probe) лимит подстраивается
+    раз в interval секунд (AIMD): задержка выше базовой вдвое (или нет ответа) — лимит пополам, иначе +10% от максимума.
+    """
+
+    def __init__(self, rate: float, probe=None, interval: float = 1.0, log_prefix: str = "") -> None:
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = max(self.max_rate * 0.05, 64 * 1024)
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()  # один лимит на несколько потоков (mysql --parallel)
+        self._log_prefix = log_prefix
+        self._stop = threading.Event()
+        self._probe = probe
+        self._thread = None
+        if probe is not None:
+            self._thread = threading.Thread(target=self._adapt, args=(interval,), daemon=True)
+            self._thread.start()
+
+    def consume(self, n: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            burst = self.rate / 4  # не больше четверти секунды вперёд
+            self._tokens = min(burst, self._tokens + (now - self._last) * self.rate) - n
+            self._last = now
+            debt = -self._tokens
+        if debt > 0:
+            time.sleep(debt / self.rate)
+
+    def _adapt(self, interval: float) -> None:
+        baseline = None
+        smoothed = None
+        while not self._stop.wait(interval):
+            rtt = self._probe()
+            if self._stop.is_set():
+                return  # close() во время пробы: сессия пробы уже закрыта
+            if rtt is not None:
+                baseline = rtt if baseline is None else min(baseline, rtt)
+                smoothed = rtt if smoothed is None else 0.7 * smoothed + 0.3 * rtt
+            congested = rtt is None or smoothed > max(baseline * 2, baseline + 0.005)
+            if congested:
+                rate = max(self.min_rate, self.rate / 2)
+                if rate < self.rate:
+                    log(f"{self._log_prefix}Задержка источника {_fmt_ms(smoothed)} (база {_fmt_ms(baseline)}): "
+                        f"лимит {rate / 1e6:.1f} МБ/с")
+                self.rate = rate
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+    def close(self) -> None:
+        self._stop.set()
+        close = getattr(self._probe, "close", None)
+        if close is not None:
+            close()
+
+
+def _fmt_ms(seconds: float | None) -> str:
+    return "нет ответа" if seconds is None else f"{seconds * 1000:.1f} мс"
+
+
+def tcp_probe(host: str, port: int, timeout: float = 1.0):
+    """
+    Проба задержки источника: время установки соединения с host:port (без авторизации). None — нет ответа.
+    host, начинающийся с "/", — путь к unix-сокету.
+    """
+
+    def probe() -> float | None:
+        started = time.monotonic()
+        try:
+            if host.startswith("/"):
+                with socket.socket(socket.AF_UNIX) as sock:
+                    sock.settimeout(timeout)
+                    sock.connect(host)
+            else:
+                socket.create_connection((host, int(port)), timeout=timeout).close()
+        except OSError:
+            return None
+        return time.monotonic() - started
+
+    return probe
+
+
+class QueryProbe:
+    """
+    Проба задержки источника: время тривиального запроса (SELECT '<метка>') в постоянной сессии клиента
+    (psql, mysql — cmd читает запросы из stdin). В отличие от TCP-соединения, которое завершает ядро,
+    ответ запроса замедляется, когда сервер упирается в диск или CPU. Нет ответа за timeout — None
+    (перегрузка); опоздавший ответ отбрасывается по метке. Клиент не запустился или завершился — дальше
+    fallback (tcp_probe).
+    """
+
+    def __init__(self, cmd: list[str], env: dict | None = None, fallback=None, timeout: float = 1.0,
+                 log_prefix: str = "") -> None:
+        self._fallback = fallback
+        self._timeout = timeout
+        self._log_prefix = log_prefix
+        self._token = os.urandom(6).hex()
+        self._seq = 0
+        self._buf = b""
+        self._failed = False
+        try:
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, env={**os.environ, **(env or {})}, bufsize=0)
+        except OSError as e:
+            self._proc = None
+            self._fail(str(e))
+
+    def _fail(self, reason: str) -> float | None:
+        if not self._failed:
+            log(f"{self._log_prefix}Проба запросом недоступна ({reason}) — время TCP-соединения")
+        self._failed = True
+        self.close()
+        return self._fallback() if self._fallback is not None else None
+
+    def __call__(self) -> float | None:
+        if self._failed:
+            return self._fallback() if self._fallback is not None else None
+        self._seq += 1
+        marker = f"probe-{self._token}-{self._seq}".encode()
+        started = time.monotonic()
+        try:
+            self._proc.stdin.write(b"SELECT '" + marker + b"';\n")
+        except OSError as e:
+            return self._fail(str(e))
+        fd = self._proc.stdout.fileno()
+        while True:
+            while b"\n" in self._buf:
+                line, _, self._buf = self._buf.partition(b"\n")
+                if line.strip() == marker:
+                    return time.monotonic() - started
+            left = started + self._timeout - time.monotonic()
+            if left <= 0 or not select.select([fd], [], [], left)[0]:
+                return None
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                return self._fail(f"клиент завершился с кодом {self._proc.wait()}")
+            self._buf += chunk
+
+    def close(self) -> None:
+        self._failed = True
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+
+def _block_device(path: str | Path) -> str | None:
+    """MAJ:MIN диска (не раздела), на котором лежит path, — формат io.max/io.weight."""
+    st = os.stat(path)
+    dev = f"{os.major(st.st_dev)}:{os.minor(st.st_dev)}"
+    sys_dev = Path("/sys/dev/block") / dev
+    if not sys_dev.exists():
+        return None
+    if (sys_dev / "partition").exists():
+        return (sys_dev.resolve().parent / "dev").read_text().strip()
+    return dev
+
+
+def setup_io_cgroup(name: str, dest: str | Path, max_mbps: float = 0, weight: int = 0) -> Path | None:
+    """
+    cgroup v2 для дочерних процессов бэкапа: io.max (rbps/wbps на диск каталога dest) и io.weight.
+    Нужны права на /sys/fs/cgroup. При ошибке — лог и None (бэкап идёт без cgroup).
+    """
+    root = Path("/sys/fs/cgroup")
+    cg = root / name
+    try:
+        if not (root / "cgroup.controllers").exists():
+            raise OSError("cgroup v2 не смонтирована")
+        cg.mkdir(exist_ok=True)
+        if "io" not in (cg / "cgroup.controllers").read_text().split():
+            (root / "cgroup.subtree_control").write_text("+io")
+        if max_mbps > 0:
+            dev = _block_device(dest)
+            if dev is None:
+                raise OSError(f"не найдено блочное устройство для {dest}")
+            bps = int(max_mbps * 1e6)
+            (cg / "io.max").write_text(f"{dev} rbps={bps} wbps={bps}")
+        if weight > 0:
+            (cg / "io.weight").write_text(f"default {weight}")
+    except OSError as e:
+        log(f"cgroup {cg} не настроена ({e}) — продолжаем без неё")
+        return None
+    return cg
+
+
+def io_prefix(ionice: str | None = None, cgroup: Path | None = None) -> list[str]:
+    """
+    Префикс команды дампера: перевод в cgroup (до exec, так что все его потомки тоже там) и ionice.
+    ionice: "idle" или "best-effort:N" (N 0-7, 7 — самый низкий).
+    """
+    prefix: list[str] = []
+    if cgroup is not None:
+        prefix += ["sh", "-c", f'echo $$ > {cgroup / "cgroup.procs"} && exec "$@"', "sh"]
+    if ionice and shutil.which("ionice"):
+        if ionice == "idle":
+            prefix += ["ionice", "-c3"]
+        else:
+            level = ionice.partition(":")[2] or "7"
+            prefix += ["ionice", "-c2", f"-n{level}"]
+    elif ionice:
+        log("ionice не найден — приоритет ввода-вывода не задан")
+    return prefix
+
+
+def add_io_args(parser) -> None:
+    """Общие аргументы ограничения нагрузки на источник и диск (MySQL, PostgreSQL)."""
+    parser.add_argument("--max-rate", type=float, default=0, help="Лимит потока дампа, МБ/с (0 — без лимита)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="С --max-rate: снижать лимит, когда растёт время SELECT на сервере БД "
+                             "(постоянная сессия клиента; без неё — время TCP-соединения)")
+    parser.add_argument("--ionice", default=None, help="Приоритет ввода-вывода дампера: idle или best-effort:0-7")
+    parser.add_argument("--io-max", type=float, default=0,
+                        help="cgroup v2 io.max для дампера на диске --dest, МБ/с (нужны права на /sys/fs/cgroup)")
+    parser.add_argument("--io-weight", type=int, default=0, help="cgroup v2 io.weight дампера (1-10000)")
+
+
+def io_setup(args, dest: Path, host: str | None, port, name: str, probe_cmd: list[str] | None = None,
+             env: dict | None = None) -> tuple[list[str], Throttle | None]:
+    """
+    По аргументам add_io_args: (префикс команды, Throttle или None).
+    probe_cmd — клиент БД для QueryProbe (--adaptive); без него или при его сбое — tcp_probe(host, port).
+    """
+    cgroup = None
+    if args.io_max > 0 or args.io_weight > 0:
+        cgroup = setup_io_cgroup(f"backup-{name}", dest, args.io_max, args.io_weight)
+    throttle = None
+    if args.max_rate > 0:
+        probe = None
+        if args.adaptive:
+            probe = tcp_probe(host or "localhost", int(port))
+            if probe_cmd:
+                probe = QueryProbe(probe_cmd, env, fallback=probe, log_prefix=f"[{name}] ")
+        throttle = Throttle(args.max_rate * 1e6, probe, log_prefix=f"[{name}] ")
+        how = "времени SELECT" if probe_cmd else "RTT"
+        log(f"Лимит потока {args.max_rate:g} МБ/с" + (f", адаптивный по {how} до {host or 'localhost'}:{port}" if probe else ""))
+    elif args.adaptive:
+        log("--adaptive без --max-rate не действует")
+    return io_prefix(args.ionice, cgroup), throttle
+
+
+def _read_sample(stream, size: int, throttle: Throttle | None) -> bytes:
+    """Первые size байт потока (или всё, если он короче) — образец для --codec auto."""
+    parts = []
+    got = 0
+    while got < size:
+        chunk = stream.read(min(STREAM_BUFFER, size - got))
+        if not chunk:
+            break
+        if throttle is not None:
+            throttle.consume(len(chunk))
+        parts.append(chunk)
+        got += len(chunk)
+    return b"".join(parts)
+
+
+def stream_to_artifact(
+    cmd: list[str] | None,
+    out_path: str | Path,
+    compress: str = "gzip",
+    level: int | None = None,
+    env: dict | None = None,
+    log_prefix: str = "",
+    timeout: float | None = None,
+    checksum: str | None = DEFAULT_CHECKSUM,
+    throttle: Throttle | None = None,
+    upload=None,
+    threads: int = 0,
+    auto_min_mbps: float = codecs.AUTO_MIN_MBPS,
+    source: str | Path | None = None,
+) -> tuple[int, Path]:
+    """
+    Запуск команды, чтение её stdout блоками и сжатие на лету прямо в out_path.
+    Запись атомарная: во временный файл .<имя>.tmp, fsync, затем rename. При ошибке временный файл удаляется.
+    В том же проходе считается хеш записанных байт (checksum) и пишется манифест <имя>.manifest.json
+    (с кодеком и уровнем сжатия).
+    compress — кодек backup_codecs (threads — потоков сжатия, 0 — все CPU) или "auto": первые 8 МБ потока
+    сжимаются кандидатами, выбирается лучшее сжатие не медленнее auto_min_mbps; суффикс out_path меняется
+    на суффикс выбранного кодека. source — вместо команды читать готовый файл (Redis: копия RDB).
+    throttle — ограничение скорости чтения stdout: дампер упирается в полный pipe и читает источник медленнее.
+    timeout — предел работы команды, с (по истечении она убивается); None — без ограничения.
+    upload — потоковая загрузка (backup_s3.MultipartUpload): получает те же сжатые байты, что и файл;
+    при ошибке прерывается, после успешной записи завершается. Ошибка загрузки — код 1, локальный файл остаётся.
+    По завершении логирует байты на входе/выходе и скорость. Возвращает (код выхода, путь артефакта).
+    """
+    out_path = Path(out_path)
+    full_env = os.environ.copy()
+    if env:
+        full_env.update(env)
+    what = f"чтение {source}" if source is not None else f"Выполняется: {' '.join(cmd)}"
+    log(f"{log_prefix}{what} -> {out_path}")
+    started = time.monotonic()
+    bytes_in = 0
+    proc = None
+    try:
+        if source is not None:
+            stream = open(source, "rb", buffering=0)
+        else:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=full_env, bufsize=0)
+            stream = proc.stdout
+    except OSError as e:
+        log(f"Ошибка: команда не найдена — {e}" if source is None else f"Ошибка чтения {source}: {e}")
+        if upload is not None:
+            upload.abort()
+        return -1, out_path
+    timer = threading.Timer(timeout, proc.kill) if proc is not None and timeout else None
+    if timer is not None:
+        timer.start()
+    tmp_path = None
+    try:
+        sample = b""
+        if compress == "auto":
+            sample = _read_sample(stream, codecs.AUTO_SAMPLE, throttle)
+            bytes_in = len(sample)
+            compress, level, results = codecs.choose(sample, auto_min_mbps, threads)
+            log(f"{log_prefix}{codecs.describe(compress, level, results, auto_min_mbps)}")
+            out_path = codecs.with_codec(out_path, compress)
+            if upload is not None:
+                upload.rename(out_path.name)
+        if level is None and compress != "none":
+            level = codecs.DEFAULT_LEVELS[compress]
+        tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+        with open(tmp_path, "wb", buffering=STREAM_BUFFER) as f:
+            hashed = _HashingFile(f, checksum or DEFAULT_CHECKSUM, tee=upload)
+            writer = open_writer(hashed, compress, level, threads)
+            if sample:
+                writer.write(sample)
+            while True:
+                chunk = stream.read(STREAM_BUFFER)
+                if not chunk:
+                    break
+                bytes_in += len(chunk)
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                writer.write(chunk)
+            writer.close()
+            code = proc.wait() if proc is not None else 0
+            if code != 0:
+                timed_out = timer is not None and not timer.is_alive()
+                log(f"Ошибка: {cmd[0]} завершился с кодом {code}" + (" (таймаут)" if timed_out else ""))
+                tmp_path.unlink(missing_ok=True)
+                if upload is not None:
+                    upload.abort()
+                return (code if code > 0 else -1), out_path
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, out_path)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка записи {out_path}: {e}")
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        if upload is not None:
+            upload.abort()
+        return -1, out_path
+    finally:
+        if timer is not None:
+            timer.cancel()
+        stream.close()
+        if throttle is not None:
+            throttle.close()
+    elapsed = max(time.monotonic() - started, 1e-6)
+    bytes_out = hashed.size
+    if checksum:
+        write_sidecar(out_path, {"algorithm": checksum, "digest": hashed.hasher.hexdigest(), "size": bytes_out,
+                                 "codec": compress, "level": level})
+    metrics.add(bytes_read=bytes_in, bytes_written=bytes_out)
+    ratio = bytes_in / bytes_out if bytes_out else 0.0
+    log(
+        f"{log_prefix}Записано {out_path.name}: вход {bytes_in} байт, выход {bytes_out} байт "
+        f"(x{ratio:.2f}), {elapsed:.1f} с, {bytes_in / elapsed / 1e6:.1f} МБ/с"
+    )
+    if upload is not None:
+        try:
+            upload.close()
+        except OSError as e:
+            log(f"Ошибка выгрузки {out_path.name} в S3: {e}")
+            upload.abort()
+            return 1, out_path
+    return 0, out_path
+
+
+def stream_to_file(cmd: list[str], out_path: str | Path, compress: str = "gzip", level: int | None = None,
+                   **kwargs) -> int:
+    """stream_to_artifact с известным кодеком (путь не меняется). Возвращает код выхода."""
+    if compress == "auto":
+        raise ValueError("stream_to_file: для --codec auto нужен stream_to_artifact")
+    return stream_to_artifact(cmd, out_path, compress, level, **kwargs)[0]
+
+
+def _fadvise(fd: int, advice_name: str) -> None:
+    advice = getattr(os, advice_name, None)
+    if advice is not None and hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+
+def _copy_range(fin: int, fout: int, size: int, use_copy_file_range: bool) -> int:
+    """Копирование в ядре: copy_file_range (или sendfile) до конца файла. Возвращает скопированные байты."""
+    copied = 0
+    while copied < size:
+        if use_copy_file_range:
+            n = os.copy_file_range(fin, fout, min(size - copied, 1 << 30))
+        else:
+            n = os.sendfile(fout, fin, None, min(size - copied, 1 << 30))
+        if n == 0:
+            break  # конец раньше size (файл укоротили, ФС не поддерживает) — решает вызывающий
+        copied += n
+    return copied
+
+
+def copy_file(src: str | Path, dst: str | Path, checksum: str | None = None) -> str:
+    """
+    Копирование артефакта без прогона данных через user space, где это возможно:
+    reflink (FICLONE) -> copy_file_range -> sendfile -> буферизованное копирование.
+    Исходник помечается POSIX_FADV_DONTNEED, чтобы не вытеснять из кэша страниц рабочие данные
+    (например, самого Redis). Запись атомарная (.<имя>.tmp + rename), метаданные как у shutil.copy2.
+    С checksum пишется манифест dst: после reflink исходник один раз читается для хеша, иначе
+    копирование буферизованное с хешированием в том же проходе (данные всё равно читаются).
+    Возвращает название использованного способа. Ошибки — OSError.
+    """
+    src, dst = Path(src), Path(dst)
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    started = time.monotonic()
+    method = ""
+    with open(src, "rb", buffering=0) as fi, open(tmp, "wb", buffering=0) as fo:
+        fin, fout = fi.fileno(), fo.fileno()
+        size = os.fstat(fin).st_size
+        _fadvise(fin, "POSIX_FADV_SEQUENTIAL")
+        try:
+            try:
+                fcntl.ioctl(fout, FICLONE, fin)
+                method = "reflink"
+            except OSError as e:
+                if e.errno not in _COPY_FALLBACK_ERRNOS:
+                    raise
+            kernel_copy = () if checksum else (
+                ("copy_file_range", hasattr(os, "copy_file_range")),
+                ("sendfile", hasattr(os, "sendfile")),
+            )
+            for name, available in kernel_copy:
+                if method or not available:
+                    continue
+                try:
+                    copied = _copy_range(fin, fout, size, name == "copy_file_range")
+                    if copied == size:
+                        method = name
+                        continue
+                    log(f"{name}: скопировано {copied} из {size} байт — следующий способ")
+                except OSError as e:
+                    if e.errno not in _COPY_FALLBACK_ERRNOS:
+                        raise
+                # Частично скопированное переписываем следующим способом с начала
+                os.ftruncate(fout, 0)
+                os.lseek(fin, 0, os.SEEK_SET)
+                os.lseek(fout, 0, os.SEEK_SET)
+            hasher = hashlib.new(checksum) if checksum else None
+            if method == "reflink" and hasher is not None:
+                _hash_fd(fin, hasher)
+            elif not method:
+                buf = bytearray(STREAM_BUFFER)
+                view = memoryview(buf)
+                while True:
+                    n = fi.readinto(buf)
+                    if not n:
+                        break
+                    if hasher is not None:
+                        hasher.update(view[:n])
+                    fo.write(view[:n])
+                method = "buffered"
+            written = os.fstat(fout).st_size
+            if written != size:
+                raise OSError(f"копия {tmp.name}: {written} байт вместо {size} (способ {method}) — исходник изменился?")
+            os.fsync(fout)
+            _fadvise(fout, "POSIX_FADV_DONTNEED")
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        finally:
+            _fadvise(fin, "POSIX_FADV_DONTNEED")
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dst)
+    if hasher is not None:
+        write_sidecar(dst, {"algorithm": checksum, "digest": hasher.hexdigest(), "size": size})
+    elapsed = max(time.monotonic() - started, 1e-6)
+    metrics.add(bytes_read=size, bytes_written=size)
+    log(f"Скопировано {src} -> {dst}: {size} байт, способ {method}, {elapsed:.1f} с, {size / elapsed / 1e6:.1f} МБ/с")
+    return method
+
+
+def _hash_fd(fd: int, hasher) -> None:
+    """Хеш файла крупными последовательными чтениями через mmap (без копий в буферы Python)."""
+    size = os.fstat(fd).st_size
+    if size == 0:
+        return
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mm)
+        try:
+            for off in range(0, size, 16 * STREAM_BUFFER):
+                hasher.update(view[off:off + 16 * STREAM_BUFFER])
+        finally:
+            view.release()
+
+
+def hash_file(path: str | Path, algo: str = DEFAULT_CHECKSUM) -> tuple[str, int]:
+    """(хеш, размер) файла. Страницы после чтения отдаются обратно (POSIX_FADV_DONTNEED)."""
+    hasher = hashlib.new(algo)
+    with open(path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        _fadvise(fd, "POSIX_FADV_SEQUENTIAL")
+        _hash_fd(fd, hasher)
+        size = os.fstat(fd).st_size
+        _fadvise(fd, "POSIX_FADV_DONTNEED")
+    return hasher.hexdigest(), size
+
+
+def sidecar_path(path: str | Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + SIDECAR_SUFFIX)
+
+
+def write_sidecar(path: str | Path, manifest: dict) -> None:
+    """Записать манифест артефакта (атомарно)."""
+    manifest = dict(manifest, created=time.time())
+    side = sidecar_path(path)
+    tmp = side.with_name(f".{side.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, side)
+
+
+def read_sidecar(path: str | Path) -> dict | None:
+    try:
+        with open(sidecar_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def hash_directory(directory: str | Path, algo: str = DEFAULT_CHECKSUM, workers: int = 4) -> dict:
+    """Манифест каталога (pg_dump -Fd, mongodump): хеш и размер каждого файла, файлы хешируются параллельно."""
+    directory = Path(directory)
+    files = sorted(f for f in directory.rglob("*") if f.is_file())
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda f: hash_file(f, algo), files))
+    entries = {
+        str(f.relative_to(directory)): {"digest": digest, "size": size}
+        for f, (digest, size) in zip(files, results)
+    }
+    return {"algorithm": algo, "files": entries, "size": sum(e["size"] for e in entries.values())}
+
+
+def write_file_manifest(path: str | Path, algo: str = DEFAULT_CHECKSUM) -> None:
+    """Манифест для артефакта, который записал сам инструмент (pg_dump -f, mongodump --out)."""
+    path = Path(path)
+    if path.is_dir():
+        write_sidecar(path, hash_directory(path, algo))
+    else:
+        digest, size = hash_file(path, algo)
+        write_sidecar(path, {"algorithm": algo, "digest": digest, "size": size})
+
+
+def remove_artifact(path: Path) -> None:
+    """Удалить артефакт бэкапа: файл или каталог (pg_dump -Fd, mongodump) и его манифест."""
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+    sidecar_path(path).unlink(missing_ok=True)
+
+
 def rotate_by_days(directory: Path, prefix: str, days: int) -> None:
-    """Удалить файлы в directory с именем, начинающимся на prefix, старше days дней."""
+    """
+    Удалить файлы и каталоги в directory с именем, начинающимся на prefix, старше days дней.
+    Если рядом с бэкапами есть каталог (backup_catalog), выборка идёт по нему, без обхода директории.
+    """
     if days <= 0:
         return
+    if (Path(directory) / CATALOG_NAME).is_file():
+        import backup_catalog
+        backup_catalog.rotate_by_days(directory, prefix, days)
+        return
     now = time.time()
     cutoff = now - days * 86400
     directory = Path(directory)
     if not directory.is_dir():
         return
     for f in directory.iterdir():
-        if f.is_file() and f.name.startswith(prefix):
+        if f.name.startswith(prefix) and not f.name.endswith(SIDECAR_SUFFIX):
             try:
                 if f.stat().st_mtime < cutoff:
                     log(f"Ротация: удаление {f}")
-                    f.unlink()
+                    remove_artifact(f)
             except OSError as e:
                 log(f"Ошибка удаления {f}: {e}")
 
 
 def rotate_keep_n(directory: Path, prefix: str, keep: int) -> None:
-    """Оставить только последние keep файлов (по mtime) с именем, начинающимся на prefix; остальные удалить."""
+    """Оставить только последние keep артефактов (по mtime) с именем, начинающимся на prefix; остальные удалить."""
     if keep <= 0:
         return
+    if (Path(directory) / CATALOG_NAME).is_file():
+        import backup_catalog
+        backup_catalog.rotate_keep_n(directory, prefix, keep)
+        return
     directory = Path(directory)
     if not directory.is_dir():
         return
     candidates = []
     for f in directory.iterdir():
-        if f.is_file() and f.name.startswith(prefix):
+        if f.name.startswith(prefix) and not f.name.endswith(SIDECAR_SUFFIX):
             try:
                 candidates.append((f.stat().st_mtime, f))
             except OSError:
@@ -79,6 +744,6 @@ def rotate_keep_n(directory: Path, prefix: str, keep: int) -> None:
     for _, f in candidates[keep:]:
         try:
             log(f"Ротация: удаление {f}")
-            f.unlink()
+            remove_artifact(f)
         except OSError as e:
             log(f"Ошибка удаления {f}: {e}")
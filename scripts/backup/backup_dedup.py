@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Дедуплицирующее хранилище бэкапов: артефакт режется на чанки по содержимому (content-defined chunking,
+скользящий отпечаток по gear-таблице, нормализация как в FastCDC), уникальные чанки хранятся один раз под своим SHA-256,
+на каждый бэкап — небольшой манифест (список чанков).
+Ротация: удаление манифестов + сборка мусора (чанки без ссылок). Чтение потоковое — бэкап можно
+отдать в pg_restore/mysql через stdin, не разворачивая на диск.
+Структура: STORE/chunks/ab/abcdef... , STORE/manifests/<имя артефакта>.json, STORE/lock
+Использование:
+  python3 backup_dedup.py put --store /backup/dedup /backup/pg/pg_mydb_2025-02-11_02-00.dump [--remove]
+  python3 backup_dedup.py list --store /backup/dedup [--prefix pg_mydb_]
+  python3 backup_dedup.py cat --store /backup/dedup pg_mydb_2025-02-11_02-00.dump | pg_restore -d mydb
+  python3 backup_dedup.py get --store /backup/dedup pg_mydb_2025-02-11_02-00.dump --out /tmp/restore.dump
+  python3 backup_dedup.py rotate --store /backup/dedup --prefix pg_mydb_ --days 14
+  python3 backup_dedup.py gc --store /backup/dedup
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from backup_common import STREAM_BUFFER, log, remove_artifact
+
+# Размеры чанков: минимум / целевой средний / максимум
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK = 1024 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+
+# Скользящий хеш по gear-таблице (256 псевдослучайных 64-битных чисел, детерминированно — одинаковые
+# границы между запусками) в два этапа, чтобы основной проход шёл в C, а не побайтовым циклом Python:
+#  1) каждый байт даёт один бит отпечатка (старший бит своего gear-значения); кандидат в границы —
+#     позиция, где последние 8 бит отпечатка совпали с _PREFILTER (bytes.translate + bytes.find);
+#  2) в кандидате считается хеш окна из _WINDOW предыдущих байт (zlib.crc32); граница — если его
+#     младшие биты нулевые. До среднего размера маска строже, после — мягче (нормализация как в FastCDC).
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "little") for i in range(256)]
+_BITS = bytes(ord("1") if g >> 63 else ord("0") for g in _GEAR)
+_PREFILTER = b"10110011"
+_WINDOW = 64
+
+
+def _mask_bits(avg: int) -> tuple[int, int]:
+    """Маски хеша окна: вероятность границы ~1/(avg*4) до среднего размера и ~1/(avg/4) после."""
+    bits = avg.bit_length() - 1 - len(_PREFILTER)
+    return (1 << (bits + 2)) - 1, (1 << max(bits - 2, 1)) - 1
+
+
+def find_cut(buf: bytes | bytearray, n: int, min_size: int = MIN_CHUNK, avg_size: int = AVG_CHUNK) -> int:
+    """Позиция границы чанка в buf[:n]. Граница не раньше min_size; если не нашлась — n."""
+    if n <= min_size:
+        return n
+    data = bytes(buf[:n])
+    bits = data.translate(_BITS)
+    mask_s, mask_l = _mask_bits(avg_size)
+    plen = len(_PREFILTER)
+    crc32 = zlib.crc32
+    pos = bits.find(_PREFILTER, max(min_size - plen, _WINDOW - plen))
+    while pos >= 0:
+        end = pos + plen
+        mask = mask_s if end < avg_size else mask_l
+        if not crc32(data[end - _WINDOW:end]) & mask:
+            return end
+        pos = bits.find(_PREFILTER, pos + 1)
+    return n
+
+
+def iter_chunks(f: BinaryIO, min_size: int = MIN_CHUNK, avg_size: int = AVG_CHUNK, max_size: int = MAX_CHUNK) -> Iterator[bytes]:
+    """Нарезка потока на чанки по содержимому. Память: не больше max_size + блок чтения."""
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            data = f.read(STREAM_BUFFER)
+            if not data:
+                eof = True
+            buf += data
+        if not buf:
+            return
+        cut = find_cut(buf, min(len(buf), max_size), min_size, avg_size)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+def _chunk_path(store: Path, digest: str) -> Path:
+    return store / "chunks" / digest[:2] / digest
+
+
+def _manifest_path(store: Path, name: str) -> Path:
+    if "/" in name or name.startswith("."):
+        raise ValueError(f"недопустимое имя бэкапа: {name}")
+    return store / "manifests" / f"{name}.json"
+
+
+@contextmanager
+def _store_lock(store: Path, exclusive: bool):
+    """put/чтение — общая блокировка, gc — эксклюзивная (чтобы не удалить чанк, который сейчас переиспользуется)."""
+    store.mkdir(parents=True, exist_ok=True)
+    with open(store / "lock", "a") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp.{os.getpid()}")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def put_stream(store: str | Path, f: BinaryIO, name: str, source: str | None = None) -> dict:
+    """Записать поток в хранилище под именем name. Возвращает манифест."""
+    store = Path(store)
+    started = time.monotonic()
+    total = hashlib.sha256()
+    chunks: list[list] = []
+    size = new_bytes = 0
+    with _store_lock(store, exclusive=False):
+        for chunk in iter_chunks(f):
+            digest = hashlib.sha256(chunk).hexdigest()
+            total.update(chunk)
+            size += len(chunk)
+            chunks.append([digest, len(chunk)])
+            path = _chunk_path(store, digest)
+            if not path.exists():
+                _write_atomic(path, chunk)
+                new_bytes += len(chunk)
+        manifest = {
+            "name": name,
+            "source": source,
+            "created": time.time(),
+            "size": size,
+            "sha256": total.hexdigest(),
+            "chunks": chunks,
+        }
+        _write_atomic(_manifest_path(store, name), json.dumps(manifest, separators=(",", ":")).encode())
+    elapsed = max(time.monotonic() - started, 1e-6)
+    log(f"[dedup] {name}: {size} байт, чанков {len(chunks)}, новых данных {new_bytes} байт, "
+        f"{elapsed:.1f} с, {size / elapsed / 1e6:.1f} МБ/с")
+    return manifest
+
+
+def put_file(store: str | Path, path: str | Path, name: str | None = None) -> dict:
+    path = Path(path)
+    with open(path, "rb", buffering=0) as f:
+        return put_stream(store, f, name or path.name, source=str(path))
+
+
+def store_artifact(store: str | Path, path: str | Path) -> int:
+    """Перенести готовый артефакт (файл) в хранилище и удалить полную копию. Возвращает код выхода."""
+    try:
+        put_file(store, path)
+        remove_artifact(Path(path))
+    except (OSError, ValueError) as e:
+        log(f"Ошибка записи в хранилище {store}: {e}")
+        return 1
+    return 0
+
+
+def load_manifest(store: str | Path, name: str) -> dict:
+    with open(_manifest_path(Path(store), name), "rb") as f:
+        return json.load(f)
+
+
+def iter_backup(store: str | Path, name: str) -> Iterator[bytes]:
+    """Потоковое восстановление: чанки по порядку, каждый сверяется с хешем, итог — с SHA-256 манифеста."""
+    store = Path(store)
+    manifest = load_manifest(store, name)
+    total = hashlib.sha256()
+    for digest, size in manifest["chunks"]:
+        with open(_chunk_path(store, digest), "rb") as cf:
+            data = cf.read()
+        if len(data) != size or hashlib.sha256(data).hexdigest() != digest:
+            raise OSError(f"повреждён чанк {digest} бэкапа {name}")
+        total.update(data)
+        yield data
+    if total.hexdigest() != manifest["sha256"]:
+        raise OSError(f"контрольная сумма бэкапа {name} не совпадает")
+
+
+def list_backups(store: str | Path, prefix: str = "") -> list[dict]:
+    mdir = Path(store) / "manifests"
+    if not mdir.is_dir():
+        return []
+    result = []
+    for p in sorted(mdir.glob(f"{prefix}*.json")):
+        try:
+            m = json.loads(p.read_bytes())
+        except (OSError, ValueError) as e:
+            log(f"Ошибка чтения манифеста {p}: {e}")
+            continue
+        result.append({"name": m["name"], "created": m["created"], "size": m["size"], "chunks": len(m["chunks"])})
+    return result
+
+
+def delete_backup(store: str | Path, name: str) -> None:
+    _manifest_path(Path(store), name).unlink()
+
+
+def gc(store: str | Path) -> tuple[int, int]:
+    """Удалить чанки, на которые не ссылается ни один манифест. Возвращает (чанков, байт)."""
+    store = Path(store)
+    removed = freed = 0
+    with _store_lock(store, exclusive=True):
+        referenced = set()
+        for p in (store / "manifests").glob("*.json"):
+            referenced.update(d for d, _ in json.loads(p.read_bytes())["chunks"])
+        cdir = store / "chunks"
+        if not cdir.is_dir():
+            return 0, 0
+        for sub in cdir.iterdir():
+            for c in sub.iterdir():
+                if c.name not in referenced:
+                    try:
+                        freed += c.stat().st_size
+                        c.unlink()
+                        removed += 1
+                    except OSError as e:
+                        log(f"Ошибка удаления {c}: {e}")
+    log(f"[dedup] Сборка мусора: удалено чанков {removed}, освобождено {freed} байт")
+    return removed, freed
+
+
+def rotate_by_days(store: str | Path, prefix: str, days: int) -> None:
+    """Удалить манифесты с префиксом prefix старше days дней, затем собрать мусор."""
+    if days <= 0:
+        return
+    cutoff = time.time() - days * 86400
+    deleted = 0
+    for b in list_backups(store, prefix):
+        if b["created"] < cutoff:
+            log(f"Ротация: удаление {b['name']} из хранилища {store}")
+            delete_backup(store, b["name"])
+            deleted += 1
+    if deleted:
+        gc(store)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Дедуплицирующее хранилище бэкапов (content-defined chunking)")
+    parser.add_argument("command", choices=["put", "get", "cat", "list", "delete", "rotate", "gc"])
+    parser.add_argument("items", nargs="*", help="put: файлы артефактов; get/cat/delete: имя бэкапа")
+    parser.add_argument("--store", required=True, help="Каталог хранилища")
+    parser.add_argument("--remove", action="store_true", help="put: удалить исходный файл после записи")
+    parser.add_argument("--out", default=None, help="get: путь для восстановленного файла")
+    parser.add_argument("--prefix", default="", help="list/rotate: префикс имён")
+    parser.add_argument("--days", type=int, default=0, help="rotate: удалить бэкапы старше N дней")
+    args = parser.parse_intermixed_args()
+
+    store = Path(args.store)
+    try:
+        if args.command == "put":
+            for item in args.items:
+                put_file(store, item)
+                if args.remove:
+                    Path(item).unlink()
+        elif args.command in ("get", "cat"):
+            if len(args.items) != 1:
+                log("Укажите одно имя бэкапа")
+                return 1
+            if args.command == "get":
+                out = Path(args.out or args.items[0])
+                tmp = out.with_name(f".{out.name}.tmp")
+                with open(tmp, "wb") as f:
+                    for data in iter_backup(store, args.items[0]):
+                        f.write(data)
+                os.replace(tmp, out)
+                log(f"Восстановлено в {out}")
+            else:
+                stdout = sys.stdout.buffer
+                for data in iter_backup(store, args.items[0]):
+                    stdout.write(data)
+                stdout.flush()
+        elif args.command == "list":
+            for b in list_backups(store, args.prefix):
+                print(json.dumps(b, ensure_ascii=False))
+        elif args.command == "delete":
+            for item in args.items:
+                delete_backup(store, item)
+        elif args.command == "rotate":
+            rotate_by_days(store, args.prefix, args.days)
+        elif args.command == "gc":
+            gc(store)
+    except (OSError, ValueError, KeyError) as e:
+        log(f"Ошибка: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
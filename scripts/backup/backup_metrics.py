@@ -0,0 +1,275 @@
+# Метрики запусков бэкапа и восстановления: начало/конец, байты прочитано/записано, МБ/с, степень сжатия,
+# CPU и пиковый RSS дочерних процессов (дамперы, компрессоры), код выхода.
+# Вывод: файл для textfile collector node_exporter (BACKUP_METRICS_DIR/*.prom, перезаписывается атомарно)
+# и журнал JSON lines (BACKUP_METRICS_JSONL, по умолчанию BACKUP_METRICS_DIR/backup_runs.jsonl).
+# Без этих переменных ничего не пишется. Модуль без зависимостей от backup_common: его импортируют и restore_*.py.
+# Запуск с профилем (restore_*.py --fast-load) сравнивается с историей своего профиля; вдобавок в журнал и лог
+# идёт ускорение к последнему успешному запуску без профиля на той же цели (по МБ/с, без объёма — по времени).
+from __future__ import annotations
+
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+
+METRICS_DIR_ENV = "BACKUP_METRICS_DIR"
+METRICS_JSONL_ENV = "BACKUP_METRICS_JSONL"
+JSONL_NAME = "backup_runs.jsonl"
+# Сколько прошлых успешных запусков брать для медианы длительности (метрика duration_ratio)
+HISTORY_RUNS = 10
+# Хвост журнала, который читается для истории: журнал растёт, читать его целиком незачем
+HISTORY_TAIL_BYTES = 512 * 1024
+
+_current: dict | None = None
+_lock = threading.Lock()
+
+
+def _warn(msg: str) -> None:
+    print(msg, file=sys.stderr)
+
+
+def start(kind: str, engine: str, target: str = "") -> None:
+    """Начало запуска: kind — backup/restore, engine — pg/mysql/mongo/redis."""
+    global _current
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    _current = {
+        "kind": kind,
+        "engine": engine,
+        "target": target,
+        "artifact": None,
+        "start": time.time(),
+        "cpu0": ru.ru_utime + ru.ru_stime,
+        "bytes_read": 0,
+        "bytes_written": 0,
+        "profile": None,
+        "annotated": False,
+    }
+
+
+def annotate(target: str | None = None, artifact: str | Path | None = None, profile: str | None = None) -> None:
+    """
+    Уточнить цель (БД, хост), путь артефакта (бэкап — результат, восстановление — источник)
+    и профиль запуска (fast-load): история и duration_ratio считаются в пределах профиля.
+    """
+    if _current is None:
+        return
+    _current["annotated"] = True
+    if target is not None:
+        _current["target"] = str(target)
+    if artifact is not None:
+        _current["artifact"] = str(artifact)
+    if profile is not None:
+        _current["profile"] = profile
+
+
+def add(bytes_read: int = 0, bytes_written: int = 0) -> None:
+    """Добавить прочитанные/записанные байты (вызывается из stream_to_file, copy_file и т.п.)."""
+    if _current is None:
+        return
+    with _lock:  # pg --all дампит БД в потоках
+        _current["bytes_read"] += bytes_read
+        _current["bytes_written"] += bytes_written
+
+
+def add_artifact(path: str | Path) -> None:
+    """Запуск с несколькими артефактами (pg --all): размер каждого — в записанные байты."""
+    if _current is not None:
+        add(bytes_written=_size(Path(path)))
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+def _history(jsonl: Path, kind: str, engine: str, target: str, profile: str | None = None) -> list[dict]:
+    """Успешные запуски с той же целью и профилем из хвоста журнала, по порядку."""
+    try:
+        with open(jsonl, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - HISTORY_TAIL_BYTES))
+            lines = f.read().splitlines()
+        if size > HISTORY_TAIL_BYTES:
+            lines = lines[1:]  # первая строка хвоста, скорее всего, обрезана
+    except OSError:
+        return []
+    runs = []
+    for line in lines:
+        try:
+            e = json.loads(line)
+        except ValueError:
+            continue
+        if ((e.get("kind"), e.get("engine"), e.get("target"), e.get("profile")) == (kind, engine, target, profile)
+                and e.get("exit_code") == 0):
+            runs.append(e)
+    return runs
+
+
+def _history_durations(jsonl: Path, kind: str, engine: str, target: str, profile: str | None = None) -> list[float]:
+    return [e["duration_seconds"] for e in _history(jsonl, kind, engine, target, profile)][-HISTORY_RUNS:]
+
+
+def _speedup(entry: dict, baseline: dict) -> float | None:
+    """Во сколько раз запуск быстрее baseline: по МБ/с, если объём известен у обоих, иначе по длительности."""
+    if entry["mb_per_s"] and baseline.get("mb_per_s"):
+        return round(entry["mb_per_s"] / baseline["mb_per_s"], 3)
+    if baseline.get("duration_seconds"):
+        return round(baseline["duration_seconds"] / entry["duration_seconds"], 3)
+    return None
+
+
+def finish(code: int) -> dict | None:
+    """Конец запуска: собрать метрики и записать. Возвращает запись (или None, если start не вызывался)."""
+    global _current
+    run, _current = _current, None
+    if run is None:
+        return None
+    end = time.time()
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    duration = max(end - run["start"], 1e-6)
+    artifact_size = None
+    if run["artifact"]:
+        try:
+            artifact_size = _size(Path(run["artifact"]))
+        except OSError:
+            pass
+    bytes_read, bytes_written = run["bytes_read"], run["bytes_written"]
+    # Инструмент писал/читал файлы сам — берём размер артефакта
+    if artifact_size is not None:
+        if run["kind"] == "backup" and not bytes_written:
+            bytes_written = artifact_size
+        if run["kind"] == "restore" and not bytes_read:
+            bytes_read = artifact_size
+    entry = {
+        "kind": run["kind"],
+        "engine": run["engine"],
+        "target": run["target"],
+        "artifact": run["artifact"],
+        "start": round(run["start"], 3),
+        "end": round(end, 3),
+        "duration_seconds": round(duration, 3),
+        "bytes_read": bytes_read,
+        "bytes_written": bytes_written,
+        "mb_per_s": round((bytes_read or bytes_written) / duration / 1e6, 3),
+        "compression_ratio": (
+            round(bytes_read / bytes_written, 3) if run["kind"] == "backup" and bytes_read and bytes_written else None
+        ),
+        "artifact_size": artifact_size,
+        "child_cpu_seconds": round(ru.ru_utime + ru.ru_stime - run["cpu0"], 3),
+        # ru_maxrss — максимум по всем дождавшимся дочерним процессам, в КБ (Linux)
+        "child_max_rss_bytes": ru.ru_maxrss * 1024,
+        "exit_code": code,
+    }
+    if run["profile"]:
+        entry["profile"] = run["profile"]
+    metrics_dir = os.environ.get(METRICS_DIR_ENV)
+    jsonl = os.environ.get(METRICS_JSONL_ENV) or (str(Path(metrics_dir) / JSONL_NAME) if metrics_dir else None)
+    if jsonl:
+        history = _history_durations(Path(jsonl), entry["kind"], entry["engine"], entry["target"], run["profile"])
+        if history:
+            median = sorted(history)[len(history) // 2]
+            entry["duration_ratio"] = round(duration / median, 3) if median > 0 else None
+        if run["profile"] and code == 0:
+            baseline = _history(Path(jsonl), entry["kind"], entry["engine"], entry["target"])
+            if baseline:
+                last = baseline[-1]
+                entry["speedup"] = _speedup(entry, last)
+                if entry["speedup"]:
+                    _warn(f"Метрики: {run['profile']} — x{entry['speedup']:.1f} к последнему запуску без профиля "
+                          f"({last['duration_seconds']:.1f} с, {last.get('mb_per_s') or 0:g} МБ/с -> "
+                          f"{duration:.1f} с, {entry['mb_per_s']:g} МБ/с)")
+            else:
+                _warn(f"Метрики: {run['profile']} — запуска без профиля на {entry['target']} в журнале нет, ускорение не с чем сравнить")
+        try:
+            Path(jsonl).parent.mkdir(parents=True, exist_ok=True)
+            with open(jsonl, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            _warn(f"Метрики: не удалось записать {jsonl}: {e}")
+    if metrics_dir:
+        try:
+            write_textfile(Path(metrics_dir), entry)
+        except OSError as e:
+            _warn(f"Метрики: не удалось записать в {metrics_dir}: {e}")
+    return entry
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_GAUGES = (
+    ("start_timestamp_seconds", "start", "Время начала последнего запуска"),
+    ("end_timestamp_seconds", "end", "Время окончания последнего запуска"),
+    ("duration_seconds", "duration_seconds", "Длительность последнего запуска"),
+    ("duration_ratio", "duration_ratio", "Длительность относительно медианы прошлых успешных запусков"),
+    ("bytes_read", "bytes_read", "Прочитано байт (вход дампера / файл бэкапа)"),
+    ("bytes_written", "bytes_written", "Записано байт"),
+    ("throughput_bytes_per_second", None, "Скорость, байт/с"),
+    ("compression_ratio", "compression_ratio", "Вход / выход сжатия"),
+    ("artifact_size_bytes", "artifact_size", "Размер артефакта"),
+    ("child_cpu_seconds", "child_cpu_seconds", "CPU дочерних процессов, с"),
+    ("child_max_rss_bytes", "child_max_rss_bytes", "Пиковый RSS дочерних процессов"),
+    ("exit_code", "exit_code", "Код выхода последнего запуска"),
+)
+
+
+def write_textfile(metrics_dir: Path, entry: dict) -> Path:
+    """Файл textfile collector для одного (kind, engine, target): последние значения + время последнего успеха."""
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{entry['kind']}_{entry['engine']}_{entry['target'] or 'default'}")
+    path = metrics_dir / f"{name}.prom"
+    labels = ",".join(f'{k}="{_label(str(entry[k]))}"' for k in ("kind", "engine", "target"))
+    last_success = entry["end"] if entry["exit_code"] == 0 else _previous_value(path, "backup_run_last_success_timestamp_seconds")
+    lines = []
+    for metric, key, help_text in _GAUGES:
+        value = entry["mb_per_s"] * 1e6 if key is None else entry.get(key)
+        if value is None:
+            continue
+        lines += [f"# HELP backup_run_{metric} {help_text}", f"# TYPE backup_run_{metric} gauge",
+                  f"backup_run_{metric}{{{labels}}} {value}"]
+    if last_success is not None:
+        lines += ["# HELP backup_run_last_success_timestamp_seconds Время окончания последнего успешного запуска",
+                  "# TYPE backup_run_last_success_timestamp_seconds gauge",
+                  f"backup_run_last_success_timestamp_seconds{{{labels}}} {last_success}"]
+    # Атомарно: node_exporter не должен прочитать файл наполовину
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+    return path
+
+
+def _previous_value(path: Path, metric: str) -> float | None:
+    try:
+        for line in path.read_text().splitlines():
+            if line.startswith(metric + "{"):
+                return float(line.rsplit(" ", 1)[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def run_main(kind: str, engine: str, main, target: str = "") -> int:
+    """
+    Обёртка main() скрипта: метрики пишутся при любом исходе (код, исключение, sys.exit).
+    sys.exit до первого annotate() — --help или ошибка аргументов (argparse): это не запуск, метрик нет,
+    иначе --help обновил бы время последнего успеха.
+    """
+    global _current
+    start(kind, engine, target)
+    code = 1
+    try:
+        code = main()
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        if _current is not None and not _current["annotated"]:
+            _current = None
+        raise
+    finally:
+        finish(code)
+    return code
@@ -2,61 +2,115 @@
 """
 Бэкап MongoDB: mongodump. В каталог с датой в имени (архив BSON + metadata).
 Переменные окружения: MONGODB_URI или --uri. Опционально --gzip для сжатия (mongodump --gzip).
+--archive: один поток mongodump --archive вместо дерева файлов — сжимается на лету (--codec, backup_codecs.py),
+хешируется и пишется в один файл mongo_<дата>.archive.gz (.zst, .lz4) атомарно; с --s3 поток уходит в S3 в том
+же проходе. Ротация удаляет один файл на бэкап. --parallel-collections — mongodump --numParallelCollections.
+--s3 s3://бакет/префикс — выгрузка каталога в S3 (backup_s3.py), --s3-rotate-days — ротация там.
 Использование:
   python3 backup_mongodb.py --dest /backup/mongo [--uri URI] [--gzip] [--rotate-days N]
+  python3 backup_mongodb.py --dest /backup/mongo --archive --codec zstd --parallel-collections 8
 """
 from __future__ import annotations
 
 import argparse
 import os
-import shutil
 import sys
 import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from backup_common import dated_path, log, run
+import backup_catalog as catalog
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_s3 as s3
+from backup_common import dated_path, log, rotate_by_days, run, stream_to_artifact, write_file_manifest
+
+
+def _source(uri: str | None) -> str:
+    """Хост из URI для каталога бэкапов (без учётных данных)."""
+    if not uri:
+        return "localhost"
+    return uri.split("://", 1)[-1].rsplit("@", 1)[-1].split("/", 1)[0]
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Бэкап MongoDB (mongodump)")
     parser.add_argument("--dest", required=True, help="Каталог для сохранения бэкапов")
     parser.add_argument("--uri", default=os.environ.get("MONGODB_URI"), help="MongoDB URI (или MONGODB_URI)")
-    parser.add_argument("--gzip", action="store_true", help="Сжатие дампов (mongodump --gzip)")
+    parser.add_argument("--gzip", action="store_true", help="Сжатие дампов (mongodump --gzip; без --archive)")
+    parser.add_argument("--archive", action="store_true",
+                        help="Один файл: поток mongodump --archive со сжатием --codec и контрольной суммой")
+    parser.add_argument("--parallel-collections", type=int, default=0,
+                        help="Коллекций одновременно (mongodump --numParallelCollections; 0 — по умолчанию, 4)")
     parser.add_argument("--rotate-days", type=int, default=0, help="Удалить бэкапы старше N дней")
     parser.add_argument("--mongodump", default="mongodump", help="Путь к mongodump")
+    parser.add_argument("--timeout", type=int, default=0, help="Предел работы mongodump, с (0 — без ограничения)")
+    codecs.add_codec_args(parser, "gzip")
+    s3.add_s3_args(parser)
     args = parser.parse_args()
+    if args.archive and args.gzip:
+        parser.error("--gzip сжимает файлы каталога; для --archive сжатие задаёт --codec")
 
     dest = Path(args.dest)
     dest.mkdir(parents=True, exist_ok=True)
 
-    out_dir = dated_path(dest, "mongo", "")
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    log(f"Бэкап MongoDB в {out_dir}")
-    cmd = [args.mongodump, "--out", str(out_dir)]
+    cmd = [args.mongodump]
     if args.uri:
         cmd.extend(["--uri", args.uri])
-    if args.gzip:
-        cmd.append("--gzip")
+    if args.parallel_collections > 0:
+        cmd.append(f"--numParallelCollections={args.parallel_collections}")
+    if args.archive:
+        code = _backup_archive(args, dest, cmd)
+        if code != 0:
+            return code
+    else:
+        out_dir = dated_path(dest, "mongo", "")
+        out_dir.mkdir(parents=True, exist_ok=True)
+        log(f"Бэкап MongoDB в {out_dir}")
+        metrics.annotate(target=_source(args.uri), artifact=out_dir)
+        cmd.extend(["--out", str(out_dir)])
+        if args.gzip:
+            cmd.append("--gzip")
 
-    code = run(cmd, log_prefix="[mongodump] ")
-    if code != 0:
-        return code
+        started = time.time()
+        code = run(cmd, log_prefix="[mongodump] ", timeout=args.timeout)
+        if code != 0:
+            return code
+        write_file_manifest(out_dir)
+        catalog.register(dest, out_dir, source=_source(args.uri), started=started)
+        code = s3.upload_artifact(args, out_dir)
+        if code != 0:
+            return code
 
     if args.rotate_days > 0:
-        cutoff = time.time() - args.rotate_days * 86400
-        for d in dest.iterdir():
-            if d.is_dir() and d.name.startswith("mongo_") and d.stat().st_mtime < cutoff:
-                try:
-                    log(f"Ротация: удаление {d}")
-                    shutil.rmtree(d)
-                except OSError as e:
-                    log(f"Ошибка удаления {d}: {e}")
+        rotate_by_days(dest, "mongo_", args.rotate_days)
+    s3.rotate_s3(args, "mongo_")
 
     log("Готово.")
     return 0
 
 
+def _backup_archive(args, dest: Path, cmd: list[str]) -> int:
+    """--archive: stdout mongodump -> сжатие -> mongo_<дата>.archive<суффикс кодека> (+ поток в S3)."""
+    out_path = dated_path(dest, "mongo", ".archive" + codecs.SUFFIXES.get(args.codec, ""))
+    log(f"Бэкап MongoDB (архив) в {out_path}")
+    metrics.annotate(target=_source(args.uri), artifact=out_path)
+    try:
+        upload = s3.open_stream_upload(args, out_path)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка S3: {e}")
+        return 1
+    started = time.time()
+    # --archive без значения — архив в stdout
+    code, out_path = stream_to_artifact(cmd + ["--archive"], out_path, compress=args.codec, level=args.level,
+                                        log_prefix="[mongodump] ", upload=upload, threads=args.threads,
+                                        auto_min_mbps=args.auto_min_mbps, timeout=args.timeout)
+    metrics.annotate(artifact=out_path)
+    if code != 0:
+        return code
+    catalog.register(dest, out_path, source=_source(args.uri), started=started)
+    return 0
+
+
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("backup", "mongo", main))
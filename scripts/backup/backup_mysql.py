@@ -1,20 +1,36 @@
 #!/usr/bin/env python3
 """
 Бэкап MySQL / MariaDB: mysqldump. Одна БД или все (--all-databases).
-Сжатие: gzip. Переменные окружения: MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD (или --password).
+Вывод mysqldump сжимается на лету (--codec zstd, lz4, gzip, многопоточно — backup_codecs.py) и пишется сразу
+в итоговый .sql.zst / .sql.lz4 / .sql.gz (атомарно, через временный файл), без промежуточного .sql на диске.
+--codec auto: кодек и уровень выбираются замером на первых 8 МБ дампа, суффикс имени — по выбору.
+--s3 s3://бакет/префикс: сжатый поток уходит в S3 (multipart) в том же проходе, что и запись файла.
+Нагрузку на источник можно ограничить: --max-rate (МБ/с, --adaptive — по RTT до сервера), --ionice, --io-max/--io-weight.
+--parallel N: дамп в каталог N сессиями одного согласованного снимка, по файлу на кусок таблицы (backup_mysql_parallel.py).
+Готовые куски отмечаются в журнале; после сбоя --resume продолжает прерванный дамп с них.
+Переменные окружения: MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD (или --password).
 Использование:
-  python3 backup_mysql.py --dest /backup/mysql [--database NAME] [--all-databases] [--rotate-days N] [--no-gzip]
+  python3 backup_mysql.py --dest /backup/mysql [--database NAME] [--all-databases] [--rotate-days N] [--codec zstd|lz4|gzip|auto] [--no-gzip]
+  python3 backup_mysql.py --dest /backup/mysql --all-databases --max-rate 50 --adaptive --ionice idle
+  python3 backup_mysql.py --dest /backup/mysql --all-databases --parallel 8 --codec zstd --threads 4 [--resume]
+  python3 backup_mysql.py --dest /backup/mysql --all-databases --s3 s3://backups/mysql --s3-rotate-days 30
 """
 from __future__ import annotations
 
 import argparse
 import os
-import subprocess
 import sys
+import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from backup_common import dated_path, log, rotate_by_days, run
+import backup_catalog as catalog
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_dedup as dedup
+import backup_s3 as s3
+from backup_mysql_parallel import CHUNK_BYTES, dump_parallel
+from backup_common import add_io_args, dated_path, io_setup, log, rotate_by_days, stream_to_artifact
 
 
 def main() -> int:
@@ -23,13 +39,29 @@ def main() -> int:
     parser.add_argument("--database", "-d", default=None, help="Имя БД (если не указано при одном бэкапе — из MYSQL_DATABASE)")
     parser.add_argument("--all-databases", action="store_true", help="Бэкап всех БД")
     parser.add_argument("--rotate-days", type=int, default=0, help="Удалить бэкапы старше N дней")
-    parser.add_argument("--no-gzip", action="store_true", help="Не сжимать вывод (по умолчанию gzip)")
+    codecs.add_codec_args(parser, "gzip")
+    parser.add_argument("--no-gzip", action="store_true", help="Не сжимать вывод (то же, что --codec none)")
     parser.add_argument("--mysqldump", default="mysqldump", help="Путь к mysqldump")
+    parser.add_argument("--mysql", default="mysql", help="Путь к клиенту mysql (для --parallel)")
+    parser.add_argument("--parallel", type=int, default=0,
+                        help="Параллельный дамп в каталог N сессиями одного снимка (0 — один mysqldump)")
+    parser.add_argument("--resume", action="store_true",
+                        help="--parallel: продолжить прерванный дамп с готовых кусков (журнал во временном каталоге)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_BYTES // (1024 * 1024),
+                        help="--parallel: таблицы крупнее (МБ) режутся на диапазоны первичного ключа")
+    parser.add_argument("--dedup-store", default=None, help="Перенести дамп в дедуплицирующее хранилище (backup_dedup.py)")
+    parser.add_argument("--timeout", type=int, default=0, help="Предел работы mysqldump, с (0 — без ограничения)")
     parser.add_argument("--host", default=os.environ.get("MYSQL_HOST"), help="Хост (или MYSQL_HOST)")
     parser.add_argument("--port", default=os.environ.get("MYSQL_PORT", "3306"), help="Порт")
     parser.add_argument("--user", "-u", default=os.environ.get("MYSQL_USER"), help="Пользователь (или MYSQL_USER)")
     parser.add_argument("--password", "-p", default=os.environ.get("MYSQL_PWD") or os.environ.get("MYSQL_PASSWORD"), help="Пароль (лучше MYSQL_PWD)")
+    add_io_args(parser)
+    s3.add_s3_args(parser)
     args = parser.parse_args()
+    if args.parallel and args.dedup_store:
+        parser.error("--parallel пишет каталог, --dedup-store принимает только файл")
+    if args.resume and not args.parallel:
+        parser.error("--resume продолжает дамп по кускам таблиц: только с --parallel")
 
     dest = Path(args.dest)
     dest.mkdir(parents=True, exist_ok=True)
@@ -38,16 +70,24 @@ def main() -> int:
     if args.password:
         env["MYSQL_PWD"] = args.password
 
-    cmd = [args.mysqldump, "--single-transaction", "--routines", "--triggers", "--events"]
+    conn = []
     if args.host:
-        cmd.extend(["--host", args.host])
+        conn.extend(["--host", args.host])
     if args.port:
-        cmd.extend(["--port", str(args.port)])
+        conn.extend(["--port", str(args.port)])
     if args.user:
-        cmd.extend(["--user", args.user])
+        conn.extend(["--user", args.user])
+    cmd = [args.mysqldump, "--single-transaction", "--routines", "--triggers", "--events"] + conn
 
-    use_gzip = not args.no_gzip
-    suffix = ".sql.gz" if use_gzip else ".sql"
+    compress = "none" if args.no_gzip else args.codec
+    if compress != "none" and args.dedup_store:
+        # Сжатие (и gzip по умолчанию) сдвигает байты после каждого изменения: соседние дампы не делят чанки
+        log(f"--dedup-store: сжатый поток дедуплицируется плохо, --codec {compress} заменён на none")
+        compress = "none"
+    if args.parallel > 0:
+        return _backup_parallel(args, dest, conn, env, compress)
+    # auto: суффикс кодека добавит stream_to_artifact после замера
+    suffix = ".sql" + codecs.SUFFIXES.get(compress, "")
 
     if args.all_databases:
         out_path = dated_path(dest, "mysql_all", suffix)
@@ -61,31 +101,81 @@ def main() -> int:
         cmd.append(db)
         prefix_rotate = f"mysql_{db}_"
 
-    if use_gzip:
-        sql_path = out_path.with_suffix("")  # .sql.gz -> .sql
-        cmd.extend(["--result-file", str(sql_path)])
-        code = run(cmd, env=env, log_prefix="[mysqldump] ")
+    metrics.annotate(target=f"{args.host or 'localhost'}/{'all' if args.all_databases else db}", artifact=out_path)
+    try:
+        upload = s3.open_stream_upload(args, out_path)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка S3: {e}")
+        return 1
+    prefix, throttle = io_setup(args, dest, args.host, args.port, "mysqldump", _probe_cmd(args, conn), env)
+    started = time.time()
+    code, out_path = stream_to_artifact(prefix + cmd, out_path, compress=compress, level=args.level, env=env,
+                                        log_prefix="[mysqldump] ", throttle=throttle, upload=upload,
+                                        threads=args.threads, auto_min_mbps=args.auto_min_mbps, timeout=args.timeout)
+    if throttle is not None:
+        throttle.close()
+    metrics.annotate(artifact=out_path)
+    if code != 0:
+        return code
+    if args.dedup_store:
+        code = dedup.store_artifact(args.dedup_store, out_path)
         if code != 0:
-            if sql_path.exists():
-                sql_path.unlink(missing_ok=True)
             return code
-        code = run(["gzip", "-f", str(sql_path)], log_prefix="[gzip] ")
-        if code != 0:
-            sql_path.unlink(missing_ok=True)
-            return code
-        # gzip -f создаёт sql_path.gz; имя out_path уже .sql.gz, совпадает
     else:
-        cmd.extend(["--result-file", str(out_path)])
-        code = run(cmd, env=env, log_prefix="[mysqldump] ")
-        if code != 0:
-            return code
+        catalog.register(dest, out_path, source=args.host or "localhost", started=started)
 
     if args.rotate_days > 0:
-        rotate_by_days(dest, prefix_rotate, args.rotate_days)
+        if args.dedup_store:
+            dedup.rotate_by_days(args.dedup_store, prefix_rotate, args.rotate_days)
+        else:
+            rotate_by_days(dest, prefix_rotate, args.rotate_days)
+    s3.rotate_s3(args, prefix_rotate)
 
     log("Готово.")
     return 0
 
 
+def _probe_cmd(args, conn: list[str]) -> list[str]:
+    """Клиент mysql для пробы задержки (--adaptive): постоянная сессия, запросы из stdin."""
+    return [args.mysql] + conn + ["-N", "--batch", "--raw", "--unbuffered"]
+
+
+def _backup_parallel(args, dest: Path, conn: list[str], env: dict, compress: str) -> int:
+    """--parallel N: каталог mysql_<БД|all>_<дата>.dir (схема, куски таблиц, metadata.json с позицией binlog)."""
+    name = "all" if args.all_databases else (args.database or os.environ.get("MYSQL_DATABASE", "mysql"))
+    out_dir = dated_path(dest, f"mysql_{name}", ".dir")
+    log(f"Параллельный бэкап ({args.parallel} сессий) {'всех БД' if args.all_databases else 'БД ' + name} в {out_dir}")
+    metrics.annotate(target=f"{args.host or 'localhost'}/{name}", artifact=out_dir)
+    prefix, throttle = io_setup(args, dest, args.host, args.port, "mysql", _probe_cmd(args, conn), env)
+    started = time.time()
+    code, out_dir = dump_parallel(
+        prefix + [args.mysql] + conn,
+        prefix + [args.mysqldump] + conn,
+        env,
+        None if args.all_databases else [name],
+        out_dir,
+        args.parallel,
+        compress=compress,
+        level=args.level,
+        threads=args.threads,
+        auto_min_mbps=args.auto_min_mbps,
+        chunk_bytes=args.chunk_size * 1024 * 1024,
+        throttle=throttle,
+        resume=args.resume,
+    )
+    metrics.annotate(artifact=out_dir)
+    if code != 0:
+        return code
+    catalog.register(dest, out_dir, source=args.host or "localhost", started=started)
+    code = s3.upload_artifact(args, out_dir)
+    if code != 0:
+        return code
+    if args.rotate_days > 0:
+        rotate_by_days(dest, f"mysql_{name}_", args.rotate_days)
+    s3.rotate_s3(args, f"mysql_{name}_")
+    log("Готово.")
+    return 0
+
+
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("backup", "mysql", main))
@@ -0,0 +1,542 @@
+# Параллельный дамп MySQL/MariaDB в каталог (backup_mysql.py --parallel N).
+# N постоянных сессий клиента mysql видят один согласованный снимок: FLUSH TABLES WITH READ LOCK на короткое
+# время, START TRANSACTION WITH CONSISTENT SNAPSHOT в каждой сессии, запись позиции binlog/GTID, UNLOCK TABLES.
+# Крупные таблицы с целочисленным первичным ключом режутся на диапазоны ключа; каждый кусок — отдельный
+# сжатый файл <db>/<таблица>.<NNNNN>.sql.gz (.zst, .lz4 — по кодеку) с INSERT-ами. --codec auto выбирает кодек
+# по образцу строк крупнейших таблиц до блокировки. Схема (без триггеров) и триггеры — через mysqldump
+# --no-data. Драйвер MySQL не нужен: запросы идут в stdin клиента mysql, конец ответа — строка-маркер.
+# Готовые куски отмечаются в журнале (backup_checkpoint.py): прерванный дамп продолжается с --resume.
+# Строка таблицы в тексте INSERT (двоичные колонки — вдвое длиннее, hex) не должна превышать max_allowed_packet
+# сервера: иначе CONCAT даёт NULL, и дамп прерывается ошибкой — такие таблицы выгружайте mysqldump.
+from __future__ import annotations
+
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import backup_checkpoint as checkpoint
+import backup_codecs as codecs
+import backup_metrics as metrics
+from backup_common import (
+    DEFAULT_CHECKSUM,
+    STREAM_BUFFER,
+    hash_file,
+    log,
+    open_writer,
+    stream_to_file,
+    write_file_manifest,
+)
+
+SYSTEM_SCHEMAS = ("mysql", "information_schema", "performance_schema", "sys")
+# Таблица крупнее этого режется на диапазоны первичного ключа
+CHUNK_BYTES = 256 * 1024 * 1024
+# Размер одного INSERT в файле куска (max_allowed_packet по умолчанию 64 МБ)
+STATEMENT_BYTES = 1024 * 1024
+INT_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint"}
+# --codec auto: строк на таблицу в образце (LIMIT — ответ сессии дочитывается до маркера целиком)
+SAMPLE_ROWS = 20000
+# Двоичные и пространственные типы выгружаются как X'hex'
+BINARY_TYPES = {
+    "binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob", "bit",
+    "geometry", "point", "linestring", "polygon", "multipoint", "multilinestring", "multipolygon",
+    "geometrycollection", "geomcollection",
+}
+# Генерируемые колонки (EXTRA: VIRTUAL/STORED GENERATED, у MariaDB ещё PERSISTENT) не выгружаются; DEFAULT_GENERATED
+# MySQL 8 (DEFAULT CURRENT_TIMESTAMP и другие выражения по умолчанию) — обычные колонки
+GENERATED_RE = re.compile(r"\b(?:virtual|stored|persistent) generated\b")
+# Движки, которые видят снимок транзакции; остальные (MyISAM, Aria, MEMORY) дампятся под глобальной блокировкой
+TRANSACTIONAL_ENGINES = {"InnoDB", "XtraDB", "RocksDB", "TokuDB"}
+
+CHUNK_HEADER = (
+    b"/*!40101 SET NAMES utf8mb4 */;\n"
+    b"SET TIME_ZONE='+00:00';\n"
+    b"SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n"
+    b"SET FOREIGN_KEY_CHECKS=0, UNIQUE_CHECKS=0;\n"
+)
+
+
+class MysqlError(Exception):
+    pass
+
+
+def quote_ident(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def quote_str(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class MysqlSession:
+    """
+    Постоянная сессия: процесс mysql -N --batch --raw --unbuffered, запросы пишутся в stdin.
+    После запроса отправляется SELECT '<маркер>' — строка маркера в stdout означает конец ответа.
+    Без --force: ошибка SQL завершает клиент, и ожидание ответа заканчивается MysqlError с текстом stderr.
+    """
+
+    def __init__(self, base_cmd: list[str], env: dict | None = None, name: str = "mysql") -> None:
+        self.name = name
+        cmd = base_cmd + ["-N", "--batch", "--raw", "--unbuffered", "--default-character-set=utf8mb4"]
+        try:
+            self._proc = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env={**os.environ, **(env or {})}, bufsize=STREAM_BUFFER,
+            )
+        except OSError as e:
+            raise MysqlError(f"{name}: не удалось запустить {cmd[0]}: {e}") from e
+        self._stderr: list[bytes] = []
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        self._token = uuid.uuid4().hex[:12]
+        self._seq = 0
+
+    def _drain_stderr(self) -> None:
+        for line in self._proc.stderr:
+            if len(self._stderr) < 50:
+                self._stderr.append(line)
+
+    def _error(self) -> MysqlError:
+        self._proc.wait()
+        self._stderr_thread.join(timeout=5)
+        text = b"".join(self._stderr).decode(errors="replace").strip()
+        return MysqlError(f"{self.name}: клиент mysql завершился (код {self._proc.returncode}): {text or 'нет вывода'}")
+
+    def send(self, sql: str) -> bytes:
+        """Отправить запрос без ожидания ответа. Возвращает маркер для wait()/stream()."""
+        self._seq += 1
+        marker = f"--end-{self._token}-{self._seq}--"
+        try:
+            self._proc.stdin.write(f"{sql};\nSELECT '{marker}';\n".encode())
+            self._proc.stdin.flush()
+        except OSError:
+            raise self._error() from None
+        return marker.encode()
+
+    def stream(self, sql: str | None = None, marker: bytes | None = None):
+        """Строки ответа (bytes без перевода строки) по мере чтения — без накопления в памяти."""
+        marker = self.send(sql) if marker is None else marker
+        readline = self._proc.stdout.readline
+        while True:
+            line = readline()
+            if not line:
+                raise self._error()
+            line = line[:-1] if line.endswith(b"\n") else line
+            if line == marker:
+                return
+            yield line
+
+    def wait(self, marker: bytes) -> None:
+        for _ in self.stream(marker=marker):
+            pass
+
+    def query(self, sql: str) -> list[list[str]]:
+        return [line.decode(errors="surrogateescape").split("\t") for line in self.stream(sql)]
+
+    def execute(self, sql: str) -> None:
+        self.wait(self.send(sql))
+
+    def close(self) -> None:
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+
+def _row_expr(columns: list[tuple[str, str]]) -> str:
+    """
+    Выражение SELECT, дающее строку '(v1,v2,...)' в синтаксисе SQL: QUOTE(), для двоичных типов X'hex'.
+    Строка длиннее max_allowed_packet сервера даёт NULL (CONCAT с предупреждением) — см. dump_chunk.
+    """
+    parts = []
+    for name, data_type in columns:
+        col = quote_ident(name)
+        if data_type in BINARY_TYPES:
+            parts.append(f"IF({col} IS NULL,'NULL',CONCAT('X''',HEX({col}),''''))")
+        else:
+            # QUOTE не экранирует перевод строки — заменяем на \n, чтобы одна строка ответа = одна строка таблицы
+            parts.append(f"REPLACE(QUOTE({col}),'\\n','\\\\n')")
+    return f"CONCAT('(',CONCAT_WS(',',{','.join(parts)}),')')"
+
+
+def _insert_prefix(table: str, columns: list) -> bytes:
+    return f"INSERT INTO {quote_ident(table)} ({','.join(quote_ident(c) for c, _ in columns)}) VALUES\n".encode()
+
+
+def dump_chunk(
+    session: MysqlSession,
+    unit: dict,
+    out_dir: Path,
+    compress: str,
+    level: int | None,
+    throttle=None,
+    threads: int = 0,
+) -> dict:
+    """
+    Выгрузить один кусок таблицы в сжатый файл. Возвращает {rows, bytes_in, bytes_out}. throttle — общий на все сессии.
+    Строка NULL в ответе — текст строки таблицы больше max_allowed_packet сервера: MysqlError, а не кусок,
+    который не загрузится при восстановлении.
+    """
+    db, table = unit["db"], unit["table"]
+    sql = f"SELECT {_row_expr(unit['columns'])} FROM {quote_ident(db)}.{quote_ident(table)}"
+    if unit.get("where"):
+        sql += f" WHERE {unit['where']}"
+    path = out_dir / unit["file"]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    insert = _insert_prefix(table, unit["columns"])
+    rows = bytes_in = 0
+    with open(path, "wb", buffering=STREAM_BUFFER) as f:
+        writer = open_writer(f, compress, level, threads)
+        writer.write(CHUNK_HEADER)
+        batch: list[bytes] = []
+        batch_bytes = 0
+        for line in session.stream(sql):
+            if line == b"NULL":
+                where = f" ({unit['where']})" if unit.get("where") else ""
+                raise MysqlError(f"{db}.{table}{where}: строка длиннее max_allowed_packet сервера — увеличьте его "
+                                 "или выгрузите таблицу mysqldump")
+            batch.append(line)
+            batch_bytes += len(line) + 2
+            rows += 1
+            if batch_bytes >= STATEMENT_BYTES:
+                data = insert + b",\n".join(batch) + b";\n"
+                if throttle is not None:
+                    throttle.consume(len(data))
+                writer.write(data)
+                bytes_in += len(data)
+                batch, batch_bytes = [], 0
+        if batch:
+            data = insert + b",\n".join(batch) + b";\n"
+            if throttle is not None:
+                throttle.consume(len(data))
+            writer.write(data)
+            bytes_in += len(data)
+        writer.close()
+        f.flush()
+        os.fsync(f.fileno())
+        bytes_out = f.tell()
+    metrics.add(bytes_read=bytes_in, bytes_written=bytes_out)
+    return {"rows": rows, "bytes_in": bytes_in, "bytes_out": bytes_out}
+
+
+def _sample(session: MysqlSession, tables: list[dict], size: int) -> bytes:
+    """Образец для --codec auto: INSERT-ы из первых строк крупнейших таблиц, до size байт."""
+    parts: list[bytes] = []
+    got = 0
+    for t in tables:
+        if got >= size or not t["columns"]:
+            break
+        sql = f"SELECT {_row_expr(t['columns'])} FROM {quote_ident(t['db'])}.{quote_ident(t['table'])} LIMIT {SAMPLE_ROWS}"
+        lines = list(session.stream(sql))
+        if lines:
+            data = _insert_prefix(t["table"], t["columns"]) + b",\n".join(lines) + b";\n"
+            parts.append(data)
+            got += len(data)
+    return b"".join(parts)[:size]
+
+
+def _in_list(names: list[str]) -> str:
+    return ",".join(quote_str(n) for n in names)
+
+
+def _load_tables(session: MysqlSession, databases: list[str]) -> list[dict]:
+    """Базовые таблицы с движком, размером, колонками (без генерируемых) и целочисленным PK из одной колонки."""
+    dbs = _in_list(databases)
+    tables = {}
+    for db, table, engine, size in session.query(
+        "SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(ENGINE,''), IFNULL(DATA_LENGTH,0) FROM information_schema.TABLES "
+        f"WHERE TABLE_TYPE='BASE TABLE' AND TABLE_SCHEMA IN ({dbs})"
+    ):
+        tables[(db, table)] = {"db": db, "table": table, "engine": engine, "size": int(size), "columns": [], "pk": []}
+    for db, table, column, data_type, extra in session.query(
+        "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, LOWER(DATA_TYPE), LOWER(EXTRA) FROM information_schema.COLUMNS "
+        f"WHERE TABLE_SCHEMA IN ({dbs}) ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION"
+    ):
+        t = tables.get((db, table))
+        if t is not None and not GENERATED_RE.search(extra):
+            t["columns"].append((column, data_type))
+    for db, table, column in session.query(
+        "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+        f"WHERE CONSTRAINT_NAME='PRIMARY' AND TABLE_SCHEMA IN ({dbs}) ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION"
+    ):
+        t = tables.get((db, table))
+        if t is not None:
+            t["pk"].append(column)
+    return sorted(tables.values(), key=lambda t: -t["size"])
+
+
+def _plan_units(session: MysqlSession, tables: list[dict], chunk_bytes: int, suffix: str) -> list[dict]:
+    """Куски выгрузки: таблица целиком или диапазоны целочисленного PK (границы — по MIN/MAX на момент плана)."""
+    units = []
+    for t in tables:
+        base = {"db": t["db"], "table": t["table"], "columns": t["columns"], "size": t["size"]}
+        types = dict(t["columns"])
+        pieces = -(-t["size"] // chunk_bytes) if chunk_bytes > 0 else 1
+        if pieces > 1 and len(t["pk"]) == 1 and types.get(t["pk"][0]) in INT_TYPES:
+            pk = quote_ident(t["pk"][0])
+            rows = session.query(f"SELECT MIN({pk}), MAX({pk}) FROM {quote_ident(t['db'])}.{quote_ident(t['table'])}")
+            lo, hi = rows[0] if rows else ("NULL", "NULL")
+            if lo != "NULL":
+                lo, hi = int(lo), int(hi)
+                step = max(1, -(-(hi - lo + 1) // pieces))
+                starts = list(range(lo, hi + 1, step))
+                for i, start in enumerate(starts):
+                    # Крайние куски открыты: строки за MIN/MAX плана (план до снимка, --resume) не теряются
+                    where = ([f"{pk} >= {start}"] if i > 0 else []) + ([f"{pk} < {start + step}"] if i < len(starts) - 1 else [])
+                    units.append({
+                        **base,
+                        "size": t["size"] // pieces,
+                        "where": " AND ".join(where) or None,
+                        "file": f"{t['db']}/{t['table']}.{i:05d}.sql{suffix}",
+                    })
+                continue
+        units.append({**base, "where": None, "file": f"{t['db']}/{t['table']}.00000.sql{suffix}"})
+    return units
+
+
+def _binlog_position(session: MysqlSession, version: str) -> dict:
+    """Позиция binlog и GTID под глобальной блокировкой."""
+    mariadb = "mariadb" in version.lower()
+    major_minor = tuple(int(x) for x in version.split("-")[0].split(".")[:2])
+    status_sql = "SHOW BINARY LOG STATUS" if not mariadb and major_minor >= (8, 2) else "SHOW MASTER STATUS"
+    pos: dict = {}
+    rows = session.query(status_sql)
+    if rows and len(rows[0]) >= 2:
+        pos["binlog_file"], pos["binlog_position"] = rows[0][0], int(rows[0][1])
+    gtid_var = "@@GLOBAL.gtid_binlog_pos" if mariadb else "@@GLOBAL.gtid_executed"
+    gtid = session.query(f"SELECT REPLACE({gtid_var}, '\\n', '')")
+    if gtid and gtid[0][0] not in ("", "NULL"):
+        pos["gtid"] = gtid[0][0]
+    return pos
+
+
+def _resume_point(out_dir: Path, resume: bool) -> tuple[Path, dict | None, dict[str, dict]]:
+    """
+    Каталог временного дампа, план и готовые куски. --resume: последний незавершённый дамп того же префикса
+    с журналом (имя артефакта — его, с датой первого запуска). Прочие незавершённые дампы удаляются.
+    """
+    m = re.match(r"^(.+_)\d{4}-\d{2}-\d{2}_\d{2}-\d{2}\.dir$", out_dir.name)
+    stale = checkpoint.partials(out_dir.parent, m.group(1), ".dir") if m else []
+    plan, done, tmp_dir = None, {}, out_dir.with_name(f".{out_dir.name}.tmp")
+    if resume and stale:
+        plan, done = checkpoint.load(stale[-1] / checkpoint.JOURNAL_NAME)
+        if plan is not None:
+            tmp_dir = stale.pop()
+        else:
+            log(f"Продолжение: в {stale[-1]} нет журнала — полный дамп")
+    elif resume:
+        log("Продолжение: незавершённого дампа нет — полный дамп")
+    for path in stale:
+        log(f"Удаление незавершённого дампа {path}")
+        shutil.rmtree(path, ignore_errors=True)
+    if plan is None:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+    return tmp_dir, plan, done
+
+
+def dump_parallel(
+    mysql_cmd: list[str],
+    mysqldump_cmd: list[str],
+    env: dict,
+    databases: list[str] | None,
+    out_dir: Path,
+    workers: int,
+    compress: str = "gzip",
+    level: int | None = None,
+    chunk_bytes: int = CHUNK_BYTES,
+    throttle=None,
+    threads: int = 0,
+    auto_min_mbps: float = codecs.AUTO_MIN_MBPS,
+    resume: bool = False,
+) -> tuple[int, Path]:
+    """
+    Дамп БД (databases; None — все пользовательские) в каталог out_dir через workers сессий одного снимка.
+    compress — кодек backup_codecs или "auto" (замер на образце строк). threads — потоков сжатия на каждый файл:
+    файлы пишутся параллельно, поэтому по умолчанию (0) — CPU / workers.
+    Пишется во временный .<имя>.tmp, переименовывается после успеха. Готовые куски отмечаются в журнале
+    (backup_checkpoint.py); при ошибке временный каталог остаётся, resume=True продолжает с него по плану
+    первого запуска — в новом снимке, поэтому такой дамп согласован только внутри кусков (metadata.json:
+    "consistent": false и позиции binlog всех снимков). Возвращает (код выхода, каталог артефакта).
+    """
+    tmp_dir, plan, done = _resume_point(out_dir, resume)
+    out_dir = tmp_dir.with_name(tmp_dir.name[1:-len(".tmp")])
+    threads = threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+    sessions: list[MysqlSession] = []
+    journal = None
+    try:
+        main = MysqlSession(mysql_cmd, env, "main")
+        sessions.append(main)
+        version = main.query("SELECT @@version")[0][0]
+        if plan is None:
+            if databases is None:
+                databases = [r[0] for r in main.query(
+                    f"SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME NOT IN ({_in_list(list(SYSTEM_SCHEMAS))})"
+                )]
+            tables = _load_tables(main, databases)
+            log(f"MySQL {version}: БД {len(databases)}, таблиц {len(tables)}, сессий {workers}")
+            if compress == "auto":
+                # Сессии читают параллельно — порог скорости делится между ними
+                compress, level, results = codecs.choose(_sample(main, tables, codecs.AUTO_SAMPLE),
+                                                         auto_min_mbps / max(1, workers), threads)
+                log(codecs.describe(compress, level, results, auto_min_mbps / max(1, workers)))
+            if level is None and compress != "none":
+                level = codecs.DEFAULT_LEVELS[compress]
+            suffix = codecs.SUFFIXES[compress]
+            # План — до снимка: границы кусков открыты с краёв, снимок на них не влияет.
+            # Нетранзакционные таблицы снимок не видит — их выгружаем целиком под глобальной блокировкой.
+            locked = [t for t in tables if t["engine"] not in TRANSACTIONAL_ENGINES]
+            units = [dict(u, locked=True) for u in _plan_units(main, locked, 0, suffix)]
+            units += _plan_units(main, [t for t in tables if t["engine"] in TRANSACTIONAL_ENGINES], chunk_bytes, suffix)
+            plan = {"started": time.time(), "databases": databases, "tables": len(tables), "compress": compress,
+                    "level": level, "units": units}
+            journal = checkpoint.Journal(tmp_dir / checkpoint.JOURNAL_NAME, plan)
+        else:
+            databases, compress, level, units = plan["databases"], plan["compress"], plan["level"], plan["units"]
+            suffix = codecs.SUFFIXES[compress]
+            done = checkpoint.verify(tmp_dir, done)
+            finished = sum(1 for u in units if u["file"] in done)
+            log(f"Продолжение дампа {out_dir.name} ({datetime.fromtimestamp(plan['started']):%Y-%m-%d %H:%M}): "
+                f"готово кусков {finished} из {len(units)}, кодек {compress}, сессий {workers}")
+            journal = checkpoint.Journal(tmp_dir / checkpoint.JOURNAL_NAME)
+        snapshots = sorted(({k: v for k, v in e.items() if k != "key"} for k, e in done.items() if k.startswith("snapshot:")),
+                           key=lambda e: e["time"])
+        attempt = len(snapshots) + 1
+
+        def finish(unit: dict, info: dict, seconds: float) -> None:
+            """Кусок на диске: fsync каталога, контрольная сумма и строка в журнале."""
+            unit.update(info, seconds=round(seconds, 3))
+            path = tmp_dir / unit["file"]
+            digest, size = hash_file(path)
+            checkpoint.fsync_dir(path.parent)
+            journal.done(unit["file"], file=unit["file"], size=size, algorithm=DEFAULT_CHECKSUM, digest=digest,
+                         attempt=attempt, **info)
+
+        for unit in units:
+            if unit["file"] in done:
+                unit.update({k: done[unit["file"]][k] for k in ("rows", "bytes_in", "bytes_out") if k in done[unit["file"]]})
+
+        # Соединения открываются до блокировки, чтобы не тратить на них время под FTWRL
+        pool_sessions = [MysqlSession(mysql_cmd, env, f"worker-{i + 1}") for i in range(max(1, workers))]
+        sessions.extend(pool_sessions)
+        for s in pool_sessions:
+            s.execute("SET SESSION sql_mode='', time_zone='+00:00', net_write_timeout=3600, wait_timeout=86400, "
+                      "TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        main.execute("SET SESSION sql_mode='', time_zone='+00:00', net_write_timeout=3600")
+
+        # FLUSH TABLES без блокировки заранее закрывает таблицы — сам FTWRL потом занимает миллисекунды
+        main.execute("FLUSH NO_WRITE_TO_BINLOG TABLES")
+        lock_started = time.monotonic()
+        main.execute("FLUSH TABLES WITH READ LOCK")
+        position = _binlog_position(main, version)
+        markers = [s.send("START TRANSACTION WITH CONSISTENT SNAPSHOT") for s in pool_sessions]
+        for s, m in zip(pool_sessions, markers):
+            s.wait(m)
+        snapshots.append(dict(position, time=time.time()))
+        journal.done(f"snapshot:{attempt}", **snapshots[-1])
+        locked_units = [u for u in units if u.get("locked") and u["file"] not in done]
+        for unit in locked_units:
+            t0 = time.monotonic()
+            finish(unit, dump_chunk(main, unit, tmp_dir, compress, level, threads=threads), time.monotonic() - t0)
+        main.execute("UNLOCK TABLES")
+        log(f"Снимок получен, глобальная блокировка {time.monotonic() - lock_started:.2f} с"
+            + (f" (нетранзакционных таблиц: {len(locked_units)})" if locked_units else "")
+            + (f", binlog {position.get('binlog_file')}:{position.get('binlog_position')}" if "binlog_file" in position else "")
+            + (f", GTID {position['gtid']}" if "gtid" in position else ""))
+
+        left = sorted((u for u in units if not u.get("locked") and u["file"] not in done), key=lambda u: -u["size"])
+        log(f"Кусков: {len(left)}" + (f" (ещё {len(units) - len(left) - len(locked_units)} готовы)" if attempt > 1 else ""))
+        todo: queue.Queue = queue.Queue()
+        for unit in left:
+            todo.put(unit)
+
+        def work(session: MysqlSession) -> None:
+            while True:
+                try:
+                    unit = todo.get_nowait()
+                except queue.Empty:
+                    return
+                t0 = time.monotonic()
+                finish(unit, dump_chunk(session, unit, tmp_dir, compress, level, throttle, threads), time.monotonic() - t0)
+
+        with ThreadPoolExecutor(max_workers=len(pool_sessions)) as pool:
+            for fut in [pool.submit(work, s) for s in pool_sessions]:
+                fut.result()
+        for s in pool_sessions:
+            s.execute("COMMIT")
+
+        # Схема без триггеров — до данных, триггеры — после (иначе сработают при загрузке)
+        db_args = ["--databases"] + databases
+        common = ["--no-data", "--single-transaction", "--skip-lock-tables", "--set-gtid-purged=OFF"] if "mariadb" not in version.lower() \
+            else ["--no-data", "--single-transaction", "--skip-lock-tables"]
+        for name, extra in (("schema", ["--routines", "--events", "--skip-triggers"]),
+                            ("triggers", ["--no-create-info", "--no-create-db", "--triggers", "--skip-routines", "--skip-events"])):
+            if f"{name}.sql{suffix}" in done:
+                continue
+            t0 = time.monotonic()
+            code = stream_to_file(mysqldump_cmd + common + extra + db_args, tmp_dir / f"{name}.sql{suffix}", compress=compress,
+                                  level=level, env=env, log_prefix=f"[mysqldump {name}] ", checksum=None, threads=threads)
+            if code != 0:
+                raise MysqlError(f"mysqldump ({name}) завершился с кодом {code}")
+            finish({"file": f"{name}.sql{suffix}"}, {}, time.monotonic() - t0)
+    except (MysqlError, OSError, ValueError) as e:
+        log(f"Ошибка параллельного дампа: {e}")
+        if journal is None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            log(f"Готовые куски остаются в {tmp_dir}: повторный запуск с --resume продолжит с них")
+        return 1, out_dir
+    finally:
+        for s in sessions:
+            s.close()
+        if throttle is not None:
+            throttle.close()
+        if journal is not None:
+            journal.close()
+
+    metadata = {
+        "format": "mysql-parallel-1",
+        "server_version": version,
+        "started": plan["started"],
+        "finished": time.time(),
+        "compress": compress,
+        "level": level,
+        "databases": databases,
+        **{k: v for k, v in snapshots[0].items() if k != "time"},
+        "schema": f"schema.sql{suffix}",
+        "triggers": f"triggers.sql{suffix}",
+        "chunks": [
+            {k: u[k] for k in ("db", "table", "file", "where", "rows", "bytes_in", "bytes_out") if k in u} for u in units
+        ],
+    }
+    if len(snapshots) > 1:
+        # Куски из разных снимков: для PITR и реплики позиция binlog одной точки не годится
+        metadata.update(consistent=False, snapshots=snapshots)
+        log(f"Внимание: дамп собран из {len(snapshots)} снимков — согласован только внутри кусков, "
+            "позиция binlog для PITR/реплики непригодна")
+    (tmp_dir / "metadata.json").write_text(json.dumps(metadata, ensure_ascii=False, indent=2))
+    (tmp_dir / checkpoint.JOURNAL_NAME).unlink()
+    if out_dir.exists():
+        shutil.rmtree(out_dir)  # повторный запуск в ту же минуту — как перезапись файла
+    os.replace(tmp_dir, out_dir)
+    write_file_manifest(out_dir)
+    rows = sum(u.get("rows", 0) for u in units)
+    raw = sum(u.get("bytes_in", 0) for u in units)
+    elapsed = max(time.time() - plan["started"], 1e-6)
+    log(f"Дамп в {out_dir}: таблиц {plan['tables']}, кусков {len(units)}, строк {rows}, "
+        f"{raw / 1e6:.1f} МБ SQL за {elapsed:.1f} с ({raw / elapsed / 1e6:.1f} МБ/с)")
+    return 0, out_dir
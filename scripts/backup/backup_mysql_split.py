@@ -0,0 +1,144 @@
+# Разбор потока mysqldump на инструкции для параллельного восстановления (restore_mysql.py --jobs): один проход
+# по распакованному потоку, в памяти — одна инструкция (строка INSERT — до net_buffer_length mysqldump).
+# Каждая инструкция получает назначение:
+#   preamble — SET из заголовка дампа (кодировка, UNIQUE_CHECKS, FOREIGN_KEY_CHECKS, SQL_MODE, TIME_ZONE,
+#              SQL_LOG_BIN): выполняются в каждом соединении;
+#   schema   — CREATE DATABASE, USE, DROP/CREATE TABLE, GTID_PURGED и всё нераспознанное — в исходном порядке
+#              одним соединением, до данных своей таблицы;
+#   data     — INSERT/REPLACE (таблица из INTO `...`): распределяются по загрузчикам; LOCK TABLES, UNLOCK TABLES
+#              и ALTER TABLE ... DISABLE/ENABLE KEYS отбрасываются — таблицу пишут несколько соединений;
+#   late     — представления (/*!50001 ...), процедуры, функции, события и триггеры (блоки DELIMITER ;;),
+#              DROP PROCEDURE/FUNCTION/EVENT/TRIGGER: после всех данных (триггеры не срабатывают на загрузке).
+# SET между инструкциями относятся к соседям: сохранение (SET @saved = @@var, SET var = значение) — к следующей
+# инструкции, возврат (SET var = @saved) — к предыдущей; так sql_mode триггера уходит вместе с триггером.
+from __future__ import annotations
+
+import re
+from typing import Iterator
+
+# Блок чтения распакованного потока
+BLOCK = 1 << 20
+
+PREAMBLE, SCHEMA, DATA, LATE = "preamble", "schema", "data", "late"
+
+# Начало инструкции: необязательный версионный комментарий /*!NNNNN и текст
+_HEAD_RE = re.compile(rb"^\s*(?:/\*!(\d{5})\s*)?(.*)", re.DOTALL)
+_INTO_RE = re.compile(rb"\bINTO\s+`((?:[^`]|``)+)`", re.IGNORECASE)
+_USE_RE = re.compile(rb"^USE\s+`((?:[^`]|``)+)`", re.IGNORECASE)
+# SET var = @saved (пользовательская переменная справа) — возврат значения после инструкции
+_RESTORE_RE = re.compile(rb"=\s*@[A-Za-z_]")
+_LATE_DROP_RE = re.compile(rb"^DROP\s+(?:PROCEDURE|FUNCTION|EVENT|TRIGGER)\b", re.IGNORECASE)
+_SKIP = (b"LOCK TABLES", b"UNLOCK TABLES")
+
+
+def lines(f, block: int = BLOCK) -> Iterator[bytes]:
+    """Строки потока с переводом строки (у распаковщиков кодеков readline есть не везде)."""
+    tail = b""
+    while True:
+        data = f.read(block)
+        if not data:
+            break
+        data = tail + data if tail else data
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            yield data[start:end + 1]
+            start = end + 1
+        tail = data[start:]
+    if tail:
+        yield tail
+
+
+def _name(quoted: bytes) -> str:
+    return quoted.replace(b"``", b"`").decode("utf-8", errors="replace")
+
+
+def _classify(text: bytes) -> tuple[str | None, str | None, str | None]:
+    """(назначение, БД из USE, таблица) инструкции; назначение None — отбросить, "set"/"restore" — SET."""
+    m = _HEAD_RE.match(text[:512])
+    version, body = m.group(1), m.group(2)
+    up = body[:32].upper()
+    if up.startswith(b"SET "):
+        if b"@@GLOBAL." in body.upper():
+            return SCHEMA, None, None  # GTID_PURGED и т.п. — один раз
+        return ("restore" if _RESTORE_RE.search(body) else "set"), None, None
+    if version == b"50001":
+        return LATE, None, None  # представления: временные заглушки и окончательные
+    if up.startswith((b"INSERT ", b"REPLACE ")):
+        into = _INTO_RE.search(body)
+        return DATA, None, _name(into.group(1)) if into else None
+    if up.startswith(_SKIP) or (up.startswith(b"ALTER TABLE") and body.rstrip().upper().endswith((b"KEYS */;", b"KEYS;"))):
+        return None, None, None
+    use = _USE_RE.match(body)
+    if use:
+        return SCHEMA, _name(use.group(1)), None
+    if _LATE_DROP_RE.match(body):
+        return LATE, None, None
+    return SCHEMA, None, None
+
+
+def statements(f) -> Iterator[tuple[str, str | None, str | None, bytes]]:
+    """
+    Инструкции дампа по порядку: (назначение, текущая БД, таблица для data, текст с переводами строк).
+    Комментарии -- и пустые строки отбрасываются.
+    """
+    db = None
+    preamble = True
+    last = SCHEMA
+    pending: list[bytes] = []  # SET-сохранения до следующей инструкции
+    stmt: list[bytes] = []
+    block: list[bytes] | None = None  # DELIMITER ;; ... DELIMITER ;
+
+    def emit(dest: str, table: str | None, text: bytes):
+        nonlocal preamble, last
+        preamble = False
+        # SET перед данными выполняются в schema: загрузчики получают только INSERT
+        set_dest = dest if dest != DATA else SCHEMA
+        for s in pending:
+            yield set_dest, db, None, s
+        pending.clear()
+        yield dest, db, table, text
+        last = dest
+
+    for line in lines(f):
+        if block is not None:
+            block.append(line)
+            if line[:10].upper().startswith(b"DELIMITER ") and line.strip()[10:].strip() == b";":
+                yield from emit(LATE, None, b"".join(block))
+                block = None
+            continue
+        if not stmt:
+            head = line[:16].lstrip()
+            if not head or head.startswith(b"--"):
+                continue
+            if head.upper().startswith(b"DELIMITER "):
+                block = [line]
+                continue
+        stmt.append(line)
+        if not line.rstrip().endswith(b";"):
+            continue
+        text = b"".join(stmt) if len(stmt) > 1 else stmt[0]
+        stmt = []
+        dest, use_db, table = _classify(text)
+        if dest is None:
+            continue
+        if dest == "set":
+            if preamble:
+                yield PREAMBLE, db, None, text
+            else:
+                pending.append(text)
+            continue
+        if dest == "restore":
+            yield (LATE if last == DATA else last), db, None, text
+            continue
+        if use_db is not None:
+            db = use_db
+        yield from emit(dest, table, text)
+    # Хвост без ';' или незакрытый DELIMITER — как есть, в конец
+    rest = b"".join(stmt) + b"".join(block or [])
+    for s in pending:
+        yield LATE, db, None, s
+    if rest.strip():
+        yield LATE, db, None, rest
@@ -0,0 +1,276 @@
+# Физический бэкап PostgreSQL (backup_postgres.py --physical): pg_basebackup -Ft в каталог pg_phys_<дата>.dir —
+# по tar на табличное пространство (base.tar, <oid>.tar), pg_wal.tar с WAL за время копии (-X stream) и
+# backup_manifest с SHA-256 каждого файла. Восстановление — распаковка tar, без пересборки индексов.
+# Сжатие каждого tar: pg_basebackup 15+ сжимает на клиенте сам, по мере приёма (--compress=client-zstd:workers=N —
+# многопоточно); старые версии пишут tar без сжатия, после копии все tar сжимаются параллельно (backup_codecs).
+# Один поток tar в stdout (pg_basebackup -D -) здесь не подходит: он только для кластера без табличных
+# пространств и без -X stream. Проверка (validate) — разбор каждого tar с распаковкой на лету и сверка
+# размеров и хешей файлов с backup_manifest, контрольной суммы самого манифеста и наличия WAL из WAL-Ranges.
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import backup_catalog as catalog
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_pg_wal as wal
+import backup_s3 as s3
+from backup_common import STREAM_BUFFER, dated_path, log, read_sidecar, run, write_file_manifest, write_sidecar
+
+PREFIX = "pg_phys"
+MANIFEST = "backup_manifest"
+# Как часто писать в лог объём и скорость во время копии, с
+PROGRESS_INTERVAL = 30.0
+# Алгоритмы backup_manifest, которые считаются hashlib; CRC32C не проверяется (только размер)
+_HASHES = {"SHA224": "sha224", "SHA256": "sha256", "SHA384": "sha384", "SHA512": "sha512"}
+
+
+def compress_args(major: int, codec: str, level: int | None, threads: int) -> list[str]:
+    """
+    Сжатие на клиенте pg_basebackup 15+ (метод:level=N[,workers=N] — потоки только у zstd). Пусто — без сжатия
+    или старая версия (тогда сжимает compress_tars после копии).
+    """
+    if codec == "none" or (major and major < 15):
+        return []
+    level = codecs.DEFAULT_LEVELS[codec] if level is None else level
+    detail = f"level={level}" + (f",workers={threads}" if codec == "zstd" and threads > 1 else "")
+    return [f"--compress=client-{codec}:{detail}"]
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for f in path.iterdir():
+        try:
+            total += f.stat().st_size
+        except OSError:
+            pass
+    return total
+
+
+def _progress(path: Path, stop: threading.Event, started: float) -> None:
+    """Объём каталога копии и средняя скорость — в лог раз в PROGRESS_INTERVAL секунд."""
+    while not stop.wait(PROGRESS_INTERVAL):
+        size = _dir_size(path) if path.is_dir() else 0
+        log(f"[pg_basebackup] записано {size / 1e9:.2f} ГБ, {size / max(time.monotonic() - started, 1e-6) / 1e6:.1f} МБ/с")
+
+
+def _compress_one(path: Path, codec: str, level: int | None, threads: int) -> Path:
+    out = path.with_name(path.name + codecs.SUFFIXES[codec])
+    tmp = out.with_name(f".{out.name}.tmp")
+    with open(path, "rb") as fin, open(tmp, "wb") as fout:
+        writer = codecs.open_writer(fout, codec, level, threads)
+        while True:
+            chunk = fin.read(STREAM_BUFFER)
+            if not chunk:
+                break
+            writer.write(chunk)
+        writer.close()
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, out)
+    path.unlink()
+    return out
+
+
+def compress_tars(path: Path, codec: str, level: int | None, threads: int) -> None:
+    """Все .tar каталога — параллельно, крупные первыми; потоки сжатия делятся между файлами."""
+    tars = sorted(path.glob("*.tar"), key=lambda p: p.stat().st_size, reverse=True)
+    if not tars or codec == "none":
+        return
+    per_file = max(1, threads // len(tars))
+    with ThreadPoolExecutor(max_workers=min(len(tars), threads)) as pool:
+        list(pool.map(lambda p: _compress_one(p, codec, level, per_file), tars))
+
+
+def backup_physical(args, dest: Path, prefix: list[str], codec: str, level: int | None, major: int,
+                    max_rate: float = 0) -> int:
+    """
+    pg_basebackup -Ft -X stream в pg_phys_<дата>.dir: сжатие tar, манифест, каталог бэкапов, S3.
+    max_rate — МБ/с, ограничивает сам pg_basebackup (--max-rate, на сервере). args.timeout — предел копии, с
+    (0 — без ограничения: кластер от терабайта копируется часами).
+    """
+    out_dir = dated_path(dest, PREFIX, ".dir")
+    tmp_dir = out_dir.with_name(f".{out_dir.name}.tmp")
+    threads = args.threads or os.cpu_count() or 1
+    level = codecs.DEFAULT_LEVELS.get(codec) if level is None else level
+    log(f"Физический бэкап кластера в {out_dir} (pg_basebackup {major or '?'}, {codec}"
+        + (f" уровень {level}" if codec != "none" else "") + ")")
+    metrics.annotate(artifact=out_dir)
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    cmd = prefix + [args.pg_basebackup, "-D", str(tmp_dir), "-Ft", "-X", "stream", "-c", args.checkpoint,
+                    "--manifest-checksums=SHA256", "--label", out_dir.name]
+    cmd += compress_args(major, codec, level, threads)
+    if max_rate > 0:
+        cmd.append(f"--max-rate={max(1, int(max_rate))}M")
+
+    started_wall = time.time()
+    started = time.monotonic()
+    stop = threading.Event()
+    threading.Thread(target=_progress, args=(tmp_dir, stop, started), daemon=True).start()
+    try:
+        code = run(cmd, log_prefix="[pg_basebackup] ", timeout=args.timeout)
+    finally:
+        stop.set()
+    if code != 0:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        log(f"Ошибка: pg_basebackup завершился с кодом {code}")
+        return code
+    copied = time.monotonic() - started
+    if not compress_args(major, codec, level, threads) and codec != "none":
+        log(f"Сжатие tar ({codec}, {threads} потоков)")
+        try:
+            compress_tars(tmp_dir, codec, level, threads)
+        except (OSError, ValueError) as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            log(f"Ошибка сжатия: {e}")
+            return 1
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    stored = _dir_size(out_dir)
+    try:
+        manifest = json.loads((out_dir / MANIFEST).read_bytes())
+    except (OSError, ValueError) as e:
+        log(f"Ошибка: нет {MANIFEST}: {e}")
+        return 1
+    raw = sum(f.get("Size", 0) for f in manifest.get("Files", []))
+    # WAL в манифесте не перечислен: степень сжатия — по данным без pg_wal.tar
+    wal_stored = sum(f.stat().st_size for f in out_dir.glob("pg_wal.tar*"))
+    data_stored = stored - wal_stored
+    metrics.add(bytes_read=raw, bytes_written=stored)
+    log(f"[pg_basebackup] данных {raw / 1e6:.1f} МБ -> {data_stored / 1e6:.1f} МБ "
+        f"(x{raw / data_stored if data_stored else 0:.2f}), WAL {wal_stored / 1e6:.1f} МБ, "
+        f"копия {copied:.1f} с, всего {elapsed:.1f} с, {raw / elapsed / 1e6:.1f} МБ/с")
+
+    write_file_manifest(out_dir)
+    side = read_sidecar(out_dir) or {}
+    side.pop("created", None)
+    write_sidecar(out_dir, dict(side, codec=codec, level=level, wal_ranges=manifest.get("WAL-Ranges", [])))
+    catalog.register(dest, out_dir, source=f"{os.environ.get('PGHOST', 'localhost')}:{os.environ.get('PGPORT', '5432')}",
+                     started=started_wall)
+    return s3.upload_artifact(args, out_dir)
+
+
+def _manifest_path(entry: dict) -> str:
+    if "Path" in entry:
+        return entry["Path"]
+    return bytes.fromhex(entry["Encoded-Path"]).decode(errors="surrogateescape")
+
+
+def _scan_tar(path: Path, member_prefix: str, algos: dict[str, str]) -> dict[str, tuple[int, str | None]]:
+    """Файлы tar (с распаковкой на лету): путь в каталоге данных -> (размер, хеш алгоритмом из манифеста)."""
+    found = {}
+    with codecs.open_reader(path) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = member_prefix + member.name.removeprefix("./")
+            algo = algos.get(name)
+            digest = None
+            if algo:
+                h = hashlib.new(algo)
+                src = tar.extractfile(member)
+                while True:
+                    chunk = src.read(STREAM_BUFFER)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                digest = h.hexdigest()
+            found[name] = (member.size, digest)
+    return found
+
+
+def list_tars(path: Path) -> dict[str, Path]:
+    """tar каталога копии: base, pg_wal, <oid> табличного пространства -> путь (с суффиксом кодека)."""
+    tars = {}
+    for f in sorted(path.iterdir()):
+        name = codecs.strip_suffix(f).name
+        if name.endswith(".tar"):
+            tars[name[:-4]] = f
+    return tars
+
+
+def validate(path: Path, workers: int = 0) -> dict:
+    """
+    Проверка каталога pg_phys_*.dir: контрольная сумма backup_manifest, каждый tar читается до конца,
+    размеры и хеши файлов сверяются с манифестом (tar — параллельно в workers потоках), WAL из WAL-Ranges есть.
+    """
+    started = time.monotonic()
+    data = (path / MANIFEST).read_bytes()
+    manifest = json.loads(data)
+    errors: list[str] = []
+    warnings: list[str] = []
+    # Контрольная сумма манифеста — SHA-256 всего текста до ключа "Manifest-Checksum"
+    pos = data.rfind(b'"Manifest-Checksum"')
+    if pos < 0 or hashlib.sha256(data[:pos]).hexdigest() != manifest.get("Manifest-Checksum"):
+        errors.append(f"{MANIFEST}: контрольная сумма не совпадает")
+    files = {_manifest_path(e): e for e in manifest.get("Files", [])}
+    algos = {p: _HASHES[e["Checksum-Algorithm"]] for p, e in files.items()
+             if e.get("Checksum-Algorithm") in _HASHES}
+    if len(algos) < len(files):
+        warnings.append(f"файлов без проверяемого хеша (CRC32C/NONE): {len(files) - len(algos)} — только размер")
+
+    tars = list_tars(path)
+    if "base" not in tars:
+        errors.append("нет base.tar")
+    jobs = [(f, "" if key in ("base", "pg_wal") else f"pg_tblspc/{key}/") for key, f in tars.items()]
+    found: dict[str, tuple[int, str | None]] = {}
+    wal_found: dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers or os.cpu_count() or 1)) as pool:
+        futures = {f: pool.submit(_scan_tar, f, member_prefix, algos) for f, member_prefix in jobs}
+        for f, fut in futures.items():
+            try:
+                result = fut.result()
+            except (OSError, tarfile.TarError) as e:
+                errors.append(f"{f.name}: ошибка чтения: {e}")
+                continue
+            if f == tars.get("pg_wal"):
+                wal_found = {name: size for name, (size, _) in result.items()}
+            else:
+                found.update(result)
+
+    for p, e in files.items():
+        if p not in found:
+            errors.append(f"нет файла {p}")
+            continue
+        size, digest = found[p]
+        if size != e.get("Size"):
+            errors.append(f"{p}: размер {size} вместо {e.get('Size')}")
+        elif p in algos and digest != e.get("Checksum"):
+            errors.append(f"{p}: хеш не совпадает")
+
+    # WAL на время копии: все сегменты от начала до конца каждого диапазона
+    segments = {Path(n).name: s for n, s in wal_found.items() if wal.SEGMENT_RE.match(Path(n).name)}
+    seg_size = next(iter(segments.values()), wal.DEFAULT_SEGMENT_SIZE)
+    for r in manifest.get("WAL-Ranges", []):
+        start, end = wal.parse_lsn(r["Start-LSN"]), wal.parse_lsn(r["End-LSN"])
+        needed = [wal.segment_name(int(r["Timeline"]), segno * seg_size, seg_size)
+                  for segno in range(start // seg_size, max(end - 1, start) // seg_size + 1)]
+        missing = [name for name in needed if name not in segments]
+        if missing:
+            errors.append(f"нет WAL диапазона {r['Start-LSN']}..{r['End-LSN']}: {len(missing)} из {len(needed)} "
+                          f"сегментов, первый {missing[0]}")
+    elapsed = max(time.monotonic() - started, 1e-6)
+    raw = sum(size for size, _ in found.values()) + sum(wal_found.values())
+    return {
+        "path": str(path),
+        "tars": len(tars),
+        "files": len(files),
+        "bytes": raw,
+        "wal_segments": len(segments),
+        "errors": errors,
+        "warnings": warnings,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(raw / elapsed / 1e6, 1),
+    }
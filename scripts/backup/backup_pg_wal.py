@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+Непрерывный архив WAL PostgreSQL и базовые копии для восстановления на момент времени (PITR).
+Хранилище (--dest): DEST/wal/<сегмент>.zst — сжатые сегменты WAL (кодек — backup_codecs.py, по суффиксу),
+DEST/pg_base_<дата>.tar.zst — базовые копии (pg_basebackup -Ft в stdout, поток через stream_to_artifact;
+в манифесте — стартовый LSN, линия времени и LSN, после которого копия согласована),
+DEST/spool/ — рабочий каталог pg_receivewal, DEST/wal.jsonl — журнал архивации (для status).
+Два способа получать WAL:
+  receive — управляемый pg_receivewal (слот репликации, перезапуск с задержкой при обрыве): законченные
+    сегменты сжимаются в wal/, в spool остаются только последний законченный и текущий .partial;
+  archive — цель archive_command: сегмент сжимается в wal/ атомарно (fsync файла и каталога); повтор с тем же
+    содержимым — успех, с другим — ошибка (сервер не удалит WAL и повторит).
+fetch — restore_command: сегмент из wal/ (или из spool, в т.ч. .partial — RPO в секунды) распаковывается в %p.
+base — базовая копия; --keep N оставляет N последних и удаляет WAL старше самой старой из них (как prune).
+status — последний сегмент в архиве и его возраст, отставание архива от сервера в байтах (pg_current_wal_lsn,
+  поток pg_receivewal из pg_stat_replication, ошибки pg_stat_archiver), скорость WAL за окно по журналу.
+  С --max-age/--max-lag-mb — код 2 при превышении (для мониторинга).
+Восстановление на время или LSN — scripts/restore/restore_postgres_pitr.py.
+Переменные окружения: PGHOST, PGPORT, PGUSER, PGPASSWORD (pg_receivewal — пользователь с REPLICATION).
+Использование:
+  python3 backup_pg_wal.py receive --dest /backup/pg-wal --slot backup --create-slot [--codec zstd]
+  archive_command = 'python3 /opt/backup/backup_pg_wal.py archive --dest /backup/pg-wal %p %f'
+  python3 backup_pg_wal.py fetch --dest /backup/pg-wal 000000010000000A0000002F /tmp/seg
+  python3 backup_pg_wal.py base --dest /backup/pg-wal --codec zstd --keep 7
+  python3 backup_pg_wal.py status --dest /backup/pg-wal [--json] [--max-age 600]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import backup_catalog as catalog
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_s3 as s3
+from backup_common import (
+    SIDECAR_SUFFIX,
+    STREAM_BUFFER,
+    dated_path,
+    log,
+    read_sidecar,
+    rotate_keep_n,
+    run,
+    run_capture,
+    stream_to_artifact,
+    write_sidecar,
+)
+
+WAL_DIR = "wal"
+SPOOL_DIR = "spool"
+JOURNAL_NAME = "wal.jsonl"
+STATE_NAME = "archive.json"
+BASE_PREFIX = "pg_base"
+# Размер сегмента, если сервер не спрашивали (initdb --wal-segsize по умолчанию)
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+# receive: как часто забирать законченные сегменты из spool; задержка перезапуска pg_receivewal (растёт вдвое)
+POLL = 5.0
+RESTART_DELAY = 1.0
+RESTART_DELAY_MAX = 60.0
+# status: окно для скорости WAL и хвост журнала, который для этого читается
+RATE_WINDOW = 3600
+JOURNAL_TAIL_BYTES = 1024 * 1024
+
+SEGMENT_RE = re.compile(r"^[0-9A-F]{24}$")
+HISTORY_RE = re.compile(r"^[0-9A-F]{8}\.history$")
+BACKUP_RE = re.compile(r"^[0-9A-F]{24}\.[0-9A-F]{8}\.backup$")
+_LABEL_RE = {
+    "start_lsn": re.compile(r"^START WAL LOCATION: ([0-9A-F]+/[0-9A-F]+)", re.M),
+    "start_segment": re.compile(r"^START WAL LOCATION: .*\(file ([0-9A-F]{24})\)", re.M),
+    "start_time": re.compile(r"^START TIME: (.+)$", re.M),
+    "timeline": re.compile(r"^START TIMELINE: (\d+)", re.M),
+}
+
+STATUS_SQL = (
+    "SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_receive_lsn() ELSE pg_current_wal_lsn() END, "
+    "(SELECT flush_lsn FROM pg_stat_replication WHERE application_name = 'pg_receivewal' "
+    "ORDER BY flush_lsn DESC NULLS LAST LIMIT 1), "
+    "(SELECT failed_count FROM pg_stat_archiver), (SELECT last_failed_wal FROM pg_stat_archiver)"
+)
+
+
+def parse_lsn(lsn: str) -> int:
+    """LSN вида 16/B374D848 -> число."""
+    hi, _, lo = lsn.strip().partition("/")
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+
+def format_lsn(value: int) -> str:
+    return f"{value >> 32:X}/{value & 0xFFFFFFFF:X}"
+
+
+def segment_number(name: str, segment_size: int) -> int:
+    """Номер сегмента по имени (без линии времени): логический файл * сегментов в нём + сегмент."""
+    return int(name[8:16], 16) * (0x100000000 // segment_size) + int(name[16:24], 16)
+
+
+def segment_name(timeline: int, lsn: int, segment_size: int) -> str:
+    """Имя сегмента, содержащего lsn."""
+    per_file = 0x100000000 // segment_size
+    segno = lsn // segment_size
+    return f"{timeline:08X}{segno // per_file:08X}{segno % per_file:08X}"
+
+
+def _psql(args: argparse.Namespace, sql: str) -> list[str] | None:
+    """Одна строка результата запроса (поля через табуляцию); None — сервер недоступен."""
+    code, out = run_capture([args.psql, "-X", "-At", "-F", "\t", "-d", "postgres", "-c", sql])
+    if code != 0:
+        return None
+    return out.rstrip("\n").split("\t")
+
+
+def load_state(dest: Path) -> dict:
+    try:
+        return json.loads((dest / STATE_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def segment_size(dest: Path, args: argparse.Namespace | None = None) -> int:
+    """Размер сегмента: из archive.json, иначе у сервера (wal_segment_size, запоминается), иначе 16 МБ."""
+    state = load_state(dest)
+    if "segment_size" in state:
+        return state["segment_size"]
+    row = _psql(args, "SELECT setting FROM pg_settings WHERE name = 'wal_segment_size'") if args else None
+    if row and row[0].isdigit():
+        size = int(row[0])
+        tmp = dest / f".{STATE_NAME}.tmp"
+        tmp.write_text(json.dumps(dict(state, segment_size=size)))
+        os.replace(tmp, dest / STATE_NAME)
+        return size
+    return DEFAULT_SEGMENT_SIZE
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def find_archived(dest: Path, name: str) -> Path | None:
+    """Файл WAL в архиве под любым суффиксом кодека."""
+    for suffix in codecs.SUFFIXES.values():
+        path = dest / WAL_DIR / (name + suffix)
+        if path.is_file():
+            return path
+    return None
+
+
+def list_archived(dest: Path) -> dict[str, Path]:
+    """Имя файла WAL (без суффикса кодека) -> путь в архиве."""
+    wal = dest / WAL_DIR
+    if not wal.is_dir():
+        return {}
+    files = {}
+    for path in wal.iterdir():
+        if not path.name.startswith("."):
+            files[codecs.strip_suffix(path).name] = path
+    return files
+
+
+def _same_content(path: Path, src: Path) -> bool:
+    """Архивная копия (сжатая) совпадает с исходным файлом байт в байт."""
+    with codecs.open_reader(path) as a, open(src, "rb") as b:
+        while True:
+            x = a.read(STREAM_BUFFER)
+            y = b.read(len(x) or 1)
+            if x != y:
+                return False
+            if not x:
+                return True
+
+
+def _journal(dest: Path, name: str, size: int, stored: int) -> None:
+    """Строка в wal.jsonl (O_APPEND: короткие строки из разных процессов не перемешиваются)."""
+    line = json.dumps({"time": round(time.time(), 3), "name": name, "size": size, "stored": stored}) + "\n"
+    fd = os.open(dest / JOURNAL_NAME, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def archive_file(dest: Path, src: Path, name: str, codec: str, level: int | None, threads: int = 1) -> int:
+    """
+    Сжать файл WAL в DEST/wal/<name><суффикс>: временный файл, fsync, rename, fsync каталога —
+    сервер удалит сегмент сразу после кода 0. Уже в архиве: то же содержимое — 0, другое — 1.
+    """
+    wal = dest / WAL_DIR
+    wal.mkdir(parents=True, exist_ok=True)
+    existing = find_archived(dest, name)
+    if existing is not None:
+        if _same_content(existing, src):
+            log(f"{name}: уже в архиве ({existing.name})")
+            return 0
+        log(f"Ошибка: {name} уже в архиве с другим содержимым ({existing}) — не перезаписываем")
+        return 1
+    out_path = wal / (name + codecs.SUFFIXES[codec])
+    tmp_path = wal / f".{out_path.name}.tmp"
+    size = 0
+    try:
+        with open(src, "rb") as fin, open(tmp_path, "wb") as fout:
+            writer = codecs.open_writer(fout, codec, level, threads)
+            while True:
+                chunk = fin.read(STREAM_BUFFER)
+                if not chunk:
+                    break
+                size += len(chunk)
+                writer.write(chunk)
+            writer.close()
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_path, out_path)
+        _fsync_dir(wal)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка архивации {name}: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return 1
+    _journal(dest, name, size, out_path.stat().st_size)
+    return 0
+
+
+def fetch(dest: Path, name: str, target: Path) -> int:
+    """
+    restore_command: файл WAL из архива (или из spool pg_receivewal) в target. Нет файла — код 1:
+    сервер так узнаёт, что WAL кончился (и спрашивает несуществующие .history), поэтому без шума в логе.
+    """
+    path = find_archived(dest, name)
+    spool = dest / SPOOL_DIR
+    if path is None and (spool / name).is_file():
+        path = spool / name
+    if path is None and SEGMENT_RE.match(name) and (spool / f"{name}.partial").is_file():
+        # pg_receivewal дополняет .partial нулями до полного размера — сервер дочитает до последней записи
+        path = spool / f"{name}.partial"
+        log(f"{name}: из spool ({path.name})")
+    if path is None:
+        return 1
+    tmp_path = target.with_name(f".{target.name}.tmp")
+    try:
+        with codecs.open_reader(path) as fin, open(tmp_path, "wb") as fout:
+            while True:
+                chunk = fin.read(STREAM_BUFFER)
+                if not chunk:
+                    break
+                fout.write(chunk)
+        os.replace(tmp_path, target)
+    except OSError as e:
+        log(f"Ошибка извлечения {name}: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return 1
+    return 0
+
+
+def sweep_spool(dest: Path, codec: str, level: int | None, threads: int = 1) -> tuple[int, int]:
+    """
+    Законченные файлы из spool — в архив. В spool остаются последний законченный сегмент (по нему
+    pg_receivewal находит, откуда продолжать после перезапуска) и .partial. Возвращает (файлов, ошибок).
+    """
+    spool = dest / SPOOL_DIR
+    names = sorted(p.name for p in spool.iterdir() if SEGMENT_RE.match(p.name) or HISTORY_RE.match(p.name))
+    archived = list_archived(dest)
+    done = failed = 0
+    for name in names:
+        if name in archived:
+            continue
+        if archive_file(dest, spool / name, name, codec, level, threads) == 0:
+            done += 1
+        else:
+            failed += 1
+            break  # порядок важен: следующий сегмент без предыдущего бесполезен
+    if not failed:
+        segments = [n for n in names if SEGMENT_RE.match(n)]
+        for name in [n for n in names if HISTORY_RE.match(n)] + segments[:-1]:
+            (spool / name).unlink(missing_ok=True)
+    return done, failed
+
+
+def receive(args: argparse.Namespace, dest: Path) -> int:
+    """Управляемый pg_receivewal: перезапуск при выходе (с растущей задержкой), сжатие законченных сегментов."""
+    spool = dest / SPOOL_DIR
+    spool.mkdir(parents=True, exist_ok=True)
+    segment_size(dest, args)
+    if args.slot and args.create_slot:
+        code = run([args.pg_receivewal, "--slot", args.slot, "--create-slot", "--if-not-exists"],
+                   log_prefix="[pg_receivewal] ", timeout=3600)
+        if code != 0:
+            return code
+    cmd = [args.pg_receivewal, "-D", str(spool), "--no-loop"]
+    if args.slot:
+        cmd.extend(["--slot", args.slot])
+    if args.synchronous:
+        cmd.append("--synchronous")
+
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    proc = None
+    started = 0.0
+    delay = RESTART_DELAY
+    total = 0
+    while not stop.is_set():
+        if proc is None or proc.poll() is not None:
+            if proc is not None:
+                # Долго проработал — обрыв случайный, задержка сначала; падает сразу — задержка растёт
+                if time.monotonic() - started >= RESTART_DELAY_MAX:
+                    delay = RESTART_DELAY
+                log(f"pg_receivewal завершился с кодом {proc.returncode}, перезапуск через {delay:.0f} с")
+                if stop.wait(delay):
+                    break
+                delay = min(delay * 2, RESTART_DELAY_MAX)
+            log(f"[pg_receivewal] Выполняется: {' '.join(cmd)}")
+            try:
+                proc = subprocess.Popen(cmd)
+            except OSError as e:
+                log(f"Ошибка: команда не найдена — {e}")
+                return -1
+            started = time.monotonic()
+        done, failed = sweep_spool(dest, args.codec, args.level, args.threads or 1)
+        if done:
+            total += done
+            log(f"Архив WAL: +{done} (всего за запуск {total})")
+        stop.wait(args.poll)
+    if proc is not None and proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    done, failed = sweep_spool(dest, args.codec, args.level, args.threads or 1)
+    log(f"Остановлено. Сегментов в архив за запуск: {total + done}")
+    return 1 if failed else 0
+
+
+def _backup_label(path: Path) -> dict:
+    """Поля backup_label из базовой копии: он первый в base.tar, читается только начало потока."""
+    with codecs.open_reader(path) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+        for i, member in enumerate(tar):
+            if member.name.removeprefix("./") == "backup_label":
+                text = tar.extractfile(member).read().decode(errors="replace")
+                return {key: m.group(1).strip() for key, rx in _LABEL_RE.items() if (m := rx.search(text))}
+            if i >= 4:
+                break
+    return {}
+
+
+def list_bases(dest: Path) -> list[tuple[Path, dict]]:
+    """Базовые копии с манифестом, от старых к новым."""
+    bases = []
+    for path in sorted(dest.glob(f"{BASE_PREFIX}_*")):
+        if path.name.endswith(SIDECAR_SUFFIX):
+            continue
+        manifest = read_sidecar(path) or {}
+        if "start_lsn" in manifest:
+            bases.append((path, manifest))
+    return bases
+
+
+def prune(dest: Path) -> int:
+    """Удалить WAL старше стартового сегмента самой старой базовой копии (.history не трогаются)."""
+    bases = list_bases(dest)
+    if not bases:
+        log("Базовых копий нет — WAL не удаляется")
+        return 0
+    size = segment_size(dest)
+    oldest = segment_number(bases[0][1]["start_segment"], size)
+    removed = 0
+    for name, path in list_archived(dest).items():
+        if (SEGMENT_RE.match(name) or BACKUP_RE.match(name)) and segment_number(name, size) < oldest:
+            path.unlink()
+            removed += 1
+    log(f"WAL: удалено {removed} файлов старше {bases[0][1]['start_segment']} ({bases[0][0].name})")
+    return 0
+
+
+def base(args: argparse.Namespace, dest: Path) -> int:
+    """Базовая копия: pg_basebackup -Ft -D - (WAL берётся из архива: -X none) -> сжатие -> pg_base_<дата>.tar.*"""
+    out_path = dated_path(dest, BASE_PREFIX, ".tar" + codecs.SUFFIXES.get(args.codec, ""))
+    log(f"Базовая копия PostgreSQL в {out_path}")
+    source = f"{os.environ.get('PGHOST', 'localhost')}:{os.environ.get('PGPORT', '5432')}"
+    metrics.annotate(target=source, artifact=out_path)
+    size = segment_size(dest, args)
+    try:
+        upload = s3.open_stream_upload(args, out_path)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка S3: {e}")
+        return 1
+    cmd = [args.pg_basebackup, "-D", "-", "-Ft", "-X", "none", "-c", args.checkpoint, "--label", out_path.name]
+    started = time.time()
+    code, out_path = stream_to_artifact(cmd, out_path, compress=args.codec, level=args.level,
+                                        log_prefix="[pg_basebackup] ", timeout=args.timeout, upload=upload,
+                                        threads=args.threads, auto_min_mbps=args.auto_min_mbps)
+    metrics.annotate(artifact=out_path)
+    if code != 0:
+        return code
+    try:
+        label = _backup_label(out_path)
+    except (OSError, tarfile.TarError) as e:
+        label = {}
+        log(f"Ошибка чтения backup_label: {e}")
+    if "start_lsn" not in label:
+        log(f"Ошибка: в {out_path.name} нет backup_label — это не копия pg_basebackup")
+        return 1
+    # Копия согласована не раньше, чем сервер дошёл до этого LSN после её окончания (оценка сверху)
+    row = _psql(args, STATUS_SQL)
+    manifest = read_sidecar(out_path) or {}
+    manifest.pop("created", None)
+    write_sidecar(out_path, dict(manifest, start_lsn=label["start_lsn"], start_segment=label.get("start_segment")
+                                 or segment_name(int(label.get("timeline", 1)), parse_lsn(label["start_lsn"]), size),
+                                 timeline=int(label.get("timeline", 1)), start_time=label.get("start_time"),
+                                 end_lsn=row[0] if row and row[0] else None, finished=time.time()))
+    log(f"Начало копии: {label['start_lsn']}, линия времени {label.get('timeline', 1)}")
+    catalog.register(dest, out_path, source=source, started=started)
+
+    if args.keep > 0:
+        rotate_keep_n(dest, f"{BASE_PREFIX}_", args.keep)
+        prune(dest)
+    s3.rotate_s3(args, f"{BASE_PREFIX}_")
+    log("Готово.")
+    return 0
+
+
+def _rate(dest: Path, window: int) -> dict:
+    """Скорость WAL за последние window секунд по хвосту wal.jsonl."""
+    path = dest / JOURNAL_NAME
+    now = time.time()
+    entries = []
+    try:
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - JOURNAL_TAIL_BYTES))
+            lines = f.read().splitlines()
+        if end > JOURNAL_TAIL_BYTES:
+            lines = lines[1:]  # первая строка хвоста обрезана
+    except OSError:
+        lines = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry.get("time", 0) >= now - window:
+            entries.append(entry)
+    raw = sum(e["size"] for e in entries)
+    stored = sum(e["stored"] for e in entries)
+    return {
+        "window_s": window,
+        "files": len(entries),
+        "mb_per_s": round(raw / window / 1e6, 3),
+        "segments_per_hour": round(len(entries) * 3600 / window, 1),
+        "ratio": round(raw / stored, 2) if stored else None,
+    }
+
+
+def status(args: argparse.Namespace, dest: Path) -> int:
+    """Состояние архива: последний сегмент, отставание от сервера, скорость WAL, базовые копии."""
+    size = segment_size(dest, None if args.no_server else args)
+    archived = list_archived(dest)
+    segments = sorted((n for n in archived if SEGMENT_RE.match(n)), key=lambda n: segment_number(n, size))
+    report: dict = {"dest": str(dest), "segment_size": size, "segments": len(segments),
+                    "stored_bytes": sum(p.stat().st_size for p in archived.values())}
+    last_lsn = None
+    spool = dest / SPOOL_DIR
+    if segments:
+        last = segments[-1]
+        last_lsn = (segment_number(last, size) + 1) * size
+        report.update(first_segment=segments[0], last_segment=last, archived_lsn=format_lsn(last_lsn),
+                      last_age_s=round(time.time() - archived[last].stat().st_mtime, 1))
+        # Пропуски считаются с начала самой старой базовой копии: раньше WAL не нужен
+        numbers = {segment_number(n, size) for n in segments}
+        if spool.is_dir():
+            numbers |= {segment_number(p.name[:24], size) for p in spool.iterdir() if SEGMENT_RE.match(p.name[:24])}
+        first, newest = min(numbers), max(numbers)
+        bases = list_bases(dest)
+        if bases:
+            first = max(first, segment_number(bases[0][1]["start_segment"], size))
+        report["gaps"] = max(0, (newest - first + 1) - len([n for n in numbers if n >= first]))
+    partial = sorted(spool.glob("*.partial")) if spool.is_dir() else []
+    if partial:
+        report.update(partial=partial[-1].name, partial_age_s=round(time.time() - partial[-1].stat().st_mtime, 1))
+    report["rate"] = _rate(dest, args.window)
+    report["bases"] = [{"name": p.name, "start_lsn": m["start_lsn"], "end_lsn": m.get("end_lsn"),
+                        "finished": m.get("finished")} for p, m in list_bases(dest)]
+
+    row = None if args.no_server else _psql(args, STATUS_SQL)
+    if row and row[0]:
+        current = parse_lsn(row[0])
+        report["server_lsn"] = row[0]
+        if last_lsn is not None:
+            report["archive_lag_bytes"] = max(0, current - last_lsn)
+        if len(row) > 1 and row[1]:
+            report["receiver_lsn"] = row[1]
+            report["stream_lag_bytes"] = max(0, current - parse_lsn(row[1]))
+        if len(row) > 3 and row[2]:
+            report["archiver_failed"] = int(row[2])
+            report["archiver_last_failed"] = row[3] or None
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"Архив {dest}: сегментов {report['segments']}, {report['stored_bytes'] / 1e6:.1f} МБ")
+        if segments:
+            print(f"  последний {report['last_segment']} (до {report['archived_lsn']}), {report['last_age_s']:.0f} с назад;"
+                  f" пропусков {report['gaps']}")
+        if partial:
+            print(f"  текущий в spool: {report['partial']}, {report['partial_age_s']:.0f} с назад")
+        if "server_lsn" in report:
+            print(f"  сервер {report['server_lsn']}, отставание архива {report.get('archive_lag_bytes', 0) / 1e6:.1f} МБ"
+                  + (f", поток pg_receivewal {report['stream_lag_bytes'] / 1e6:.1f} МБ" if "stream_lag_bytes" in report else ""))
+        rate = report["rate"]
+        print(f"  WAL за {rate['window_s']} с: {rate['files']} файлов, {rate['mb_per_s']} МБ/с"
+              + (f", сжатие x{rate['ratio']}" if rate["ratio"] else ""))
+        print(f"  базовых копий: {len(report['bases'])}" + (f", последняя {report['bases'][-1]['name']}" if report["bases"] else ""))
+
+    code = 0
+    # С pg_receivewal живость видна по .partial: на тихом сервере законченные сегменты появляются редко
+    age = report.get("partial_age_s", report.get("last_age_s", float("inf")))
+    if args.max_age and age > args.max_age:
+        log(f"WAL не поступал дольше {args.max_age} с")
+        code = 2
+    if args.max_lag_mb and report.get("archive_lag_bytes", 0) > args.max_lag_mb * 1e6:
+        log(f"Отставание архива больше {args.max_lag_mb} МБ")
+        code = 2
+    if report.get("gaps"):
+        log(f"В архиве пропущено сегментов: {report['gaps']}")
+        code = 2
+    return code
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Архив WAL PostgreSQL и базовые копии (PITR)")
+    parser.add_argument("command", choices=["receive", "archive", "fetch", "base", "prune", "status"])
+    parser.add_argument("items", nargs="*", help="archive: %%p %%f; fetch: %%f %%p")
+    parser.add_argument("--dest", required=True, help="Каталог архива WAL и базовых копий")
+    parser.add_argument("--slot", default=None, help="receive: слот репликации для pg_receivewal")
+    parser.add_argument("--create-slot", action="store_true", help="receive: создать слот, если его нет")
+    parser.add_argument("--synchronous", action="store_true", help="receive: fsync WAL сразу (pg_receivewal --synchronous)")
+    parser.add_argument("--poll", type=float, default=POLL, help="receive: как часто забирать сегменты из spool, с")
+    parser.add_argument("--keep", type=int, default=0, help="base: оставить N последних копий и WAL с начала самой старой")
+    parser.add_argument("--checkpoint", choices=["fast", "spread"], default="fast", help="base: контрольная точка перед копией")
+    parser.add_argument("--timeout", type=int, default=24 * 3600, help="base: таймаут pg_basebackup, с")
+    parser.add_argument("--window", type=int, default=RATE_WINDOW, help="status: окно для скорости WAL, с")
+    parser.add_argument("--max-age", type=float, default=0, help="status: код 2, если последний сегмент старше N с")
+    parser.add_argument("--max-lag-mb", type=float, default=0, help="status: код 2, если архив отстаёт больше чем на N МБ")
+    parser.add_argument("--no-server", action="store_true", help="status: не обращаться к серверу")
+    parser.add_argument("--json", action="store_true", help="status: JSON в stdout")
+    parser.add_argument("--pg-receivewal", default="pg_receivewal", help="Путь к pg_receivewal")
+    parser.add_argument("--pg-basebackup", default="pg_basebackup", help="Путь к pg_basebackup")
+    parser.add_argument("--psql", default="psql", help="Путь к psql")
+    codecs.add_codec_args(parser, "zstd" if codecs.available("zstd") else "gzip")
+    s3.add_s3_args(parser)
+    args = parser.parse_intermixed_args()
+    if args.command in ("receive", "archive") and args.codec == "auto":
+        parser.error("для WAL кодек задаётся явно: замер на каждом сегменте дороже самого сжатия")
+    if args.command in ("archive", "fetch") and len(args.items) != 2:
+        parser.error(f"{args.command}: нужны два аргумента ({'%p %f' if args.command == 'archive' else '%f %p'})")
+
+    dest = Path(args.dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    if args.command == "archive":
+        src, name = Path(args.items[0]), args.items[1]
+        # archive_command запускается с каталогом данных как текущим: %p относительный
+        return archive_file(dest, src, name, args.codec, args.level, args.threads or 1)
+    if args.command == "fetch":
+        return fetch(dest, args.items[0], Path(args.items[1]))
+    if args.command == "receive":
+        return receive(args, dest)
+    if args.command == "base":
+        return metrics.run_main("backup", "pg", lambda: base(args, dest))
+    if args.command == "prune":
+        return prune(dest)
+    return status(args, dest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
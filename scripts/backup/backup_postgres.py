@@ -1,61 +1,457 @@
 #!/usr/bin/env python3
 """
-Бэкап PostgreSQL: pg_dump (одна БД) или pg_dumpall (все БД).
-Формат: custom (-Fc) для сжатия и последующей проверки pg_restore --list.
+Бэкап PostgreSQL: pg_dump (одна БД) или все БД кластера (--all).
+Одна БД: формат custom (-Fc) для сжатия и последующей проверки pg_restore --list.
+Все БД (--all): глобальные объекты один раз (pg_dumpall --globals-only), затем каждая БД отдельно
+в формате directory (pg_dump -Fd -j N). Несколько БД дампятся одновременно; общий лимит соединений
+и CPU делится между ними. --dumpall — прежний режим: весь кластер одним .sql через pg_dumpall.
+Нагрузка на источник: --max-rate (МБ/с; одна БД — дамп идёт через pipe, --adaptive — по RTT до сервера),
+--ionice, --io-max/--io-weight (cgroup v2; для --all — единственный способ ограничить скорость).
+Сжатие — встроенное в pg_dump (--codec zstd|lz4|gzip|none|auto → pg_dump --compress метод:уровень; zstd и lz4 —
+с pg_dump 16, на старых версиях — gzip). Кодек и уровень пишутся в манифест артефакта, pg_restore определяет их
+по заголовку сам. --codec auto: замер кодеков на строках крупнейших таблиц (COPY ... LIMIT через psql).
+--physical: физическая копия кластера pg_basebackup -Ft в каталог pg_phys_<дата>.dir — tar на каждое табличное
+пространство, сжатый многопоточно (backup_pg_physical.py), WAL за время копии и backup_manifest с SHA-256;
+восстановление без пересборки индексов, backup_verify.py сверяет tar с манифестом.
+--all --resume: готовые БД отмечаются в журнале в каталоге бэкапов, после сбоя повторный запуск пропускает их.
+--s3 s3://бакет/префикс: готовый артефакт выгружается в S3 (multipart, параллельные части); с --max-rate поток
+одной БД уходит в S3 в том же проходе, что и запись файла.
 Переменные окружения: PGHOST, PGPORT, PGUSER, PGPASSWORD, PGDATABASE (для одной БД).
 Использование:
   python3 backup_postgres.py --dest /backup/pg [--database NAME] [--all] [--rotate-days N]
+  python3 backup_postgres.py --dest /backup/pg --all --parallel-dbs 4 --jobs 4 --max-connections 16 --max-cpu 8
+  python3 backup_postgres.py --dest /backup/pg --database mydb --max-rate 40 --adaptive --ionice best-effort:7
+  python3 backup_postgres.py --dest /backup/pg --physical --codec zstd --threads 8 --rotate-days 7
 """
 from __future__ import annotations
 
 import argparse
 import os
+import re
+import shutil
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Добавляем путь к общему модулю (текущая папка)
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from backup_common import dated_path, log, run
+import backup_catalog as catalog
+import backup_checkpoint as checkpoint
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_dedup as dedup
+import backup_s3 as s3
+from backup_pg_physical import backup_physical
+from backup_common import (
+    add_io_args,
+    dated_path,
+    io_setup,
+    log,
+    read_sidecar,
+    rotate_by_days,
+    run,
+    run_capture,
+    stream_to_file,
+    write_file_manifest,
+    write_sidecar,
+)
+
+# БД меньше этого размера дампятся одним потоком: -j для них только тратит соединения
+SMALL_DB_BYTES = 256 * 1024 * 1024
+# --all: журнал готовых БД прерванного запуска (--resume) в каталоге бэкапов
+ALL_JOURNAL = ".pg_all.checkpoint.jsonl"
+
+# --codec auto: крупнейшие таблицы БД и строк из каждой для образца
+SAMPLE_TABLES_SQL = (
+    "SELECT format('%I.%I', schemaname, relname) FROM pg_stat_user_tables "
+    "ORDER BY pg_total_relation_size(relid) DESC LIMIT 3"
+)
+SAMPLE_ROWS = 20000
+
+LIST_DATABASES_SQL = (
+    "SELECT datname, pg_database_size(datname) FROM pg_database "
+    "WHERE datallowconn AND NOT datistemplate ORDER BY 2 DESC"
+)
+
+
+def _source(db: str | None = None) -> str:
+    """Источник для каталога бэкапов: host:port[/db] из переменных libpq."""
+    src = f"{os.environ.get('PGHOST', 'localhost')}:{os.environ.get('PGPORT', '5432')}"
+    return f"{src}/{db}" if db else src
+
+
+class _Budget:
+    """Общий бюджет соединений и CPU: задача ждёт, пока освободится нужное количество обоих."""
+
+    def __init__(self, connections: int, cpu: int) -> None:
+        self.connections = connections
+        self.cpu = cpu
+        self._cond = threading.Condition()
+
+    def acquire(self, connections: int, cpu: int) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self.connections >= connections and self.cpu >= cpu)
+            self.connections -= connections
+            self.cpu -= cpu
+
+    def release(self, connections: int, cpu: int) -> None:
+        with self._cond:
+            self.connections += connections
+            self.cpu += cpu
+            self._cond.notify_all()
+
+
+def list_databases(psql: str) -> list[tuple[str, int]] | None:
+    """Список БД кластера (кроме шаблонов) с размером, от больших к меньшим."""
+    code, out = run_capture([psql, "-At", "-F", "\t", "-d", "postgres", "-c", LIST_DATABASES_SQL])
+    if code != 0:
+        return None
+    dbs = []
+    for row in out.splitlines():
+        name, _, size = row.partition("\t")
+        if name:
+            dbs.append((name, int(size or 0)))
+    return dbs
+
+
+def pg_major(tool: str) -> int:
+    """Основная версия утилиты PostgreSQL (pg_dump, pg_basebackup: --version); 0 — не удалось определить."""
+    code, out = run_capture([tool, "--version"])
+    m = re.search(r"(\d+)(?:\.\d+)?", out) if code == 0 else None
+    return int(m.group(1)) if m else 0
+
+
+def choose_codec(args: argparse.Namespace, db: str) -> tuple[str, int | None]:
+    """(кодек, уровень) для pg_dump: --codec auto — замер на образце строк крупнейших таблиц db."""
+    if args.codec != "auto":
+        return args.codec, args.level
+    code, out = run_capture([args.psql, "-X", "-At", "-d", db, "-c", SAMPLE_TABLES_SQL])
+    parts = []
+    for table in out.split() if code == 0 else []:
+        code, rows = run_capture([args.psql, "-X", "-d", db, "-c",
+                                  f"COPY (SELECT * FROM {table} LIMIT {SAMPLE_ROWS}) TO STDOUT"], timeout=300)
+        if code == 0:
+            parts.append(rows.encode())
+    codec, level, results = codecs.choose(b"".join(parts)[:codecs.AUTO_SAMPLE], args.auto_min_mbps, 1)
+    log(codecs.describe(codec, level, results, args.auto_min_mbps))
+    return codec, level
+
+
+def pg_compress_args(major: int, codec: str, level: int | None) -> tuple[list[str], str, int]:
+    """
+    Аргумент сжатия pg_dump и фактические (кодек, уровень). До 16 pg_dump умеет только gzip (-Z 0-9):
+    zstd и lz4 заменяются на gzip с уровнем по умолчанию.
+    """
+    if codec == "none":
+        return ["--compress=0"], "none", 0
+    if major and major < 16 and codec != "gzip":
+        log(f"pg_dump {major}: {codec} поддерживается с 16 — сжатие gzip")
+        codec, level = "gzip", None
+    level = codecs.DEFAULT_LEVELS[codec] if level is None else level
+    if major and major < 16:
+        return [f"--compress={level}"], codec, level
+    return [f"--compress={codec}:{level}"], codec, level
+
+
+def record_codec(path: Path, codec: str, level: int) -> None:
+    """Кодек в манифест артефакта, который pg_dump записал сам (имя не меняется: сжатие внутри формата)."""
+    manifest = read_sidecar(path)
+    if manifest is not None:
+        manifest.pop("created", None)
+        write_sidecar(path, dict(manifest, codec=codec, level=level))
+
+
+def _probe_host() -> tuple[str, str]:
+    """Адрес сервера для запасной пробы RTT (TCP): PGHOST (каталог сокета -> путь к сокету) и PGPORT."""
+    host = os.environ.get("PGHOST", "localhost")
+    port = os.environ.get("PGPORT", "5432")
+    if host.startswith("/"):
+        host = f"{host}/.s.PGSQL.{port}"
+    return host, port
+
+
+def dump_database_dir(
+    pg_dump: str,
+    dest: Path,
+    db: str,
+    jobs: int,
+    budget: _Budget,
+    prefix: list[str],
+    args: argparse.Namespace,
+    compress: tuple[list[str], str, int] = ([], "gzip", 6),
+    journal: checkpoint.Journal | None = None,
+) -> int:
+    """
+    pg_dump -Fd -j jobs во временный каталог, затем rename в dated_path. Соединений: jobs + 1.
+    Готовая (и выгруженная в S3) БД отмечается в journal. Прерванный pg_dump -Fd не продолжается —
+    незавершённые каталоги этой БД от прошлых запусков удаляются.
+    """
+    for stale in checkpoint.partials(dest, f"pg_{db}_", ".dir"):
+        log(f"Удаление незавершённого дампа {stale}")
+        shutil.rmtree(stale, ignore_errors=True)
+    out_dir = dated_path(dest, f"pg_{db}", ".dir")
+    tmp_dir = out_dir.with_name(f".{out_dir.name}.tmp")
+    budget.acquire(jobs + 1, jobs)
+    started = time.time()
+    try:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        cmd = prefix + [pg_dump, "-Fd", "-j", str(jobs), "--no-owner", "--no-acl"] + compress[0] + ["-f", str(tmp_dir), db]
+        code = run(cmd, log_prefix=f"[pg_dump {db}] ", timeout=args.timeout)
+    finally:
+        budget.release(jobs + 1, jobs)
+    if code != 0:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        log(f"Ошибка бэкапа БД {db} (код {code})")
+        return code
+    if out_dir.exists():
+        shutil.rmtree(out_dir)  # повторный запуск в ту же минуту — как перезапись файла
+    os.replace(tmp_dir, out_dir)
+    write_file_manifest(out_dir)
+    record_codec(out_dir, compress[1], compress[2])
+    metrics.add_artifact(out_dir)
+    catalog.register(dest, out_dir, source=_source(db), started=started)
+    log(f"БД {db} сохранена в {out_dir}")
+    code = s3.upload_artifact(args, out_dir)
+    if code == 0 and journal is not None:
+        checkpoint.fsync_dir(dest)
+        journal.done(f"db:{db}", artifact=out_dir.name)
+    return code
+
+
+def _resume_all(dest: Path, resume: bool) -> tuple[dict | None, dict[str, dict]]:
+    """--all --resume: план и готовые единицы прерванного запуска; готова та, чей артефакт на месте с манифестом."""
+    journal_path = dest / ALL_JOURNAL
+    if not resume:
+        journal_path.unlink(missing_ok=True)
+        return None, {}
+    plan, done = checkpoint.load(journal_path)
+    if plan is None:
+        log("Продолжение: незавершённого запуска --all нет — полный бэкап")
+        journal_path.unlink(missing_ok=True)
+        return None, {}
+    done = {key: e for key, e in done.items() if read_sidecar(dest / e.get("artifact", "")) is not None}
+    return plan, done
+
+
+def backup_all_parallel(args: argparse.Namespace, dest: Path, prefix: list[str]) -> tuple[int, list[str]]:
+    """
+    Глобальные объекты + параллельный дамп каждой БД. Возвращает (код, префиксы для ротации).
+    Готовые артефакты отмечаются в журнале ALL_JOURNAL; --resume пропускает их после сбоя.
+    """
+    dbs = list_databases(args.psql)
+    if dbs is None:
+        log("Ошибка: не удалось получить список БД")
+        return 1, []
+    plan, done = _resume_all(dest, args.resume)
+    if plan is None:
+        # Кодек один на все БД: образец — из самой крупной
+        codec, level = choose_codec(args, dbs[0][0]) if dbs else (args.codec, args.level)
+        plan = {"started": time.time(), "codec": codec, "level": level}
+        journal = checkpoint.Journal(dest / ALL_JOURNAL, plan)
+    else:
+        codec, level = plan["codec"], plan["level"]
+        ready = [key.split(":", 1)[1] for key in done if key.startswith("db:")]
+        log(f"Продолжение бэкапа --all ({time.strftime('%Y-%m-%d %H:%M', time.localtime(plan['started']))}): "
+            f"готовы {'globals, ' if 'globals' in done else ''}БД {len(ready)} — {', '.join(ready) or 'нет'}")
+        journal = checkpoint.Journal(dest / ALL_JOURNAL)
+    try:
+        code = _backup_all(args, dest, prefix, dbs, done, codec, level, journal)
+    finally:
+        journal.close()
+    if code != 0:
+        log(f"Готовые БД отмечены в {dest / ALL_JOURNAL}: повторный запуск с --resume пропустит их")
+        return code, []
+    (dest / ALL_JOURNAL).unlink()
+    return 0, ["pg_globals_"] + [f"pg_{db}_" for db, _ in dbs]
+
+
+def _backup_all(
+    args: argparse.Namespace,
+    dest: Path,
+    prefix: list[str],
+    dbs: list[tuple[str, int]],
+    done: dict[str, dict],
+    codec: str,
+    level: int | None,
+    journal: checkpoint.Journal,
+) -> int:
+    """Тело --all: globals и БД, которых нет в done; каждая готовая единица — строка в journal."""
+    if "globals" not in done:
+        globals_path = dated_path(dest, "pg_globals", ".sql")
+        log(f"Глобальные объекты (роли, табличные пространства) в {globals_path}")
+        started = time.time()
+        code = run(prefix + [args.pg_dumpall, "--globals-only", "-f", str(globals_path)], log_prefix="[pg_dumpall] ",
+                   timeout=args.timeout)
+        if code != 0:
+            return code
+        write_file_manifest(globals_path)
+        metrics.add_artifact(globals_path)
+        catalog.register(dest, globals_path, source=_source(), started=started)
+        code = s3.upload_artifact(args, globals_path)
+        if code != 0:
+            return code
+        checkpoint.fsync_dir(dest)
+        journal.done("globals", artifact=globals_path.name)
+
+    compress = pg_compress_args(pg_major(args.pg_dump), codec, level)
+    dbs = [(db, size) for db, size in dbs if f"db:{db}" not in done]
+
+    max_cpu = max(1, args.max_cpu)
+    # Лимиты не меньше потребности одной задачи, иначе она ждала бы вечно
+    jobs = max(1, min(args.jobs, max_cpu, args.max_connections - 1))
+    budget = _Budget(max(args.max_connections, jobs + 1), max_cpu)
+    log(f"БД: {len(dbs)}, одновременно до {args.parallel_dbs}, pg_dump -j до {jobs}, "
+        f"лимит соединений {budget.connections}, CPU {budget.cpu}")
+
+    # Крупные БД стартуют первыми (список уже отсортирован по размеру) — окно определяет самая большая
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel_dbs)) as pool:
+        futures = {
+            db: pool.submit(
+                dump_database_dir,
+                args.pg_dump, dest, db, jobs if size >= SMALL_DB_BYTES else 1, budget, prefix, args, compress, journal,
+            )
+            for db, size in dbs
+        }
+    failed = [db for db, fut in futures.items() if fut.result() != 0]
+    if failed:
+        log(f"Ошибка: не удалось сохранить БД: {', '.join(failed)}")
+        return 1
+    return 0
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Бэкап PostgreSQL (pg_dump / pg_dumpall)")
     parser.add_argument("--dest", required=True, help="Каталог для сохранения бэкапов")
     parser.add_argument("--database", "-d", default=None, help="Имя БД (если не указано — из PGDATABASE или все при --all)")
-    parser.add_argument("--all", action="store_true", help="Бэкап всех БД (pg_dumpall), один файл")
+    parser.add_argument("--all", action="store_true", help="Бэкап всех БД: globals + pg_dump -Fd для каждой БД параллельно")
+    parser.add_argument("--dumpall", action="store_true", help="С --all: весь кластер одним файлом через pg_dumpall (.sql)")
+    parser.add_argument("--parallel-dbs", type=int, default=2, help="Сколько БД дампить одновременно (--all)")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="pg_dump -j для одной БД (--all)")
+    parser.add_argument("--max-connections", type=int, default=16, help="Общий лимит соединений к серверу (--all)")
+    parser.add_argument("--max-cpu", type=int, default=os.cpu_count() or 1, help="Общий лимит потоков pg_dump (--all)")
     parser.add_argument("--rotate-days", type=int, default=0, help="Удалить бэкапы старше N дней (0 = не удалять)")
     parser.add_argument("--pg-dump", default="pg_dump", help="Путь к pg_dump")
     parser.add_argument("--pg-dumpall", default="pg_dumpall", help="Путь к pg_dumpall")
+    parser.add_argument("--psql", default="psql", help="Путь к psql (список БД для --all)")
+    parser.add_argument("--timeout", type=int, default=0,
+                        help="Предел работы каждой команды pg_dump/pg_dumpall/pg_basebackup, с (0 — без ограничения)")
+    parser.add_argument("--physical", action="store_true",
+                        help="Физическая копия кластера: pg_basebackup -Ft, tar на табличное пространство, WAL, backup_manifest")
+    parser.add_argument("--checkpoint", choices=["fast", "spread"], default="fast",
+                        help="--physical: контрольная точка перед копией (spread — без пика нагрузки, но дольше)")
+    parser.add_argument("--pg-basebackup", default="pg_basebackup", help="Путь к pg_basebackup (--physical)")
+    parser.add_argument("--dedup-store", default=None, help="Одна БД: перенести .dump в дедуплицирующее хранилище (backup_dedup.py)")
+    parser.add_argument("--resume", action="store_true",
+                        help="--all: продолжить прерванный запуск — готовые БД (журнал в каталоге бэкапов) пропускаются")
+    codecs.add_codec_args(parser, "gzip")
+    add_io_args(parser)
+    s3.add_s3_args(parser)
     args = parser.parse_args()
+    if args.physical and (args.all or args.database or args.dedup_store):
+        parser.error("--physical копирует весь кластер: без --all, --database и --dedup-store")
+    if args.resume and (not args.all or args.dumpall):
+        parser.error("--resume продолжает бэкап по БД: только с --all (без --dumpall)")
+    if args.dedup_store and args.codec != "none":
+        # Сжатые блоки данных pg_dump -Fc меняются целиком от любой правки: соседние дампы не делят чанки
+        log(f"--dedup-store: сжатый дамп дедуплицируется плохо, --codec {args.codec} заменён на none (--compress=0)")
+        args.codec = "none"
 
     dest = Path(args.dest)
     dest.mkdir(parents=True, exist_ok=True)
+    physical_rate = 0.0
+    if args.physical:
+        # pg_basebackup ограничивает скорость сам, на сервере: pipe для Throttle здесь нет
+        physical_rate, args.max_rate = args.max_rate, 0
+    if args.all and args.max_rate > 0:
+        log("--max-rate с --all не действует (pg_dump пишет файлы сам) — используйте --io-max")
+        args.max_rate = 0
+    # --adaptive: SELECT в постоянной сессии psql (-w: без запроса пароля, только PGPASSWORD/.pgpass)
+    probe_db = (None if args.all else args.database) or os.environ.get("PGDATABASE", "postgres")
+    prefix, throttle = io_setup(args, dest, *_probe_host(), "pg_dump", [args.psql, "-X", "-w", "-q", "-At", "-d", probe_db])
+    metrics.annotate(target=_source(None if args.all or args.physical else args.database or os.environ.get("PGDATABASE", "postgres")))
 
-    if args.all:
+    if args.physical:
+        dbs = list_databases(args.psql)
+        codec, level = choose_codec(args, dbs[0][0] if dbs else "postgres")
+        code = backup_physical(args, dest, prefix, codec, level, pg_major(args.pg_basebackup), physical_rate)
+        if code != 0:
+            return code
+        prefixes_rotate = ["pg_phys_"]
+    elif args.all and args.dumpall:
         out_path = dated_path(dest, "pg_all", ".sql")
         log(f"Бэкап всех БД в {out_path}")
-        cmd = [args.pg_dumpall, "--no-owner", "--no-acl", "-f", str(out_path)]
-        code = run(cmd, log_prefix="[pg_dumpall] ")
+        metrics.annotate(artifact=out_path)
+        cmd = prefix + [args.pg_dumpall, "--no-owner", "--no-acl", "-f", str(out_path)]
+        started = time.time()
+        code = run(cmd, log_prefix="[pg_dumpall] ", timeout=args.timeout)
+        if code != 0:
+            return code
+        write_file_manifest(out_path)
+        catalog.register(dest, out_path, source=_source(), started=started)
+        code = s3.upload_artifact(args, out_path)
+        if code != 0:
+            return code
+        prefixes_rotate = ["pg_all_"]
+    elif args.all:
+        code, prefixes_rotate = backup_all_parallel(args, dest, prefix)
         if code != 0:
             return code
-        prefix_rotate = "pg_all_"
     else:
         db = args.database or os.environ.get("PGDATABASE", "postgres")
         out_path = dated_path(dest, f"pg_{db}", ".dump")
         log(f"Бэкап БД {db} в {out_path}")
-        cmd = [args.pg_dump, "-Fc", "--no-owner", "--no-acl", "-f", str(out_path), db]
-        code = run(cmd, log_prefix="[pg_dump] ")
-        if code != 0:
-            return code
-        prefix_rotate = f"pg_{db}_"
+        metrics.annotate(artifact=out_path)
+        compress, codec, level = pg_compress_args(pg_major(args.pg_dump), *choose_codec(args, db))
+        cmd = prefix + [args.pg_dump, "-Fc", "--no-owner", "--no-acl"] + compress + [db]
+        started = time.time()
+        if throttle is not None:
+            # Ограничение скорости возможно только на pipe — ценой смещений данных в TOC (см. ниже).
+            # Хеш, манифест и выгрузка в S3 — в stream_to_file.
+            try:
+                upload = s3.open_stream_upload(args, out_path)
+            except (OSError, ValueError) as e:
+                log(f"Ошибка S3: {e}")
+                return 1
+            code = stream_to_file(cmd, out_path, compress="none", log_prefix="[pg_dump] ", throttle=throttle,
+                                  upload=upload, timeout=args.timeout)
+            throttle.close()
+            if code != 0:
+                return code
+            record_codec(out_path, codec, level)
+        else:
+            # -Fc пишется в файл, а не в pipe: иначе в TOC нет смещений данных и pg_restore -j не работает.
+            # Хеш считается сразу после записи, пока файл в кэше страниц.
+            code = run(cmd[:-1] + ["-f", str(out_path), db], log_prefix="[pg_dump] ", timeout=args.timeout)
+            if code != 0:
+                return code
+            write_file_manifest(out_path)
+            record_codec(out_path, codec, level)
+            code = s3.upload_artifact(args, out_path)
+            if code != 0:
+                return code
+        if args.dedup_store:
+            code = dedup.store_artifact(args.dedup_store, out_path)
+            if code != 0:
+                return code
+        else:
+            catalog.register(dest, out_path, source=_source(db), started=started)
+        prefixes_rotate = [f"pg_{db}_"]
 
     if args.rotate_days > 0:
-        from backup_common import rotate_by_days
-        rotate_by_days(dest, prefix_rotate, args.rotate_days)
+        for prefix in prefixes_rotate:
+            rotate_by_days(dest, prefix, args.rotate_days)
+        if args.dedup_store:
+            for prefix in prefixes_rotate:
+                dedup.rotate_by_days(args.dedup_store, prefix, args.rotate_days)
+    for prefix in prefixes_rotate:
+        s3.rotate_s3(args, prefix)
 
     log("Готово.")
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("backup", "pg", main))
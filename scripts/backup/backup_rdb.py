@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+"""
+Потоковая проверка RDB-файла Redis без redis-check-rdb: заголовок и версия, все опкоды и кодировки
+значений (строки с LZF, ziplist, listpack, intset, quicklist, стримы, модули, хеши с TTL полей),
+контрольная сумма CRC64 в конце файла. Отчёт: ключей по БД, ключей с TTL.
+Сжатый RDB (.rdb.zst, .rdb.lz4, .rdb.gz — backup_redis.py --codec) разбирается через распаковку на лету
+(backup_codecs.open_reader): размер заранее неизвестен, поэтому последние 8 байт потока придерживаются до конца.
+Файл читается один раз блоками; память постоянная (блок + очередь блоков на CRC). CRC64 считается
+в пуле процессов: каждый блок — как остаток от деления многочлена (операции над int в C, без побайтового
+цикла), остатки склеиваются по порядку.
+Использование:
+  python3 backup_rdb.py /backup/redis/redis_2025-02-11_12-00.rdb [--workers 4] [--no-crc] [--json]
+  python3 backup_rdb.py --self-test   # разбор синтетических RDB (библиотека функций, ключи, CRC)
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import backup_codecs as codecs
+from backup_common import log
+
+BLOCK = 4 << 20
+MAX_RDB_VERSION = 12
+# Блобы в LZF распаковываются для проверки структуры, только если не больше этого размера
+MAX_LZF_CHECK = 16 << 20
+
+# CRC-64/Jones (как в Redis): отражённый, init 0, xorout 0. Многочлен в прямой записи, со старшим битом x^64
+_POLY = (1 << 64) | 0xAD93D23594C935A9
+_REV8 = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+_XK: dict[int, int] = {}
+
+
+class RdbError(Exception):
+    pass
+
+
+def _clmul(a: int, c: int) -> int:
+    """Умножение многочленов над GF(2) (без переносов): a — любой длины, c — до 64 бит."""
+    r = 0
+    shift = 0
+    while c:
+        if c & 1:
+            r ^= a << shift
+        c >>= 1
+        shift += 1
+    return r
+
+
+def _mod_small(v: int) -> int:
+    """v mod P для v до ~192 бит: деление столбиком."""
+    for i in range(v.bit_length() - 1, 63, -1):
+        if v >> i & 1:
+            v ^= _POLY << (i - 64)
+    return v
+
+
+def _xk(k: int) -> int:
+    """x^k mod P (возведение в степень квадратами), с кешем: длины блоков повторяются."""
+    v = _XK.get(k)
+    if v is None:
+        v, base, e = 1, 2, k
+        while e:
+            if e & 1:
+                v = _mod_small(_clmul(v, base))
+            base = _mod_small(_clmul(base, base))
+            e >>= 1
+        _XK[k] = v
+    return v
+
+
+def crc64_block(data: bytes) -> int:
+    """Остаток (M(x) * x^64) mod P блока: биты каждого байта разворачиваются (отражённый CRC), далее — свёртка
+    старшей половины через x^k mod P, пока не останется ~192 бит."""
+    nbits = len(data) * 8 + 64
+    v = int.from_bytes(data.translate(_REV8), "big") << 64
+    while nbits > 192:
+        k = nbits // 2
+        v = _clmul(v >> k, _xk(k)) ^ (v & ((1 << k) - 1))
+        nbits = max(k, nbits - k + 64) + 1
+    return _mod_small(v)
+
+
+def crc64_combine(r_a: int, r_b: int, len_b: int) -> int:
+    """Остаток для A||B по остаткам A и B: R_A * x^(8*len_b) + R_B."""
+    return _mod_small(_clmul(r_a, _xk(len_b * 8))) ^ r_b
+
+
+def crc64_value(r: int) -> int:
+    """Итоговое значение CRC (как его пишет Redis) из остатка: разворот 64 бит."""
+    return int(f"{r:064b}"[::-1], 2)
+
+
+def crc64(data: bytes) -> int:
+    return crc64_value(crc64_block(data))
+
+
+class _Reader:
+    """
+    Последовательное чтение блоками; каждый загруженный блок (кроме 8 байт контрольной суммы) уходит на CRC.
+    crc_limit=None — длина потока неизвестна (сжатый файл): на CRC уходит всё, кроме последних 8 байт.
+    """
+
+    def __init__(self, f, size: int, crc_limit: int | None, pool: ProcessPoolExecutor | None, workers: int) -> None:
+        self._f = f
+        self.size = size
+        self._crc_limit = crc_limit
+        self._pool = pool
+        self._inflight: deque = deque()
+        self._max_inflight = max(2, workers * 2)
+        self._crc = 0
+        self._loaded = 0
+        self._buf = b""
+        self._pos = 0
+        self._held = b""
+        self.offset = 0  # позиция в файле следующего непрочитанного байта
+
+    def _feed_crc(self, block: bytes, start: int) -> None:
+        end = start + len(block) if self._crc_limit is None else min(start + len(block), self._crc_limit)
+        if end <= start:
+            return
+        part = block[: end - start] if end - start < len(block) else block
+        if self._pool is None:
+            self._crc = crc64_combine(self._crc, crc64_block(part), len(part))
+            return
+        self._inflight.append((self._pool.submit(crc64_block, part), len(part)))
+        while len(self._inflight) > self._max_inflight:
+            self._drain_one()
+
+    def _drain_one(self) -> None:
+        fut, n = self._inflight.popleft()
+        self._crc = crc64_combine(self._crc, fut.result(), n)
+
+    def crc(self) -> int:
+        while self._inflight:
+            self._drain_one()
+        return crc64_value(self._crc)
+
+    def _load(self) -> bool:
+        block = self._f.read(BLOCK)
+        if not block:
+            return False
+        if self._crc_limit is None:
+            data = self._held + block
+            self._held = data[-8:]
+            self._feed_crc(data[:-8], self._loaded)
+        else:
+            self._feed_crc(block, self._loaded)
+        self._loaded += len(block)
+        self._buf = block
+        self._pos = 0
+        return True
+
+    def read(self, n: int) -> bytes:
+        if self._pos + n <= len(self._buf):
+            out = self._buf[self._pos:self._pos + n]
+            self._pos += n
+            self.offset += n
+            return out
+        parts = [self._buf[self._pos:]]
+        need = n - len(parts[0])
+        while need > 0:
+            if not self._load():
+                raise RdbError(f"файл обрезан: нужно ещё {need} байт на смещении {self.offset + n - need}")
+            take = self._buf[:need]
+            self._pos = len(take)
+            parts.append(take)
+            need -= len(take)
+        self.offset += n
+        return b"".join(parts)
+
+    def skip(self, n: int) -> None:
+        """Пропуск n байт без сборки в память (данные всё равно проходят через CRC)."""
+        avail = len(self._buf) - self._pos
+        if n <= avail:
+            self._pos += n
+            self.offset += n
+            return
+        left = n - avail
+        while left > 0:
+            if not self._load():
+                raise RdbError(f"файл обрезан: нужно ещё {left} байт на смещении {self.offset + n - left}")
+            step = min(left, len(self._buf))
+            self._pos = step
+            left -= step
+        self.offset += n
+
+    def byte(self) -> int:
+        return self.read(1)[0]
+
+    def at_eof(self) -> bool:
+        return self._pos >= len(self._buf) and not self._f.read(1)
+
+
+class _Walker:
+    def __init__(self, reader: _Reader, version: int) -> None:
+        self.r = reader
+        self.version = version
+        self.blobs_checked = 0
+
+    # --- длины и строки ---
+
+    def length(self) -> tuple[int, bool]:
+        """(длина, закодировано ли значение специально) — rdbLoadLen."""
+        b = self.r.byte()
+        kind = b >> 6
+        if kind == 0:
+            return b & 0x3F, False
+        if kind == 1:
+            return ((b & 0x3F) << 8) | self.r.byte(), False
+        if kind == 3:
+            return b & 0x3F, True
+        if b == 0x80:
+            return struct.unpack(">I", self.r.read(4))[0], False
+        if b == 0x81:
+            return struct.unpack(">Q", self.r.read(8))[0], False
+        raise RdbError(f"неизвестная кодировка длины 0x{b:02x} на смещении {self.r.offset - 1}")
+
+    def plain_length(self) -> int:
+        n, enc = self.length()
+        if enc:
+            raise RdbError(f"ожидалась длина, а не закодированное значение (смещение {self.r.offset})")
+        return n
+
+    def skip_string(self) -> None:
+        n, enc = self.length()
+        if not enc:
+            self.r.skip(n)
+        elif n in (0, 1, 2):
+            self.r.skip(1 << n)
+        elif n == 3:
+            clen = self.plain_length()
+            self.plain_length()
+            self.r.skip(clen)
+        else:
+            raise RdbError(f"неизвестная кодировка строки {n} на смещении {self.r.offset}")
+
+    def small_string(self, limit: int = 1 << 20) -> bytes:
+        """Короткая строка целиком (имена, ID модулей и т.п.)."""
+        n, enc = self.length()
+        if not enc:
+            if n > limit:
+                raise RdbError(f"слишком длинная служебная строка ({n} байт)")
+            return self.r.read(n)
+        if n in (0, 1, 2):
+            return str(int.from_bytes(self.r.read(1 << n), "little", signed=True)).encode()
+        if n == 3:
+            clen, ulen = self.plain_length(), self.plain_length()
+            if ulen > limit:
+                raise RdbError(f"слишком длинная служебная строка ({ulen} байт)")
+            return lzf_decompress(self.r.read(clen), ulen)
+        raise RdbError(f"неизвестная кодировка строки {n} на смещении {self.r.offset}")
+
+    def blob(self, kind: str) -> None:
+        """Строка-контейнер (ziplist/listpack/intset/zipmap): проверка заголовка и терминатора без чтения целиком."""
+        start = self.r.offset
+        n, enc = self.length()
+        if enc and n == 3:
+            clen, ulen = self.plain_length(), self.plain_length()
+            if ulen > MAX_LZF_CHECK:
+                self.r.skip(clen)
+                return
+            _check_blob(kind, lzf_decompress(self.r.read(clen), ulen), start)
+        elif enc:
+            raise RdbError(f"{kind}: закодирован как число (смещение {start})")
+        elif n <= 64:
+            _check_blob(kind, self.r.read(n), start)
+        else:
+            head = self.r.read(10)
+            self.r.skip(n - 11)
+            _check_blob(kind, head, start, total=n, last=self.r.byte())
+        self.blobs_checked += 1
+
+    # --- значения ---
+
+    def value(self, t: int) -> None:
+        if t == 0:
+            self.skip_string()
+        elif t in (1, 2):
+            for _ in range(self.plain_length()):
+                self.skip_string()
+        elif t == 3:
+            for _ in range(self.plain_length()):
+                self.skip_string()
+                dlen = self.r.byte()
+                if dlen < 253:
+                    self.r.skip(dlen)
+        elif t == 4:
+            for _ in range(self.plain_length() * 2):
+                self.skip_string()
+        elif t == 5:
+            for _ in range(self.plain_length()):
+                self.skip_string()
+                self.r.skip(8)
+        elif t == 7:
+            self.plain_length()  # ID модуля
+            self.module_body()
+        elif t == 9:
+            self.blob("zipmap")
+        elif t in (10, 12, 13):
+            self.blob("ziplist")
+        elif t == 11:
+            self.blob("intset")
+        elif t == 14:
+            for _ in range(self.plain_length()):
+                self.blob("ziplist")
+        elif t in (16, 17, 20):
+            self.blob("listpack")
+        elif t == 18:
+            for _ in range(self.plain_length()):
+                container = self.plain_length()
+                if container == 1:
+                    self.skip_string()
+                elif container == 2:
+                    self.blob("listpack")
+                else:
+                    raise RdbError(f"quicklist: неизвестный контейнер {container}")
+        elif t in (15, 19, 21):
+            self.stream(t)
+        elif t in (22, 24):
+            if t == 24:
+                self.r.skip(8)  # минимальное время истечения полей
+            for _ in range(self.plain_length()):
+                self.plain_length()  # TTL поля
+                self.skip_string()
+                self.skip_string()
+        elif t in (23, 25):
+            if t == 25:
+                self.r.skip(8)
+            self.blob("listpack")
+        else:
+            raise RdbError(f"неизвестный тип значения {t} на смещении {self.r.offset - 1}")
+
+    def module_body(self) -> None:
+        """Сериализация модуля (RDB_TYPE_MODULE_2 / MODULE_AUX): опкоды до EOF (0)."""
+        while True:
+            op = self.plain_length()
+            if op == 0:
+                return
+            if op in (1, 2):
+                self.plain_length()
+            elif op == 3:
+                self.r.skip(4)
+            elif op == 4:
+                self.r.skip(8)
+            elif op == 5:
+                self.skip_string()
+            else:
+                raise RdbError(f"модуль: неизвестный опкод {op} на смещении {self.r.offset}")
+
+    def stream(self, t: int) -> None:
+        for _ in range(self.plain_length()):
+            if len(self.small_string()) != 16:
+                raise RdbError(f"стрим: ключ узла не 16 байт (смещение {self.r.offset})")
+            self.blob("listpack")
+        for _ in range(3):  # length, last_id.ms, last_id.seq
+            self.plain_length()
+        if t >= 19:
+            for _ in range(5):  # first_id, max_deleted_entry_id, entries_added
+                self.plain_length()
+        for _ in range(self.plain_length()):  # группы потребителей
+            self.skip_string()
+            self.plain_length()
+            self.plain_length()
+            if t >= 19:
+                self.plain_length()  # entries_read
+            for _ in range(self.plain_length()):  # PEL группы
+                self.r.skip(16 + 8)
+                self.plain_length()
+            for _ in range(self.plain_length()):  # потребители
+                self.skip_string()
+                self.r.skip(8 if t < 21 else 16)  # seen_time [, active_time]
+                self.r.skip(16 * self.plain_length())
+
+
+def _check_blob(kind: str, data: bytes, offset: int, total: int | None = None, last: int | None = None) -> None:
+    """Заголовок контейнера: объявленный размер совпадает с реальным, в конце терминатор 0xFF."""
+    total = len(data) if total is None else total
+    last = data[-1] if last is None and data else last
+    if kind in ("ziplist", "listpack"):
+        if len(data) < 7 or int.from_bytes(data[:4], "little") != total:
+            raise RdbError(f"{kind}: неверный размер в заголовке (смещение {offset})")
+        if kind == "ziplist" and int.from_bytes(data[4:8], "little") >= total:
+            raise RdbError(f"ziplist: неверное смещение хвоста (смещение {offset})")
+    elif kind == "intset":
+        if len(data) < 8:
+            raise RdbError(f"intset: короткий заголовок (смещение {offset})")
+        enc, n = int.from_bytes(data[:4], "little"), int.from_bytes(data[4:8], "little")
+        if enc not in (2, 4, 8) or 8 + enc * n != total:
+            raise RdbError(f"intset: неверная кодировка или длина (смещение {offset})")
+        return
+    if last != 0xFF:
+        raise RdbError(f"{kind}: нет терминатора 0xFF (смещение {offset})")
+
+
+def lzf_decompress(data: bytes, ulen: int) -> bytes:
+    """Распаковка LZF (формат liblzf, как в Redis)."""
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        ctrl = data[i]
+        i += 1
+        if ctrl < 32:
+            out += data[i:i + ctrl + 1]
+            i += ctrl + 1
+            continue
+        length = ctrl >> 5
+        if length == 7:
+            length += data[i]
+            i += 1
+        ref = len(out) - ((ctrl & 0x1F) << 8) - data[i] - 1
+        i += 1
+        if ref < 0:
+            raise RdbError("LZF: ссылка за пределы данных")
+        for _ in range(length + 2):
+            out.append(out[ref])
+            ref += 1
+    if len(out) != ulen:
+        raise RdbError(f"LZF: распаковано {len(out)} байт вместо {ulen}")
+    return bytes(out)
+
+
+def _check_end(reader: _Reader, size: int, codec: str) -> None:
+    if codec != "none":
+        if not reader.at_eof():
+            raise RdbError(f"лишние данные после EOF (смещение {reader.offset} в распакованном потоке)")
+    elif reader.offset != size:
+        raise RdbError(f"лишние данные после EOF: {size - reader.offset} байт")
+
+
+def validate_rdb(path: str | Path, check_crc: bool = True, workers: int = 0) -> dict:
+    """
+    Проверка RDB-файла. Возвращает отчёт: версия, ключей по БД, с TTL, CRC, время, МБ/с.
+    Ошибка структуры или CRC — RdbError.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    codec = codecs.detect(path)
+    started = time.monotonic()
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if check_crc and workers > 1 else None
+    try:
+        with (open(path, "rb", buffering=0) if codec == "none" else codecs.open_reader(path, codec)) as f:
+            head = f.read(9)
+            if len(head) < 9 or head[:5] != b"REDIS" or not head[5:].isdigit():
+                raise RdbError("нет сигнатуры REDIS<версия>")
+            version = int(head[5:])
+            if version > MAX_RDB_VERSION:
+                raise RdbError(f"версия RDB {version} новее поддерживаемой ({MAX_RDB_VERSION})")
+            has_crc = version >= 5
+            crc_limit = (size - 8 if codec == "none" else None) if has_crc and check_crc else 0
+            reader = _Reader(f, size, crc_limit, pool, workers)
+            reader._feed_crc(head, 0)
+            reader._loaded = reader.offset = 9
+            w = _Walker(reader, version)
+
+            dbs: dict[int, dict] = {}
+            db = 0
+            expiring = False
+            aux: dict[str, str] = {}
+            while True:
+                op = reader.byte()
+                if op == 0xFF:
+                    break
+                if op == 0xFE:
+                    db = w.plain_length()
+                    dbs.setdefault(db, {"keys": 0, "expires": 0})
+                elif op == 0xFD:
+                    reader.skip(4)
+                    expiring = True
+                elif op == 0xFC:
+                    reader.skip(8)
+                    expiring = True
+                elif op == 0xFB:
+                    size_hint, expires_hint = w.plain_length(), w.plain_length()
+                    dbs.setdefault(db, {"keys": 0, "expires": 0}).update(resize_keys=size_hint, resize_expires=expires_hint)
+                elif op == 0xFA:
+                    key = w.small_string().decode(errors="replace")
+                    aux[key] = w.small_string().decode(errors="replace")
+                elif op == 0xF9:
+                    reader.skip(1)
+                elif op == 0xF8:
+                    w.plain_length()
+                elif op == 0xF7:
+                    w.plain_length()
+                    w.plain_length()
+                    w.plain_length()
+                    w.module_body()
+                elif op == 0xF5:
+                    w.skip_string()  # RDB_OPCODE_FUNCTION2: код библиотеки функций (Redis 7.0+)
+                elif op == 0xF4:
+                    for _ in range(3):
+                        w.plain_length()
+                elif op == 0xF6:
+                    raise RdbError("функции в формате до 7.0 GA (RDB_OPCODE_FUNCTION_PRE_GA) не поддерживаются")
+                else:
+                    w.skip_string()  # ключ
+                    w.value(op)
+                    stats = dbs.setdefault(db, {"keys": 0, "expires": 0})
+                    stats["keys"] += 1
+                    if expiring:
+                        stats["expires"] += 1
+                    expiring = False
+
+            crc_status = "нет (версия < 5)"
+            if has_crc:
+                stored = int.from_bytes(reader.read(8), "little")
+                _check_end(reader, size, codec)
+                if stored == 0:
+                    crc_status = "отключена (rdbchecksum no)"
+                elif check_crc:
+                    actual = reader.crc()
+                    if actual != stored:
+                        raise RdbError(f"CRC64 не совпадает: в файле {stored:016x}, посчитано {actual:016x}")
+                    crc_status = f"ok ({stored:016x})"
+                else:
+                    crc_status = "не проверялась"
+            else:
+                _check_end(reader, size, codec)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    elapsed = max(time.monotonic() - started, 1e-6)
+    compressed_size = None
+    if codec != "none":
+        compressed_size, size = size, reader.offset
+    for stats in dbs.values():
+        if "resize_keys" in stats and stats["resize_keys"] != stats["keys"]:
+            stats["warning"] = "число ключей не совпадает с RESIZEDB"
+    return {
+        "path": str(path),
+        "version": version,
+        "redis_version": aux.get("redis-ver"),
+        "size": size,
+        "codec": codec,
+        "compressed_size": compressed_size,
+        "dbs": {str(k): v for k, v in sorted(dbs.items())},
+        "keys": sum(v["keys"] for v in dbs.values()),
+        "expires": sum(v["expires"] for v in dbs.values()),
+        "containers_checked": w.blobs_checked,
+        "crc": crc_status,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(size / elapsed / 1e6, 1),
+    }
+
+
+def _rdb_string(data: bytes) -> bytes:
+    """Строка RDB с длиной (6/14/32 бита)."""
+    n = len(data)
+    if n < 64:
+        head = bytes([n])
+    elif n < 16384:
+        head = bytes([0x40 | n >> 8, n & 0xFF])
+    else:
+        head = b"\x80" + n.to_bytes(4, "big")
+    return head + data
+
+
+def build_rdb(version: int = 11, function_opcode: int | None = 0xF5) -> bytes:
+    """Синтетический RDB: aux, библиотека функций (опкод function_opcode), db0 с двумя ключами (один с TTL), CRC64."""
+    body = b"REDIS%04d" % version
+    body += b"\xfa" + _rdb_string(b"redis-ver") + _rdb_string(b"7.2.4")
+    if function_opcode is not None:
+        body += bytes([function_opcode]) + _rdb_string(b"#!lua name=mylib\nredis.register_function('f', function() return 1 end)")
+    body += b"\xfe\x00" + b"\xfb\x02\x01"
+    body += b"\x00" + _rdb_string(b"key:1") + _rdb_string(b"value")
+    body += b"\xfc" + (1_900_000_000_000).to_bytes(8, "little") + b"\x00" + _rdb_string(b"key:2") + _rdb_string(b"x" * 100)
+    body += b"\xff"
+    return body + crc64(body).to_bytes(8, "little")
+
+
+def self_test() -> int:
+    """Разбор синтетических RDB: FUNCTION2 (0xF5) принимается, FUNCTION_PRE_GA (0xF6) — ошибка, порча CRC находится."""
+    import tempfile
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [
+            ("function2", build_rdb(11, 0xF5), None),
+            ("без функций v9", build_rdb(9, None), None),
+            ("function_pre_ga", build_rdb(10, 0xF6), "PRE_GA"),
+        ]
+        corrupt = bytearray(build_rdb(11, 0xF5))
+        corrupt[-20] ^= 0xFF  # байт значения key:2 — структура цела, CRC нет
+        cases.append(("порча данных", bytes(corrupt), "CRC"))
+        for name, data, error in cases:
+            path = Path(tmp) / "dump.rdb"
+            path.write_bytes(data)
+            try:
+                report = validate_rdb(path, workers=1)
+                got = None if report["dbs"].get("0", {}).get("keys") == 2 else f"ключей {report['dbs']}"
+            except RdbError as e:
+                got = str(e)
+            ok = got is None if error is None else (got is not None and error in got)
+            print(f"  {'OK  ' if ok else 'FAIL'} {name}: {got or 'разобран, 2 ключа'}")
+            if not ok:
+                failures.append(name)
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Потоковая проверка RDB-файла Redis")
+    parser.add_argument("path", nargs="?", help="Путь к .rdb (или сжатому .rdb.zst, .rdb.lz4, .rdb.gz)")
+    parser.add_argument("--no-crc", action="store_true", help="Не проверять CRC64 (только структура)")
+    parser.add_argument("--workers", type=int, default=0, help="Процессов для CRC64 (по умолчанию — число CPU)")
+    parser.add_argument("--json", action="store_true", help="Отчёт в JSON")
+    parser.add_argument("--self-test", action="store_true", help="Проверить разбор на синтетических RDB и выйти")
+    args = parser.parse_args()
+    if args.self_test:
+        return self_test()
+    if not args.path:
+        parser.error("укажите путь к RDB или --self-test")
+
+    try:
+        report = validate_rdb(args.path, check_crc=not args.no_crc, workers=args.workers)
+    except (OSError, RdbError) as e:
+        log(f"Ошибка RDB: {e}")
+        return 1
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+    print(f"RDB v{report['version']} (Redis {report['redis_version'] or '?'}): {report['size']} байт, "
+          f"{report['seconds']} с, {report['mb_per_s']} МБ/с")
+    for db, stats in report["dbs"].items():
+        line = f"  db{db}: ключей {stats['keys']}, с TTL {stats['expires']}"
+        if "warning" in stats:
+            line += f" [WARN] {stats['warning']}"
+        print(line)
+    print(f"  CRC64: {report['crc']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
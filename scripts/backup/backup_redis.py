@@ -4,7 +4,11 @@
 Нужно знать путь к dump.rdb (из конфига Redis или --rdb-path).
 Использование:
   python3 backup_redis.py --dest /backup/redis [--rdb-path /var/lib/redis/dump.rdb] [--bgsave] [--rotate-days N]
-  С --bgsave: выполнить redis-cli BGSAVE и ждать завершения, затем копировать файл.
+  С --bgsave: выполнить BGSAVE SCHEDULE и следить за INFO persistence (с нарастающим интервалом опроса),
+  копировать сразу после появления нового снимка; --bgsave-timeout — предельное время ожидания.
+  --s3 s3://бакет/префикс — выгрузка копии в S3 (backup_s3.py), --s3-rotate-days — ротация там.
+  --codec zstd|lz4|gzip|auto — сжатие при копировании (redis_<дата>.rdb.zst и т.п., backup_codecs.py);
+  по умолчанию none — копия без сжатия (reflink, copy_file_range).
 """
 from __future__ import annotations
 
@@ -15,7 +19,74 @@ import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from backup_common import dated_path, log, rotate_by_days, run
+import backup_catalog as catalog
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_dedup as dedup
+import backup_s3 as s3
+from backup_common import DEFAULT_CHECKSUM, copy_file, dated_path, log, rotate_by_days, run_capture, stream_to_artifact
+
+
+# Интервал опроса INFO: от POLL_MIN, каждый раз x1.5, но не больше POLL_MAX
+POLL_MIN = 0.05
+POLL_MAX = 2.0
+
+
+def redis_info(cli: list[str], section: str) -> dict[str, str] | None:
+    """INFO <section> как словарь поле -> значение."""
+    code, out = run_capture(cli + ["INFO", section], timeout=30)
+    if code != 0:
+        return None
+    info = {}
+    for row in out.splitlines():
+        key, sep, value = row.strip().partition(":")
+        if sep and not key.startswith("#"):
+            info[key] = value
+    return info
+
+
+def _save_marker(info: dict[str, str]) -> tuple[int, int]:
+    """Счётчик сохранений (rdb_saves, Redis 7+) и время последнего сохранения: меняются с каждым новым снимком."""
+    return int(info.get("rdb_saves", -1)), int(info.get("rdb_last_save_time", 0))
+
+
+def bgsave_and_wait(cli: list[str], timeout: float) -> int:
+    """
+    BGSAVE SCHEDULE (если сохранение уже идёт — начнётся сразу после него) и ожидание нового снимка.
+    Готово, когда rdb_bgsave_in_progress:0 и сменился rdb_saves / rdb_last_save_time; статус должен быть ok.
+    """
+    before = redis_info(cli, "persistence")
+    if before is None:
+        log("Ошибка: не удалось получить INFO persistence")
+        return 1
+    marker = _save_marker(before)
+    started = time.monotonic()
+    code, out = run_capture(cli + ["BGSAVE", "SCHEDULE"], timeout=30)
+    if code != 0 or "ERR" in out:
+        log(f"Ошибка BGSAVE: {out.strip()}")
+        return 1
+    log(f"[redis-cli] {out.strip()}")
+
+    delay = POLL_MIN
+    while True:
+        info = redis_info(cli, "persistence")
+        if info is not None and info.get("rdb_bgsave_in_progress") == "0" and _save_marker(info) != marker:
+            break
+        if time.monotonic() - started + delay > timeout:
+            log(f"Ошибка: снимок не готов за {timeout:g} с (BGSAVE продолжается на сервере)")
+            return 1
+        time.sleep(delay)
+        delay = min(delay * 1.5, POLL_MAX)
+    waited = time.monotonic() - started
+
+    if info.get("rdb_last_bgsave_status") != "ok":
+        log(f"Ошибка: BGSAVE завершился со статусом {info.get('rdb_last_bgsave_status')}")
+        return 1
+    stats = redis_info(cli, "stats") or {}
+    fork_ms = int(stats.get("latest_fork_usec", 0)) / 1000
+    log(f"Снимок готов: fork {fork_ms:.1f} мс, сохранение {info.get('rdb_last_bgsave_time_sec', '?')} с, "
+        f"ожидание {waited:.2f} с")
+    return 0
 
 
 def main() -> int:
@@ -23,11 +94,18 @@ def main() -> int:
     parser.add_argument("--dest", required=True, help="Каталог для сохранения бэкапов")
     parser.add_argument("--rdb-path", default="/var/lib/redis/dump.rdb", help="Путь к dump.rdb на сервере Redis")
     parser.add_argument("--bgsave", action="store_true", help="Выполнить redis-cli BGSAVE и дождаться сохранения")
+    parser.add_argument("--bgsave-timeout", type=float, default=3600, help="Сколько секунд максимум ждать BGSAVE")
     parser.add_argument("--rotate-days", type=int, default=0, help="Удалить бэкапы старше N дней")
     parser.add_argument("--redis-cli", default="redis-cli", help="Путь к redis-cli")
+    parser.add_argument("--dedup-store", default=None, help="Перенести RDB в дедуплицирующее хранилище (backup_dedup.py)")
     parser.add_argument("--host", default=os.environ.get("REDIS_HOST", "127.0.0.1"), help="Хост Redis")
     parser.add_argument("--port", type=int, default=int(os.environ.get("REDIS_PORT", "6379")), help="Порт Redis")
+    codecs.add_codec_args(parser, "none")
+    s3.add_s3_args(parser)
     args = parser.parse_args()
+    if args.dedup_store and args.codec != "none":
+        log(f"--dedup-store: сжатый RDB дедуплицируется плохо, --codec {args.codec} заменён на none")
+        args.codec = "none"
 
     dest = Path(args.dest)
     dest.mkdir(parents=True, exist_ok=True)
@@ -37,29 +115,53 @@ def main() -> int:
         log(f"Ошибка: RDB-файл не найден: {rdb}")
         return 1
 
+    started = time.time()
     if args.bgsave:
         log("Выполняется BGSAVE...")
-        code = run([args.redis_cli, "-h", args.host, "-p", str(args.port), "BGSAVE"], log_prefix="[redis-cli] ")
+        save_started = time.time()
+        code = bgsave_and_wait([args.redis_cli, "-h", args.host, "-p", str(args.port)], args.bgsave_timeout)
         if code != 0:
             return code
-        log("Ожидание завершения сохранения (10 сек)...")
-        time.sleep(10)
+        if rdb.stat().st_mtime < save_started - 1:
+            log(f"Ошибка: {rdb} не обновился после BGSAVE — проверьте --rdb-path (CONFIG GET dir / dbfilename)")
+            return 1
 
-    out_path = dated_path(dest, "redis", ".rdb")
+    out_path = dated_path(dest, "redis", ".rdb" + codecs.SUFFIXES.get(args.codec, ""))
     log(f"Копирование {rdb} в {out_path}")
-    try:
-        import shutil
-        shutil.copy2(rdb, out_path)
-    except OSError as e:
-        log(f"Ошибка копирования: {e}")
-        return 1
+    metrics.annotate(target=f"{args.host}:{args.port}", artifact=out_path)
+    if args.codec == "none":
+        try:
+            copy_file(rdb, out_path, checksum=DEFAULT_CHECKSUM)
+        except OSError as e:
+            log(f"Ошибка копирования: {e}")
+            return 1
+    else:
+        code, out_path = stream_to_artifact(None, out_path, compress=args.codec, level=args.level, source=rdb,
+                                            threads=args.threads, auto_min_mbps=args.auto_min_mbps)
+        metrics.annotate(artifact=out_path)
+        if code != 0:
+            return 1
+    # До переноса в дедуп-хранилище: оно удаляет полную копию
+    code = s3.upload_artifact(args, out_path)
+    if code != 0:
+        return code
+    if args.dedup_store:
+        code = dedup.store_artifact(args.dedup_store, out_path)
+        if code != 0:
+            return code
+    else:
+        catalog.register(dest, out_path, source=f"{args.host}:{args.port}", started=started)
 
     if args.rotate_days > 0:
-        rotate_by_days(dest, "redis_", args.rotate_days)
+        if args.dedup_store:
+            dedup.rotate_by_days(args.dedup_store, "redis_", args.rotate_days)
+        else:
+            rotate_by_days(dest, "redis_", args.rotate_days)
+    s3.rotate_s3(args, "redis_")
 
     log("Готово.")
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("backup", "redis", main))
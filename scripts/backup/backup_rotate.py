@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 """
-Ротация бэкапов: удаление старых по возрасту (--days) или оставить только последние N (--keep).
+Ротация бэкапов: удаление старых по возрасту (--days), оставить только последние N (--keep)
+или политика дед-отец-сын (--daily/--weekly/--monthly). Если в каталоге есть .backup_catalog.sqlite
+(его ведут backup_*.py), выборка идёт индексными запросами по каталогу, без обхода файлов.
 Использование:
   python3 backup_rotate.py --dir /backup/pg --prefix pg_mydb_ [--days 7]
   python3 backup_rotate.py --dir /backup/pg --prefix pg_mydb_ --keep 10
+  python3 backup_rotate.py --dir /backup/pg --prefix pg_mydb_ --daily 7 --weekly 4 --monthly 12
+  python3 backup_rotate.py --dir /backup/pg --reconcile
 """
 from __future__ import annotations
 
@@ -12,15 +16,20 @@ import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
+import backup_catalog as catalog
 from backup_common import log, rotate_by_days, rotate_keep_n
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Ротация бэкапов по возрасту или количеству")
     parser.add_argument("--dir", "--directory", dest="directory", required=True, help="Каталог с бэкапами")
-    parser.add_argument("--prefix", required=True, help="Префикс имён файлов (например pg_mydb_)")
+    parser.add_argument("--prefix", default=None, help="Префикс имён файлов (например pg_mydb_)")
     parser.add_argument("--days", type=int, default=0, help="Удалить файлы старше N дней")
     parser.add_argument("--keep", type=int, default=0, help="Оставить только последние N файлов")
+    parser.add_argument("--daily", type=int, default=0, help="Дед-отец-сын: хранить по одному бэкапу за последние N дней")
+    parser.add_argument("--weekly", type=int, default=0, help="Дед-отец-сын: ... за последние N недель")
+    parser.add_argument("--monthly", type=int, default=0, help="Дед-отец-сын: ... за последние N месяцев")
+    parser.add_argument("--reconcile", action="store_true", help="Сверить каталог бэкапов (.backup_catalog.sqlite) с диском")
     args = parser.parse_args()
 
     dest = Path(args.directory)
@@ -28,13 +37,25 @@ def main() -> int:
         log(f"Ошибка: каталог не найден: {dest}")
         return 1
 
+    if args.reconcile:
+        catalog.reconcile(dest)
+    gfs = args.daily > 0 or args.weekly > 0 or args.monthly > 0
+    if args.days <= 0 and args.keep <= 0 and not gfs:
+        if args.reconcile:
+            log("Готово.")
+            return 0
+        log("Укажите --days N, --keep N или --daily/--weekly/--monthly")
+        return 1
+    if args.prefix is None:
+        log("Укажите --prefix")
+        return 1
+
     if args.days > 0:
         rotate_by_days(dest, args.prefix, args.days)
     if args.keep > 0:
         rotate_keep_n(dest, args.prefix, args.keep)
-    if args.days <= 0 and args.keep <= 0:
-        log("Укажите --days N или --keep N")
-        return 1
+    if gfs:
+        catalog.rotate_gfs(dest, args.prefix, args.daily, args.weekly, args.monthly)
 
     log("Готово.")
     return 0
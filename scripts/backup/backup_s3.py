@@ -0,0 +1,798 @@
+#!/usr/bin/env python3
+"""
+Выгрузка бэкапов в S3-совместимое хранилище (AWS S3, MinIO, Ceph RGW) без boto3: подпись SigV4 на stdlib.
+Поток дампа уходит в multipart upload по мере записи (stream_to_file(upload=...)): части по --s3-part-size МБ
+загружаются параллельно, в памяти не больше parallel+1 частей — при медленной сети дампер ждёт, а не копит.
+Контрольные суммы: каждая часть — с Content-MD5 и x-amz-content-sha256 (сервер проверяет тело), ETag части
+сверяется с MD5, ETag всего объекта — с MD5 от MD5 частей. Рядом кладётся <ключ>.manifest.json с SHA-256 всего
+потока (формат локального манифеста); get/cat сверяют его при чтении.
+Журнал загрузки (<каталог артефакта>/.s3/<имя>.json): upload_id и готовые части. put файла продолжает
+прерванную загрузку (ListParts; части, чей ETag совпал с MD5 локальной части, не перегружаются). Брошенные
+потоковые загрузки (процесс умер) прерываются при следующем запуске (AbortMultipartUpload): незавершённые
+части иначе занимают место в бакете.
+Ротация по префиксу: ListObjectsV2 + DeleteObjects пачками по 1000; возраст артефакта-каталога — по самому
+новому объекту в нём.
+Переменные: S3_ENDPOINT_URL (или AWS_ENDPOINT_URL; без них — AWS), AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+AWS_SESSION_TOKEN, AWS_REGION (по умолчанию us-east-1). Адресация path-style (/бакет/ключ).
+Использование:
+  python3 backup_s3.py put s3://backups/pg /backup/pg/pg_mydb_2025-02-11_02-00.dump [--part-size 64] [--parallel 8]
+  python3 backup_s3.py ls s3://backups/pg/pg_mydb_
+  python3 backup_s3.py get s3://backups/pg/pg_mydb_2025-02-11_02-00.dump --out /tmp/restore.dump
+  python3 backup_s3.py cat s3://backups/mysql/mysql_all_2025-02-11_02-00.sql.gz | gunzip | mysql
+  python3 backup_s3.py rotate s3://backups/pg/pg_mydb_ --days 30
+  python3 backup_s3.py abort-stale /backup/mysql
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import calendar
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from backup_common import SIDECAR_SUFFIX, hash_file, log, read_sidecar, sidecar_path
+
+MB = 1024 * 1024
+PART_SIZE = 16 * MB
+# Минимум S3 для всех частей, кроме последней; частей не больше 10000
+MIN_PART = 5 * MB
+MAX_PARTS = 10000
+# Каждые столько частей размер части удваивается: поток неизвестной длины не упрётся в MAX_PARTS
+PART_GROWTH_EVERY = 1000
+PARALLEL = 4
+RETRIES = 6
+DELETE_BATCH = 1000
+JOURNAL_DIR = ".s3"
+# Ошибки 4xx, после которых имеет смысл повторить запрос
+_RETRY_CODES = {"RequestTimeout", "RequestTimeTooSkewed", "SlowDown", "InternalError"}
+
+
+class S3Error(OSError):
+    """Ошибка запроса к S3. OSError — чтобы stream_to_file и скрипты обрабатывали её как ошибку записи."""
+
+    def __init__(self, msg: str, status: int = 0, code: str = "") -> None:
+        super().__init__(msg)
+        self.status = status
+        self.code = code
+
+
+def parse_url(url: str) -> tuple[str, str]:
+    """s3://бакет/префикс -> (бакет, префикс)."""
+    if not url.startswith("s3://") or len(url) <= 5:
+        raise ValueError(f"ожидается s3://бакет/префикс: {url}")
+    bucket, _, prefix = url[5:].partition("/")
+    return bucket, prefix
+
+
+def join_key(prefix: str, name: str) -> str:
+    return f"{prefix.rstrip('/')}/{name}" if prefix else name
+
+
+def _md5(data) -> bytes:
+    return hashlib.md5(data).digest()
+
+
+def _etag_is_md5(headers) -> bool:
+    """
+    ETag ответа — MD5 тела? При SSE-KMS и SSE-C (AWS, MinIO с KMS) ETag не MD5, сверять нечего:
+    тело проверяет сервер по Content-MD5, весь поток — SHA-256 манифеста.
+    """
+    if headers.get("x-amz-server-side-encryption", "").startswith("aws:kms"):
+        return False
+    return not headers.get("x-amz-server-side-encryption-customer-algorithm")
+
+
+def _check_etag(headers, etag: str, expected: str, what: str) -> None:
+    """Расхождение ETag с MD5 без признаков шифрования — предупреждение (шлюзы и S3-совместимые хранилища)."""
+    if etag and etag != expected and _etag_is_md5(headers):
+        log(f"[s3] {what}: ETag {etag} не совпал с MD5 {expected}; целостность — по SHA-256 манифеста")
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def sign_v4(
+    method: str,
+    host: str,
+    path: str,
+    query: dict,
+    headers: dict,
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    amz_date: str,
+    service: str = "s3",
+) -> str:
+    """Заголовок Authorization (AWS Signature Version 4). path — без кодирования, headers — подписываемые."""
+    canonical_query = "&".join(f"{quote(k, safe='')}={quote(str(v), safe='')}" for k, v in sorted(query.items()))
+    hdrs = {k.lower(): " ".join(str(v).split()) for k, v in headers.items()}
+    hdrs["host"] = host
+    names = sorted(hdrs)
+    signed = ";".join(names)
+    canonical = "\n".join([
+        method, quote(path, safe="/"), canonical_query, "".join(f"{k}:{hdrs[k]}\n" for k in names), signed, payload_hash,
+    ])
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    key = _hmac(_hmac(_hmac(_hmac(("AWS4" + secret_key).encode(), amz_date[:8]), region), service), "aws4_request")
+    signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed}, Signature={signature}"
+
+
+def _xml(data: bytes) -> ET.Element:
+    """Разбор XML-ответа с отброшенными пространствами имён: find('Key') вместо find('{ns}Key')."""
+    root = ET.fromstring(data)
+    for el in root.iter():
+        if "}" in el.tag:
+            el.tag = el.tag.split("}", 1)[1]
+    return root
+
+
+class S3Client:
+    """Запросы к S3 с подписью SigV4 и повторами. Соединение keep-alive — своё у каждого потока."""
+
+    def __init__(
+        self,
+        endpoint: str | None = None,
+        access_key: str | None = None,
+        secret_key: str | None = None,
+        region: str | None = None,
+        session_token: str | None = None,
+        timeout: float = 300,
+    ) -> None:
+        self.region = region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+        endpoint = (endpoint or os.environ.get("S3_ENDPOINT_URL") or os.environ.get("AWS_ENDPOINT_URL")
+                    or f"https://s3.{self.region}.amazonaws.com")
+        parts = urlsplit(endpoint)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise S3Error(f"неверный адрес S3: {endpoint}")
+        self._https = parts.scheme == "https"
+        self._host = parts.netloc
+        self._base = parts.path.rstrip("/")
+        self._access_key = access_key or os.environ.get("AWS_ACCESS_KEY_ID")
+        self._secret_key = secret_key or os.environ.get("AWS_SECRET_ACCESS_KEY")
+        self._token = session_token or os.environ.get("AWS_SESSION_TOKEN")
+        if not self._access_key or not self._secret_key:
+            raise S3Error("не заданы AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self._host, timeout=self.timeout)
+        return conn
+
+    def _reset(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(
+        self,
+        method: str,
+        bucket: str,
+        key: str = "",
+        query: dict | None = None,
+        body=b"",
+        headers: dict | None = None,
+        stream: bool = False,
+    ):
+        """
+        Запрос с повторами (сетевые ошибки, 5xx, SlowDown — экспоненциальная задержка со случайным разбросом).
+        Возвращает (статус, заголовки, тело); stream=True — объект ответа для чтения по частям.
+        """
+        query = query or {}
+        path = f"{self._base}/{bucket}" + (f"/{key}" if key else "")
+        payload_hash = hashlib.sha256(body).hexdigest()
+        url = quote(path, safe="/")
+        if query:
+            url += "?" + "&".join(f"{quote(k, safe='')}={quote(str(v), safe='')}" for k, v in sorted(query.items()))
+        err: S3Error | None = None
+        for attempt in range(RETRIES):
+            if attempt:
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.8, 1.2)
+                log(f"[s3] {method} {bucket}/{key}: {err}; повтор через {delay:.1f} с")
+                time.sleep(delay)
+            hdrs = dict(headers or {})
+            hdrs["x-amz-date"] = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+            hdrs["x-amz-content-sha256"] = payload_hash
+            if self._token:
+                hdrs["x-amz-security-token"] = self._token
+            hdrs["Authorization"] = sign_v4(method, self._host, path, query, hdrs, payload_hash,
+                                            self._access_key, self._secret_key, self.region, hdrs["x-amz-date"])
+            try:
+                conn = self._conn()
+                conn.request(method, url, body=body, headers=hdrs)
+                resp = conn.getresponse()
+                if stream and resp.status < 300:
+                    return resp
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                self._reset()
+                err = S3Error(f"{type(e).__name__}: {e}")
+                continue
+            if resp.status < 300:
+                return resp.status, resp.headers, data
+            err = self._error(resp.status, data)
+            if resp.status < 500 and err.code not in _RETRY_CODES:
+                raise err
+        raise S3Error(f"{method} {bucket}/{key}: {err}", err.status, err.code)
+
+    @staticmethod
+    def _error(status: int, data: bytes) -> S3Error:
+        code, message = "", data[:200].decode(errors="replace")
+        try:
+            root = _xml(data)
+            code = root.findtext("Code") or ""
+            message = root.findtext("Message") or code
+        except ET.ParseError:
+            pass
+        return S3Error(f"HTTP {status} {code}: {message}".strip(), status, code)
+
+    # --- Объекты ---
+
+    def put_object(self, bucket: str, key: str, data: bytes, content_type: str = "application/octet-stream") -> str:
+        md5 = _md5(data)
+        _, headers, _ = self.request("PUT", bucket, key, body=data, headers={
+            "Content-MD5": base64.b64encode(md5).decode(), "Content-Type": content_type,
+        })
+        etag = headers.get("ETag", "").strip('"')
+        _check_etag(headers, etag, md5.hex(), f"{bucket}/{key}")
+        return etag
+
+    def get_object(self, bucket: str, key: str, offset: int = 0):
+        """Тело объекта блоками. Обрыв соединения — повтор с Range от прочитанного места."""
+        while True:
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            resp = self.request("GET", bucket, key, headers=headers, stream=True)
+            try:
+                while True:
+                    chunk = resp.read(1 << 20)
+                    if not chunk:
+                        return
+                    offset += len(chunk)
+                    yield chunk
+            except (OSError, http.client.HTTPException) as e:
+                log(f"[s3] GET {bucket}/{key}: обрыв на {offset} байт ({e}), продолжение")
+                self._reset()
+
+    def head_object(self, bucket: str, key: str) -> dict | None:
+        try:
+            _, headers, _ = self.request("HEAD", bucket, key)
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+        return {"size": int(headers.get("Content-Length", 0)), "etag": headers.get("ETag", "").strip('"')}
+
+    def list_objects(self, bucket: str, prefix: str = ""):
+        """Объекты под префиксом: {key, size, mtime, etag}. ListObjectsV2 постранично."""
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if token:
+                query["continuation-token"] = token
+            _, _, data = self.request("GET", bucket, query=query)
+            root = _xml(data)
+            for c in root.iter("Contents"):
+                yield {
+                    "key": c.findtext("Key"),
+                    "size": int(c.findtext("Size") or 0),
+                    "mtime": calendar.timegm(time.strptime(c.findtext("LastModified")[:19], "%Y-%m-%dT%H:%M:%S")),
+                    "etag": (c.findtext("ETag") or "").strip('"'),
+                }
+            token = root.findtext("NextContinuationToken")
+            if root.findtext("IsTruncated") != "true" or not token:
+                return
+
+    def delete_objects(self, bucket: str, keys: list[str]) -> None:
+        """Удаление пачками по 1000 (DeleteObjects, Quiet); ошибки по отдельным ключам — S3Error."""
+        for i in range(0, len(keys), DELETE_BATCH):
+            root = ET.Element("Delete")
+            ET.SubElement(root, "Quiet").text = "true"
+            for key in keys[i:i + DELETE_BATCH]:
+                ET.SubElement(ET.SubElement(root, "Object"), "Key").text = key
+            body = ET.tostring(root, encoding="utf-8")
+            _, _, data = self.request("POST", bucket, query={"delete": ""}, body=body, headers={
+                "Content-MD5": base64.b64encode(_md5(body)).decode(), "Content-Type": "application/xml",
+            })
+            errors = [f"{e.findtext('Key')}: {e.findtext('Code')}" for e in _xml(data).iter("Error")] if data else []
+            if errors:
+                raise S3Error(f"не удалены: {', '.join(errors[:5])}" + (" ..." if len(errors) > 5 else ""))
+
+    # --- Multipart ---
+
+    def create_multipart(self, bucket: str, key: str) -> str:
+        _, _, data = self.request("POST", bucket, key, query={"uploads": ""},
+                                  headers={"Content-Type": "application/octet-stream"})
+        return _xml(data).findtext("UploadId")
+
+    def upload_part(self, bucket: str, key: str, upload_id: str, number: int, data) -> str:
+        md5 = _md5(data)
+        _, headers, _ = self.request("PUT", bucket, key, query={"partNumber": number, "uploadId": upload_id}, body=data,
+                                     headers={"Content-MD5": base64.b64encode(md5).decode()})
+        etag = headers.get("ETag", "").strip('"')
+        _check_etag(headers, etag, md5.hex(), f"{bucket}/{key}: часть {number}")
+        return etag
+
+    def complete_multipart(self, bucket: str, key: str, upload_id: str, etags: dict[int, str]) -> str:
+        """
+        Завершить загрузку. ETag итогового объекта сверяется с MD5 от MD5 частей ("<hex>-<частей>"),
+        если объект не зашифрован SSE-KMS/SSE-C.
+        """
+        root = ET.Element("CompleteMultipartUpload")
+        for number in sorted(etags):
+            part = ET.SubElement(root, "Part")
+            ET.SubElement(part, "PartNumber").text = str(number)
+            ET.SubElement(part, "ETag").text = f'"{etags[number]}"'
+        _, headers, data = self.request("POST", bucket, key, query={"uploadId": upload_id}, body=ET.tostring(root),
+                                        headers={"Content-Type": "application/xml"})
+        # Ошибка CompleteMultipartUpload может прийти с кодом 200 — в теле
+        result = _xml(data)
+        if result.tag == "Error":
+            raise S3Error(f"{bucket}/{key}: {result.findtext('Code')}: {result.findtext('Message')}",
+                          code=result.findtext("Code") or "")
+        etag = (result.findtext("ETag") or "").strip('"')
+        try:
+            expected = hashlib.md5(b"".join(bytes.fromhex(etags[n]) for n in sorted(etags))).hexdigest()
+        except ValueError:
+            expected = ""  # ETag частей не hex — не MD5
+        _check_etag(headers, etag, f"{expected}-{len(etags)}", f"{bucket}/{key}")
+        return etag
+
+    def abort_multipart(self, bucket: str, key: str, upload_id: str) -> None:
+        try:
+            self.request("DELETE", bucket, key, query={"uploadId": upload_id})
+        except S3Error as e:
+            if e.code != "NoSuchUpload":
+                raise
+
+    def list_parts(self, bucket: str, key: str, upload_id: str) -> dict[int, tuple[str, int]]:
+        """Загруженные части: номер -> (ETag, размер)."""
+        parts: dict[int, tuple[str, int]] = {}
+        marker = 0
+        while True:
+            _, _, data = self.request("GET", bucket, key, query={"uploadId": upload_id, "part-number-marker": marker})
+            root = _xml(data)
+            for p in root.iter("Part"):
+                parts[int(p.findtext("PartNumber"))] = ((p.findtext("ETag") or "").strip('"'), int(p.findtext("Size") or 0))
+            if root.findtext("IsTruncated") != "true":
+                return parts
+            marker = int(root.findtext("NextPartNumberMarker") or 0)
+
+
+# --- Журнал загрузок ---
+
+def _journal_path(journal_dir: Path, key: str) -> Path:
+    return journal_dir / (key.replace("/", "%2F") + ".json")
+
+
+def _write_journal(path: Path, data: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False))
+    os.replace(tmp, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def abort_stale(client: S3Client, journal_dir: str | Path) -> int:
+    """Прервать потоковые загрузки, чей процесс уже завершился. Возвращает число прерванных."""
+    journal_dir = Path(journal_dir)
+    aborted = 0
+    for path in sorted(journal_dir.glob("*.json")) if journal_dir.is_dir() else []:
+        try:
+            j = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if not j.get("stream") or _pid_alive(j.get("pid", 0)):
+            continue
+        log(f"[s3] Прерывание брошенной загрузки {j['bucket']}/{j['key']} (частей {len(j.get('parts', {}))})")
+        client.abort_multipart(j["bucket"], j["key"], j["upload_id"])
+        path.unlink(missing_ok=True)
+        aborted += 1
+    return aborted
+
+
+class MultipartUpload:
+    """
+    Потоковая загрузка как файл: write() копит часть, полная часть уходит в пул потоков, write() блокируется,
+    пока в работе parallel частей (в памяти не больше parallel+1 частей). close() — Complete и манифест,
+    abort() — AbortMultipartUpload. Поток короче одной части загружается одним PUT.
+    """
+
+    def __init__(
+        self,
+        client: S3Client,
+        bucket: str,
+        key: str,
+        part_size: int = PART_SIZE,
+        parallel: int = PARALLEL,
+        journal_dir: str | Path | None = None,
+    ) -> None:
+        self.client, self.bucket, self.key = client, bucket, key
+        self.part_size = max(MIN_PART, part_size)
+        self.parallel = max(1, parallel)
+        self._journal = _journal_path(Path(journal_dir), key) if journal_dir else None
+        self._buf = bytearray()
+        self._slots = threading.Semaphore(self.parallel)
+        self._pool: ThreadPoolExecutor | None = None
+        self._futures = []
+        self._etags: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._error: BaseException | None = None
+        self.upload_id: str | None = None
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self._started = time.monotonic()
+
+    def write(self, data) -> int:
+        if self._error is not None:
+            raise OSError(f"загрузка в S3 прервана: {self._error}")
+        self.hasher.update(data)
+        self.size += len(data)
+        self._buf += data
+        while len(self._buf) >= self.part_size:
+            part = self._buf[: self.part_size]
+            del self._buf[: self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, part: bytearray) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart(self.bucket, self.key)
+            self._pool = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="s3-part")
+            self._save_journal()
+        number = len(self._futures) + 1
+        if number > MAX_PARTS:
+            raise OSError(f"больше {MAX_PARTS} частей: увеличьте --s3-part-size")
+        if number % PART_GROWTH_EVERY == 0:
+            self.part_size *= 2
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._upload, number, part))
+
+    def _upload(self, number: int, part: bytearray) -> None:
+        try:
+            etag = self.client.upload_part(self.bucket, self.key, self.upload_id, number, part)
+            with self._lock:
+                self._etags[number] = etag
+                self._save_journal()
+        except BaseException as e:
+            self._error = self._error or e
+            raise
+        finally:
+            self._slots.release()
+
+    def rename(self, name: str) -> None:
+        """Сменить имя объекта (последний компонент ключа) до первой части: --codec auto узнаёт суффикс после образца."""
+        if self.upload_id is not None:
+            raise ValueError("загрузка уже начата")
+        self.key = join_key(self.key.rpartition("/")[0], name)
+        if self._journal is not None:
+            self._journal = _journal_path(self._journal.parent, self.key)
+
+    def _save_journal(self) -> None:
+        if self._journal is not None:
+            _write_journal(self._journal, {
+                "stream": True, "pid": os.getpid(), "bucket": self.bucket, "key": self.key,
+                "upload_id": self.upload_id, "parts": {str(n): e for n, e in sorted(self._etags.items())},
+            })
+
+    def close(self) -> dict:
+        """Дозагрузить хвост, завершить загрузку, положить <ключ>.manifest.json. Возвращает манифест."""
+        if self.upload_id is None:
+            etag = self.client.put_object(self.bucket, self.key, bytes(self._buf))
+        else:
+            if self._buf:
+                self._submit(self._buf)
+            self._buf = bytearray()
+            for fut in self._futures:
+                fut.result()
+            self._pool.shutdown()
+            etag = self.client.complete_multipart(self.bucket, self.key, self.upload_id, self._etags)
+        self._buf = bytearray()
+        manifest = {"algorithm": "sha256", "digest": self.hasher.hexdigest(), "size": self.size, "etag": etag,
+                    "parts": len(self._etags) or 1, "created": time.time()}
+        self.client.put_object(self.bucket, self.key + SIDECAR_SUFFIX, json.dumps(manifest).encode(), "application/json")
+        if self._journal is not None:
+            self._journal.unlink(missing_ok=True)
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        log(f"[s3] Загружено s3://{self.bucket}/{self.key}: {self.size} байт, частей {manifest['parts']}, "
+            f"{self.size / elapsed / 1e6:.1f} МБ/с")
+        return manifest
+
+    def abort(self) -> None:
+        self._error = self._error or OSError("прервано")
+        if self._pool is not None:
+            for fut in self._futures:
+                fut.cancel()
+            self._pool.shutdown(wait=True)
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart(self.bucket, self.key, self.upload_id)
+            except S3Error as e:
+                log(f"[s3] Не удалось прервать загрузку {self.key}: {e}")
+                return  # журнал остаётся: abort_stale прервёт её позже
+        if self._journal is not None:
+            self._journal.unlink(missing_ok=True)
+
+
+def _local_manifest(path: Path) -> dict:
+    """SHA-256 файла: из локального манифеста, если он свежий, иначе пересчёт."""
+    side = read_sidecar(path)
+    size = path.stat().st_size
+    if side and side.get("algorithm") == "sha256" and side.get("size") == size and "digest" in side:
+        return {"algorithm": "sha256", "digest": side["digest"], "size": size}
+    digest, size = hash_file(path, "sha256")
+    return {"algorithm": "sha256", "digest": digest, "size": size}
+
+
+def upload_file(
+    client: S3Client,
+    path: str | Path,
+    bucket: str,
+    key: str,
+    part_size: int = PART_SIZE,
+    parallel: int = PARALLEL,
+    journal_dir: str | Path | None = None,
+) -> dict:
+    """
+    Загрузить готовый файл. Части читаются os.pread в потоках пула (без общего буфера). Прерванная загрузка
+    продолжается по журналу: части, уже лежащие на сервере с ETag = MD5 локальной части, пропускаются.
+    """
+    path = Path(path)
+    st = path.stat()
+    started = time.monotonic()
+    manifest = _local_manifest(path)
+    part_size = max(MIN_PART, part_size, -(-st.st_size // MAX_PARTS))
+    if st.st_size <= part_size:
+        etag = client.put_object(bucket, key, path.read_bytes())
+        parts = 1
+    else:
+        journal = _journal_path(Path(journal_dir) if journal_dir else path.parent / JOURNAL_DIR, key)
+        ident = {"bucket": bucket, "key": key, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "part_size": part_size}
+        done: dict[int, tuple[str, int]] = {}
+        upload_id = None
+        try:
+            j = json.loads(journal.read_text())
+        except (OSError, ValueError):
+            j = {}
+        if j.get("upload_id") and all(j.get(k) == v for k, v in ident.items()):
+            try:
+                done = client.list_parts(bucket, key, j["upload_id"])
+                upload_id = j["upload_id"]
+                log(f"[s3] Продолжение загрузки {key}: на сервере частей {len(done)}")
+            except S3Error as e:
+                if e.code != "NoSuchUpload":
+                    raise
+        if upload_id is None:
+            upload_id = client.create_multipart(bucket, key)
+            _write_journal(journal, {**ident, "upload_id": upload_id})
+        count = -(-st.st_size // part_size)
+
+        def one(number: int) -> str:
+            length = min(part_size, st.st_size - (number - 1) * part_size)
+            with open(path, "rb", buffering=0) as f:
+                data = os.pread(f.fileno(), length, (number - 1) * part_size)
+            if len(data) != length:
+                raise OSError(f"{path}: файл изменился во время загрузки")
+            if number in done and done[number] == (_md5(data).hex(), length):
+                return done[number][0]
+            return client.upload_part(bucket, key, upload_id, number, data)
+
+        with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="s3-part") as pool:
+            etags = dict(zip(range(1, count + 1), pool.map(one, range(1, count + 1))))
+        etag = client.complete_multipart(bucket, key, upload_id, etags)
+        journal.unlink(missing_ok=True)
+        parts = count
+    manifest.update(etag=etag, parts=parts, created=time.time())
+    client.put_object(bucket, key + SIDECAR_SUFFIX, json.dumps(manifest).encode(), "application/json")
+    elapsed = max(time.monotonic() - started, 1e-6)
+    log(f"[s3] Загружено s3://{bucket}/{key}: {st.st_size} байт, частей {parts}, {st.st_size / elapsed / 1e6:.1f} МБ/с")
+    return manifest
+
+
+def upload_path(
+    client: S3Client,
+    path: str | Path,
+    bucket: str,
+    prefix: str,
+    part_size: int = PART_SIZE,
+    parallel: int = PARALLEL,
+) -> None:
+    """
+    Артефакт целиком: файл -> <префикс>/<имя>; каталог (pg -Fd, mongodump, mysql --parallel) -> <префикс>/<имя>/...
+    Мелкие файлы каталога идут параллельно одним PUT, крупные — по очереди, каждый параллельными частями.
+    Локальный манифест каталога кладётся рядом как <префикс>/<имя>.manifest.json.
+    """
+    path = Path(path)
+    key = join_key(prefix, path.name)
+    journal_dir = path.parent / JOURNAL_DIR
+    if not path.is_dir():
+        upload_file(client, path, bucket, key, part_size, parallel, journal_dir)
+        return
+    files = sorted((f for f in path.rglob("*") if f.is_file()), key=lambda f: -f.stat().st_size)
+    small = [f for f in files if f.stat().st_size <= part_size]
+    for f in files[: len(files) - len(small)]:
+        upload_file(client, f, bucket, join_key(key, f.relative_to(path).as_posix()), part_size, parallel, journal_dir)
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        list(pool.map(lambda f: client.put_object(bucket, join_key(key, f.relative_to(path).as_posix()), f.read_bytes()),
+                      small))
+    side = sidecar_path(path)
+    if side.is_file():
+        client.put_object(bucket, key + SIDECAR_SUFFIX, side.read_bytes(), "application/json")
+    log(f"[s3] Каталог {path.name}: файлов {len(files)} в s3://{bucket}/{key}/")
+
+
+def rotate(client: S3Client, bucket: str, prefix: str, days: int) -> int:
+    """
+    Удалить артефакты под префиксом (s3://бакет/pg/pg_mydb_) старше days дней. Артефакт — первый компонент
+    ключа после каталога префикса (файл, его манифест или каталог); возраст — по самому новому объекту.
+    Возвращает число удалённых объектов.
+    """
+    if days <= 0:
+        return 0
+    cutoff = time.time() - days * 86400
+    base = prefix[: prefix.rfind("/") + 1]
+    groups: dict[str, list[dict]] = {}
+    for obj in client.list_objects(bucket, prefix):
+        name = obj["key"][len(base):].split("/", 1)[0]
+        if name.endswith(SIDECAR_SUFFIX):
+            name = name[: -len(SIDECAR_SUFFIX)]
+        groups.setdefault(name, []).append(obj)
+    doomed = []
+    for name, objs in sorted(groups.items()):
+        if max(o["mtime"] for o in objs) < cutoff:
+            log(f"[s3] Ротация: удаление s3://{bucket}/{base}{name} (объектов {len(objs)})")
+            doomed += [o["key"] for o in objs]
+    client.delete_objects(bucket, doomed)
+    return len(doomed)
+
+
+# --- Аргументы скриптов бэкапа ---
+
+def add_s3_args(parser) -> None:
+    parser.add_argument("--s3", default=os.environ.get("BACKUP_S3_URL"),
+                        help="Выгрузить артефакт в s3://бакет/префикс (или BACKUP_S3_URL); поток — параллельно с записью")
+    parser.add_argument("--s3-part-size", type=int, default=PART_SIZE // MB, help="Размер части multipart, МБ (не меньше 5)")
+    parser.add_argument("--s3-parallel", type=int, default=PARALLEL, help="Частей в загрузке одновременно")
+    parser.add_argument("--s3-rotate-days", type=int, default=0, help="Удалить в S3 артефакты старше N дней")
+
+
+def s3_target(args) -> tuple[S3Client, str, str] | None:
+    """(клиент, бакет, префикс) по --s3 или None."""
+    if not getattr(args, "s3", None):
+        return None
+    bucket, prefix = parse_url(args.s3)
+    return S3Client(), bucket, prefix
+
+
+def open_stream_upload(args, out_path: Path) -> MultipartUpload | None:
+    """Потоковая загрузка для stream_to_file: ключ <префикс>/<имя артефакта>. Брошенные загрузки — abort."""
+    target = s3_target(args)
+    if target is None:
+        return None
+    client, bucket, prefix = target
+    journal_dir = out_path.parent / JOURNAL_DIR
+    abort_stale(client, journal_dir)
+    return MultipartUpload(client, bucket, join_key(prefix, out_path.name), args.s3_part_size * MB, args.s3_parallel,
+                           journal_dir)
+
+
+def upload_artifact(args, path: Path) -> int:
+    """Выгрузить готовый артефакт (файл или каталог) по --s3. Возвращает код выхода."""
+    try:
+        target = s3_target(args)
+        if target is None:
+            return 0
+        client, bucket, prefix = target
+        upload_path(client, path, bucket, prefix, args.s3_part_size * MB, args.s3_parallel)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка выгрузки в S3: {e}")
+        return 1
+    return 0
+
+
+def rotate_s3(args, name_prefix: str) -> None:
+    """--s3-rotate-days: ротация по префиксу имени (pg_mydb_, mysql_all_). Ошибки — в лог, как у локальной ротации."""
+    if not getattr(args, "s3", None) or args.s3_rotate_days <= 0:
+        return
+    try:
+        client, bucket, prefix = s3_target(args)
+        rotate(client, bucket, join_key(prefix, name_prefix), args.s3_rotate_days)
+    except (OSError, ValueError) as e:
+        log(f"Ошибка ротации в S3: {e}")
+
+
+def _read_remote_manifest(client: S3Client, bucket: str, key: str) -> dict | None:
+    try:
+        return json.loads(b"".join(client.get_object(bucket, key + SIDECAR_SUFFIX)))
+    except S3Error as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бэкапы в S3-совместимом хранилище (multipart, SigV4)")
+    parser.add_argument("command", choices=["put", "get", "cat", "ls", "rotate", "abort-stale"])
+    parser.add_argument("url", help="s3://бакет/префикс (abort-stale: локальный каталог бэкапов)")
+    parser.add_argument("items", nargs="*", help="put: файлы или каталоги артефактов")
+    parser.add_argument("--out", default=None, help="get: путь для файла")
+    parser.add_argument("--days", type=int, default=0, help="rotate: удалить артефакты старше N дней")
+    parser.add_argument("--part-size", type=int, default=PART_SIZE // MB, help="Размер части, МБ")
+    parser.add_argument("--parallel", type=int, default=PARALLEL, help="Частей одновременно")
+    args = parser.parse_intermixed_args()
+
+    try:
+        client = S3Client()
+        if args.command == "abort-stale":
+            log(f"Прервано загрузок: {abort_stale(client, Path(args.url) / JOURNAL_DIR)}")
+            return 0
+        bucket, prefix = parse_url(args.url)
+        if args.command == "put":
+            for item in args.items:
+                upload_path(client, item, bucket, prefix, args.part_size * MB, args.parallel)
+        elif args.command == "ls":
+            for obj in client.list_objects(bucket, prefix):
+                print(json.dumps(obj, ensure_ascii=False))
+        elif args.command == "rotate":
+            log(f"Удалено объектов: {rotate(client, bucket, prefix, args.days)}")
+        elif args.command in ("get", "cat"):
+            # Поток сверяется с SHA-256 из <ключ>.manifest.json
+            expected = _read_remote_manifest(client, bucket, prefix)
+            hasher = hashlib.sha256()
+            if args.command == "get":
+                out = Path(args.out or Path(prefix).name)
+                tmp = out.with_name(f".{out.name}.tmp")
+                with open(tmp, "wb") as f:
+                    for data in client.get_object(bucket, prefix):
+                        hasher.update(data)
+                        f.write(data)
+            else:
+                stdout = sys.stdout.buffer
+                for data in client.get_object(bucket, prefix):
+                    hasher.update(data)
+                    stdout.write(data)
+                stdout.flush()
+            if expected and expected.get("algorithm") == "sha256" and hasher.hexdigest() != expected.get("digest"):
+                log(f"Ошибка: SHA-256 {hasher.hexdigest()} не совпал с манифестом {expected.get('digest')}")
+                if args.command == "get":
+                    tmp.unlink(missing_ok=True)
+                return 1
+            if args.command == "get":
+                os.replace(tmp, out)
+                log(f"Получено в {out}" + (" (SHA-256 совпал)" if expected else " (манифеста нет, без проверки)"))
+    except (OSError, ValueError) as e:
+        log(f"Ошибка: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Планировщик бэкапов: долгоживущий процесс, который по списку заданий (JSON) запускает backup_*.py
+одновременно с лимитами — общим (max_parallel) и на хост-источник (per_host). Очередь упорядочена
+по приоритету и сроку (deadline); не начатое до срока задание пропускается, а задание, не успевшее
+к сроку, прерывается. Ошибки повторяются с экспоненциальной задержкой; повтор mysql --parallel и pg --all
+идёт с --resume — готовые куски и БД прерванной попытки не выгружаются заново. Время каждой попытки пишется
+в журнал runs.jsonl, по окончании окна — сводка: общее время окна против суммы времени заданий.
+Учётные данные — в окружении самого планировщика (PGPASSWORD, MYSQL_PWD, ...), не в файле заданий.
+Файл заданий:
+  {
+    "max_parallel": 4, "per_host": 1, "log_dir": "/backup/.scheduler",   # по умолчанию — .scheduler рядом с файлом
+    "defaults": {"retries": 2, "backoff": 60, "timeout": 14400},
+    "jobs": [
+      {"name": "pg-db1", "engine": "pg", "host": "db1", "at": "02:00", "deadline": "06:00", "priority": 10,
+       "args": ["--dest", "/backup/pg", "--all"], "env": {"PGHOST": "db1"}},
+      {"name": "redis-cache", "engine": "redis", "every": 21600, "args": ["--dest", "/backup/redis", "--bgsave"]}
+    ]
+  }
+Использование:
+  python3 backup_scheduler.py --config /etc/backup/jobs.json          # демон
+  python3 backup_scheduler.py --config /etc/backup/jobs.json --once   # все задания сейчас, выход после окна
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from backup_common import log
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+ENGINE_SCRIPTS = {
+    "pg": "backup_postgres.py",
+    "pg_wal": "backup_pg_wal.py",  # базовые копии для PITR: "args": ["base", "--dest", ..., "--keep", "7"]
+    "mysql": "backup_mysql.py",
+    "mongo": "backup_mongodb.py",
+    "redis": "backup_redis.py",
+}
+# Переменная окружения с хостом источника — если "host" в задании не указан
+ENGINE_HOST_ENV = {"pg": "PGHOST", "pg_wal": "PGHOST", "mysql": "MYSQL_HOST", "mongo": "MONGODB_URI", "redis": "REDIS_HOST"}
+DEFAULTS = {"retries": 2, "backoff": 60, "timeout": 4 * 3600, "priority": 0}
+# Как часто главный цикл просыпается без событий (новые запуски по расписанию, сроки)
+TICK = 30.0
+
+
+class Job:
+    """Задание из файла: что запускать и когда."""
+
+    def __init__(self, spec: dict, defaults: dict) -> None:
+        merged = {**DEFAULTS, **defaults, **spec}
+        self.name = merged["name"]
+        self.engine = merged.get("engine")
+        if self.engine not in ENGINE_SCRIPTS and "command" not in merged:
+            raise ValueError(f"задание {self.name}: engine одно из {sorted(ENGINE_SCRIPTS)} или command")
+        self.command = merged.get("command")
+        self.args = [str(a) for a in merged.get("args", [])]
+        self.env = {k: str(v) for k, v in merged.get("env", {}).items()}
+        self.host = merged.get("host") or self._host_from_env()
+        self.priority = int(merged["priority"])
+        self.retries = int(merged["retries"])
+        self.backoff = float(merged["backoff"])
+        self.timeout = float(merged["timeout"])
+        at = merged.get("at", [])
+        self.at = [at] if isinstance(at, str) else list(at)
+        self.every = float(merged["every"]) if merged.get("every") else None
+        self.deadline = merged.get("deadline")
+
+    def _host_from_env(self) -> str:
+        var = ENGINE_HOST_ENV.get(self.engine or "")
+        value = self.env.get(var) or os.environ.get(var or "") or "localhost"
+        if var == "MONGODB_URI":
+            value = value.split("://", 1)[-1].rsplit("@", 1)[-1].split("/", 1)[0]
+        return value
+
+    def resumable(self) -> bool:
+        """Повтор продолжает прерванный запуск (--resume): mysql --parallel и pg --all без --dumpall."""
+        if self.command:
+            return False
+        if self.engine == "mysql":
+            return any(a == "--parallel" or a.startswith("--parallel=") for a in self.args)
+        return self.engine == "pg" and "--all" in self.args and "--dumpall" not in self.args
+
+    def argv(self, resume: bool = False) -> list[str]:
+        if self.command:
+            return [str(c) for c in self.command] + self.args
+        extra = ["--resume"] if resume and "--resume" not in self.args else []
+        return [sys.executable, str(SCRIPT_DIR / ENGINE_SCRIPTS[self.engine])] + self.args + extra
+
+    def next_run(self, after: float) -> float | None:
+        """Ближайший запуск строго после after: по "at" (HH:MM ежедневно) или "every" (секунды)."""
+        times = []
+        base = datetime.fromtimestamp(after)
+        for hhmm in self.at:
+            h, m = (int(x) for x in hhmm.split(":"))
+            t = base.replace(hour=h, minute=m, second=0, microsecond=0)
+            if t.timestamp() <= after:
+                t += timedelta(days=1)
+            times.append(t.timestamp())
+        if self.every:
+            times.append(after + self.every)
+        return min(times) if times else None
+
+    def deadline_for(self, scheduled: float) -> float | None:
+        """Срок запуска, назначенного на scheduled: ближайшее HH:MM после него или секунды от него."""
+        if self.deadline is None:
+            return None
+        if isinstance(self.deadline, (int, float)):
+            return scheduled + float(self.deadline)
+        h, m = (int(x) for x in str(self.deadline).split(":"))
+        t = datetime.fromtimestamp(scheduled).replace(hour=h, minute=m, second=0, microsecond=0)
+        if t.timestamp() <= scheduled:
+            t += timedelta(days=1)
+        return t.timestamp()
+
+
+class Run:
+    """Один запуск задания (с повторами)."""
+
+    def __init__(self, job: Job, scheduled: float, seq: int) -> None:
+        self.job = job
+        self.scheduled = scheduled
+        self.deadline = job.deadline_for(scheduled)
+        self.seq = seq
+        self.attempt = 0
+        self.not_before = scheduled
+        self.started = 0.0
+        self.seconds = 0.0  # суммарно по попыткам
+        self.killed = False  # прерван по таймауту/сроку — не повторяем
+
+    def sort_key(self) -> tuple:
+        return (-self.job.priority, self.deadline or float("inf"), self.seq)
+
+
+class Scheduler:
+    def __init__(self, config: dict, once: bool) -> None:
+        defaults = config.get("defaults", {})
+        self.jobs = [Job(spec, defaults) for spec in config["jobs"]]
+        if not once:
+            for job in self.jobs:
+                if not job.at and not job.every:
+                    log(f"[{job.name}] нет ни at, ни every — в режиме демона не запускается (только --once)")
+        names = [j.name for j in self.jobs]
+        if len(set(names)) != len(names):
+            raise ValueError("имена заданий должны быть уникальны")
+        self.max_parallel = max(1, int(config.get("max_parallel", 4)))
+        self.per_host = max(1, int(config.get("per_host", 1)))
+        self.log_dir = Path(config["log_dir"])
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.once = once
+        self.queue: list[Run] = []
+        self.running: dict[str, tuple[Run, subprocess.Popen]] = {}
+        self.host_load: dict[str, int] = {}
+        self.next_at: dict[str, float | None] = {}
+        self.window: list[dict] = []
+        self.window_started: float | None = None
+        self.stopping = False
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    # --- очередь ---
+
+    def _enqueue(self, job: Job, scheduled: float) -> None:
+        if any(r.job is job for r in self.queue) or job.name in self.running:
+            log(f"[{job.name}] предыдущий запуск ещё не завершён — пропуск запуска по расписанию")
+            return
+        self._seq += 1
+        self.queue.append(Run(job, scheduled, self._seq))
+        if self.window_started is None:
+            self.window_started = time.time()
+
+    def _schedule_due(self, now: float) -> None:
+        for job in self.jobs:
+            if job.name not in self.next_at:
+                self.next_at[job.name] = now if self.once else job.next_run(now)
+            at = self.next_at[job.name]
+            if at is not None and at <= now:
+                self._enqueue(job, at)
+                self.next_at[job.name] = None if self.once else job.next_run(now)
+
+    def _start_ready(self, now: float) -> None:
+        for run in sorted(self.queue, key=Run.sort_key):
+            if len(self.running) >= self.max_parallel:
+                return
+            if run.deadline is not None and now >= run.deadline:
+                self.queue.remove(run)
+                log(f"[{run.job.name}] срок {_fmt(run.deadline)} прошёл до запуска — пропущено")
+                self._record(run, None, "missed")
+                continue
+            if run.not_before > now or self.host_load.get(run.job.host, 0) >= self.per_host:
+                continue
+            self.queue.remove(run)
+            self._launch(run)
+
+    def _launch(self, run: Run) -> None:
+        job = run.job
+        run.attempt += 1
+        run.started = time.time()
+        env = {**os.environ, **job.env}
+        resume = run.attempt > 1 and job.resumable()
+        log(f"[{job.name}] запуск (попытка {run.attempt}/{job.retries + 1}, хост {job.host}, приоритет {job.priority})"
+            + (", продолжение с --resume" if resume else ""))
+        try:
+            proc = subprocess.Popen(job.argv(resume), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+        except OSError as e:
+            log(f"[{job.name}] не удалось запустить: {e}")
+            self._finished(run, -1)
+            return
+        self.running[job.name] = (run, proc)
+        self.host_load[job.host] = self.host_load.get(job.host, 0) + 1
+        threading.Thread(target=self._watch, args=(run, proc), daemon=True).start()
+
+    def _watch(self, run: Run, proc: subprocess.Popen) -> None:
+        """Вывод задания в лог с префиксом; по окончании — в главный цикл."""
+        prefix = f"[{run.job.name}] "
+        for line in iter(proc.stdout.readline, b""):
+            sys.stderr.write(prefix + line.decode(errors="replace"))
+        code = proc.wait()
+        with self._cond:
+            self.running.pop(run.job.name, None)
+            self.host_load[run.job.host] -= 1
+            self._finished(run, code)
+            self._cond.notify_all()
+
+    def _finished(self, run: Run, code: int) -> None:
+        elapsed = time.time() - run.started
+        run.seconds += elapsed
+        job = run.job
+        if code == 0:
+            log(f"[{job.name}] готово за {elapsed:.1f} с")
+            self._record(run, code, "ok", elapsed)
+            return
+        now = time.time()
+        delay = job.backoff * 2 ** (run.attempt - 1) * random.uniform(0.9, 1.1)
+        retry = (not self.stopping and not run.killed and run.attempt <= job.retries
+                 and not (run.deadline and now + delay >= run.deadline))
+        log(f"[{job.name}] ошибка (код {code}) за {elapsed:.1f} с" + (f", повтор через {delay:.0f} с" if retry else ""))
+        self._record(run, code, "retry" if retry else "failed", elapsed)
+        if retry:
+            run.not_before = now + delay
+            self.queue.append(run)
+
+    def _enforce(self, now: float) -> None:
+        """Прервать задания, превысившие таймаут попытки или срок."""
+        for run, proc in list(self.running.values()):
+            limit = run.started + run.job.timeout
+            if run.deadline is not None:
+                limit = min(limit, run.deadline)
+            if now >= limit and proc.poll() is None:
+                log(f"[{run.job.name}] превышен таймаут/срок — остановка")
+                run.killed = True
+                _terminate(proc)
+
+    # --- журнал ---
+
+    def _record(self, run: Run, code: int | None, status: str, seconds: float = 0.0) -> None:
+        entry = {
+            "name": run.job.name,
+            "engine": run.job.engine,
+            "host": run.job.host,
+            "attempt": run.attempt,
+            "scheduled": round(run.scheduled, 3),
+            "started": round(run.started, 3) if run.started else None,
+            "finished": round(time.time(), 3),
+            "seconds": round(seconds, 3),
+            "code": code,
+            "status": status,
+        }
+        with open(self.log_dir / "runs.jsonl", "a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        if status != "retry":
+            self.window.append({**entry, "seconds": round(run.seconds, 3)})
+
+    def _close_window(self) -> dict | None:
+        """Окно закончилось (очередь пуста, ничего не выполняется): сводка и сброс."""
+        if self.window_started is None or self.queue or self.running:
+            return None
+        wall = time.time() - self.window_started
+        total = sum(e["seconds"] for e in self.window)
+        slowest = max(self.window, key=lambda e: e["seconds"], default=None)
+        summary = {
+            "started": datetime.fromtimestamp(self.window_started).isoformat(timespec="seconds"),
+            "wall_seconds": round(wall, 3),
+            "sum_job_seconds": round(total, 3),
+            "slowest": slowest["name"] if slowest else None,
+            "ok": sum(1 for e in self.window if e["status"] == "ok"),
+            "failed": sum(1 for e in self.window if e["status"] == "failed"),
+            "missed": sum(1 for e in self.window if e["status"] == "missed"),
+            "jobs": {e["name"]: {"status": e["status"], "seconds": e["seconds"], "attempts": e["attempt"]} for e in self.window},
+        }
+        log(f"Окно завершено за {wall:.1f} с (сумма заданий {total:.1f} с, самое долгое — {summary['slowest']}): "
+            f"ok {summary['ok']}, ошибок {summary['failed']}, пропущено {summary['missed']}")
+        with open(self.log_dir / "windows.jsonl", "a") as f:
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        self.window = []
+        self.window_started = None
+        return summary
+
+    # --- главный цикл ---
+
+    def _next_wakeup(self, now: float) -> float:
+        events = [t for t in self.next_at.values() if t is not None]
+        events += [r.not_before for r in self.queue if r.not_before > now]
+        events += [r.deadline for r in self.queue if r.deadline]
+        for run, _ in self.running.values():
+            events.append(run.started + run.job.timeout)
+            if run.deadline:
+                events.append(run.deadline)
+        return max(0.05, min([now + TICK] + events) - now)
+
+    def stop(self, *_: object) -> None:
+        """Обработчик SIGTERM/SIGINT: только флаг, остановку выполняет главный цикл."""
+        self.stopping = True
+        with self._cond:
+            self._cond.notify_all()
+
+    def loop(self) -> dict | None:
+        summary = None
+        stopped = False
+        with self._cond:
+            while True:
+                now = time.time()
+                if self.stopping and not stopped:
+                    log("Остановка: новые задания не запускаются, выполняющиеся прерываются")
+                    stopped = True
+                    self.queue.clear()
+                    for _, proc in self.running.values():
+                        _terminate(proc)
+                if not self.stopping:
+                    self._schedule_due(now)
+                    self._start_ready(now)
+                self._enforce(now)
+                summary = self._close_window() or summary
+                if (self.once or self.stopping) and not self.queue and not self.running:
+                    return summary
+                self._cond.wait(timeout=self._next_wakeup(now))
+
+
+def _terminate(proc: subprocess.Popen) -> None:
+    """SIGTERM группе процессов задания (дампер — дочерний процесс скрипта); через 30 с — SIGKILL."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    def _kill() -> None:
+        if proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    timer = threading.Timer(30, _kill)
+    timer.daemon = True
+    timer.start()
+
+
+def _fmt(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Планировщик бэкапов: параллельный запуск заданий с лимитами")
+    parser.add_argument("--config", "-c", required=True, help="JSON-файл заданий")
+    parser.add_argument("--once", action="store_true", help="Запустить все задания сейчас и выйти после окна")
+    parser.add_argument("--only", nargs="*", default=None, help="Только эти задания (по имени)")
+    args = parser.parse_args()
+
+    try:
+        config = json.loads(Path(args.config).read_text())
+        config.setdefault("log_dir", str(Path(args.config).resolve().parent / ".scheduler"))
+        if args.only is not None:
+            config["jobs"] = [j for j in config["jobs"] if j.get("name") in args.only]
+        scheduler = Scheduler(config, args.once)
+    except (OSError, ValueError, KeyError) as e:
+        log(f"Ошибка файла заданий {args.config}: {e}")
+        return 1
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    log(f"Заданий: {len(scheduler.jobs)}, одновременно до {scheduler.max_parallel}, на хост до {scheduler.per_host}")
+    summary = scheduler.loop()
+    if args.once:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 0 if summary and not summary["failed"] and not summary["missed"] else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
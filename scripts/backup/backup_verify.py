@@ -1,41 +1,115 @@
 #!/usr/bin/env python3
 """
 Проверка целостности бэкапов.
-  PostgreSQL: pg_restore --list (для формата custom .dump)
-  MySQL: проверка существования и при необходимости gunzip -t для .sql.gz
-  MongoDB: проверка наличия каталога и файлов BSON/metadata
-  Redis: проверка существования и размера .rdb
+  PostgreSQL: pg_restore --list (для формата custom .dump); базовая копия pg_base_*.tar.* (backup_pg_wal.py) —
+    разбор tar с распаковкой на лету, наличие backup_label и global/pg_control; физическая копия pg_phys_*.dir
+    (backup_postgres.py --physical) — хеши файлов всех tar по backup_manifest, его контрольная сумма, WAL копии
+  MySQL: проверка существования и целостности сжатия (gzip/zstd/lz4 -t, кодек — по суффиксу или сигнатуре);
+    каталог --parallel — по metadata.json
+  MongoDB: разметка документов во всех .bson/.bson.gz, сверка с .metadata.json — backup_bson.py;
+    архив --archive — пролог, блоки коллекций и их завершение, с распаковкой на лету
+  Redis: потоковый разбор .rdb (все опкоды и кодировки значений) и CRC64 — backup_rdb.py, без redis-check-rdb;
+    сжатый .rdb.zst/.rdb.lz4/.rdb.gz разбирается через распаковку на лету
+Режимы (--mode):
+  tool — проверка инструментом СУБД, как выше (по умолчанию);
+  fast — по манифесту <артефакт>.manifest.json, записанному при бэкапе: наличие и размеры, без чтения данных;
+  full — пересчёт хешей (mmap, крупные последовательные чтения; файлы каталога — параллельно) и сверка с манифестом.
+--dir: все артефакты каталога (тип по префиксу имени pg_/mysql_/mongo_/redis_) проверяются в пуле процессов.
+Успешные результаты кешируются в DIR/.verify_cache.json по (устройство, inode, размер, mtime): неизменённые
+артефакты повторно не проверяются. В stdout — JSON-сводка со временем проверки каждого артефакта.
 Использование:
   python3 backup_verify.py --type pg --path /backup/pg/pg_mydb_2025-02-11.dump
   python3 backup_verify.py --type mysql --path /backup/mysql/mysql_all_2025-02-11.sql.gz
-  python3 backup_verify.py --type redis --path /backup/redis/redis_2025-02-11.rdb
+  python3 backup_verify.py --type redis --path /backup/redis/redis_2025-02-11.rdb [--workers 4] [--no-crc]
+  python3 backup_verify.py --type pg --path /backup/pg/pg_mydb_2025-02-11.dir --mode full --workers 8
+  python3 backup_verify.py --dir /backup/pg --jobs 8 [--mode full] [--no-cache]
 """
 from __future__ import annotations
 
 import argparse
+import json
+import os
 import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from backup_common import log, run
+import backup_catalog as catalog
+import backup_codecs as codecs
+from backup_bson import BsonError, validate
+from backup_pg_physical import MANIFEST as PG_MANIFEST
+from backup_pg_physical import validate as validate_pg_physical
+from backup_common import SIDECAR_SUFFIX, hash_file, log, read_sidecar, run
+from backup_rdb import RdbError, validate_rdb
 
+CACHE_NAME = ".verify_cache.json"
 
-def verify_pg(path: Path, pg_restore: str) -> int:
-    """Проверка дампа PostgreSQL: pg_restore --list."""
+
+def verify_pg(path: Path, pg_restore: str, workers: int = 1) -> int:
+    """Проверка дампа PostgreSQL: pg_restore --list (custom/directory); .sql (pg_dumpall) — не пустой."""
     if not path.exists():
         log(f"Файл не найден: {path}")
         return 1
-    code = run([pg_restore, "--list", str(path)], log_prefix="[pg_restore --list] ")
+    if (path / PG_MANIFEST).is_file():
+        return verify_pg_physical(path, workers)
+    if path.name.endswith(".sql"):
+        return verify_nonempty(path)
+    if ".tar" in path.name:
+        return verify_pg_base(path)
+    code = run([pg_restore, "--list", str(path)], log_prefix="[pg_restore --list] ", timeout=3600)
     return 0 if code == 0 else 1
 
 
-def verify_mysql(path: Path) -> int:
-    """Проверка: файл существует; если .gz — gunzip -t."""
+def verify_pg_base(path: Path) -> int:
+    """Базовая копия pg_basebackup -Ft: tar читается до конца (целостность сжатия и заголовков), нужные файлы есть."""
+    names = set()
+    size = 0
+    try:
+        with codecs.open_reader(path) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+            for member in tar:
+                names.add(member.name.lstrip("./"))
+                size += member.size
+    except (OSError, tarfile.TarError) as e:
+        log(f"{path}: ошибка чтения tar: {e}")
+        return 1
+    missing = [n for n in ("backup_label", "global/pg_control") if n not in names]
+    if missing:
+        log(f"{path}: нет {', '.join(missing)} — не базовая копия")
+        return 1
+    log(f"{path}: файлов {len(names)}, {size / 1e6:.1f} МБ")
+    return 0
+
+
+def verify_pg_physical(path: Path, workers: int = 1) -> int:
+    """Физическая копия (pg_basebackup -Ft): файлы всех tar против backup_manifest, tar — в workers потоках."""
+    try:
+        report = validate_pg_physical(path, workers)
+    except (OSError, ValueError) as e:
+        log(f"{path}: ошибка чтения {PG_MANIFEST}: {e}")
+        return 1
+    for w in report["warnings"]:
+        log(f"[WARN] {w}")
+    for e in report["errors"]:
+        log(f"[ERROR] {e}")
+    if report["errors"]:
+        return 1
+    log(f"{path}: tar {report['tars']}, файлов {report['files']} по {PG_MANIFEST}, сегментов WAL {report['wal_segments']}, "
+        f"{report['mb_per_s']} МБ/с")
+    return 0
+
+
+def verify_mysql(path: Path, workers: int = 1) -> int:
+    """Проверка: файл существует; сжатый — проверка утилитой кодека (gzip/zstd/lz4 -t). Каталог (--parallel) — verify_mysql_dir."""
     if not path.exists():
         log(f"Файл не найден: {path}")
         return 1
-    if path.suffix == ".gz" or path.name.endswith(".sql.gz"):
-        code = run(["gunzip", "-t", str(path)], log_prefix="[gunzip -t] ")
+    if path.is_dir():
+        return verify_mysql_dir(path, workers)
+    cmd = codecs.test_cmd(codecs.detect(path))
+    if cmd is not None:
+        code = run(cmd + [str(path)], log_prefix=f"[{cmd[0]} -t] ", timeout=3600)
         return 0 if code == 0 else 1
     if path.stat().st_size == 0:
         log("Файл пустой")
@@ -43,23 +117,50 @@ def verify_mysql(path: Path) -> int:
     return 0
 
 
-def verify_mongo(path: Path) -> int:
-    """Проверка каталога mongodump: есть подкаталоги с .bson/.metadata.json."""
-    if not path.is_dir():
-        log(f"Каталог не найден: {path}")
+def verify_mysql_dir(path: Path, workers: int = 1) -> int:
+    """Каталог backup_mysql.py --parallel: есть metadata.json, схема и все куски из него; каждый сжатый файл — -t."""
+    try:
+        meta = json.loads((path / "metadata.json").read_text())
+    except (OSError, ValueError) as e:
+        log(f"{path}: не читается metadata.json: {e}")
+        return 1
+    files = [meta["schema"], meta["triggers"]] + [c["file"] for c in meta.get("chunks", [])]
+    missing = [f for f in files if not (path / f).is_file()]
+    for f in missing:
+        log(f"{path}: нет файла {f}")
+    present = [path / f for f in files if f not in missing]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        failed = sum(code != 0 for code in pool.map(verify_mysql, present))
+    log(f"{path}: файлов {len(files)}, отсутствует {len(missing)}, повреждено {failed}"
+        + (f", binlog {meta['binlog_file']}:{meta['binlog_position']}" if "binlog_file" in meta else ""))
+    return 1 if missing or failed else 0
+
+
+def verify_mongo(path: Path, workers: int = 1) -> int:
+    """
+    Проверка каталога mongodump: разметка BSON каждой коллекции (workers процессов) и сверка с метаданными.
+    Файл — архив mongodump --archive (сжатый кодеком backup_codecs): проверка потока целиком.
+    """
+    if not path.exists():
+        log(f"Не найден: {path}")
         return 1
-    has_bson = False
-    for f in path.rglob("*"):
-        if f.suffix == ".bson" or f.name.endswith(".metadata.json"):
-            has_bson = True
-            break
-    if not has_bson:
-        log("В каталоге нет ожидаемых файлов BSON/metadata")
+    try:
+        report = validate(path, workers)
+    except (BsonError, OSError) as e:
+        log(f"Ошибка: {e}")
         return 1
+    for w in report["warnings"]:
+        log(f"[WARN] {w}")
+    for e in report["errors"]:
+        log(f"[ERROR] {e}")
+    if report["errors"]:
+        return 1
+    log(f"BSON в порядке: коллекций {len(report['collections'])}, документов {report['docs']}, "
+        f"{report['mb_per_s']} МБ/с")
     return 0
 
 
-def verify_redis(path: Path) -> int:
+def verify_nonempty(path: Path) -> int:
     """Проверка: файл существует и не пустой."""
     if not path.exists():
         log(f"Файл не найден: {path}")
@@ -70,27 +171,188 @@ def verify_redis(path: Path) -> int:
     return 0
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Проверка целостности бэкапов")
-    parser.add_argument("--type", "-t", required=True, choices=["pg", "postgres", "mysql", "mongo", "mongodb", "redis"],
-                        help="Тип бэкапа")
-    parser.add_argument("--path", "-p", required=True, help="Путь к файлу или каталогу бэкапа")
-    parser.add_argument("--pg-restore", default="pg_restore", help="Путь к pg_restore (для типа pg)")
-    args = parser.parse_args()
+def verify_redis(path: Path, check_crc: bool = True, workers: int = 1) -> int:
+    """Проверка RDB: структура всех ключей и CRC64 (workers — процессов для CRC)."""
+    if verify_nonempty(path) != 0:
+        return 1
+    try:
+        report = validate_rdb(path, check_crc=check_crc, workers=workers)
+    except (OSError, RdbError) as e:
+        log(f"Ошибка RDB {path}: {e}")
+        return 1
+    dbs = ", ".join(f"db{db}: {st['keys']} (TTL {st['expires']})" for db, st in report["dbs"].items())
+    log(f"RDB v{report['version']} в порядке: ключей {report['keys']} [{dbs or 'пусто'}], CRC64 {report['crc']}, "
+        f"{report['mb_per_s']} МБ/с")
+    return 0
+
+
+def verify_manifest(path: Path, full: bool, workers: int) -> int:
+    """Сверка артефакта с манифестом: размеры (fast) или размеры + хеши (full)."""
+    if not path.exists():
+        log(f"Не найден: {path}")
+        return 1
+    manifest = read_sidecar(path)
+    if manifest is None:
+        log(f"Нет манифеста для {path} (бэкап сделан без контрольных сумм?)")
+        return 1
+    algo = manifest["algorithm"]
+    if "files" in manifest:
+        expected = [(path / rel, e["size"], e["digest"]) for rel, e in manifest["files"].items()]
+    else:
+        expected = [(path, manifest["size"], manifest["digest"])]
+
+    errors = 0
+    for f, size, _ in expected:
+        try:
+            actual = f.stat().st_size
+        except OSError:
+            log(f"Отсутствует: {f}")
+            errors += 1
+            continue
+        if actual != size:
+            log(f"Размер не совпадает: {f} ({actual} вместо {size})")
+            errors += 1
+    if errors or not full:
+        return 1 if errors else 0
+
+    # hashlib отпускает GIL на больших блоках, поэтому потоки хешируют файлы параллельно
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        digests = list(pool.map(lambda e: hash_file(e[0], algo)[0], expected))
+    for (f, _, digest), actual in zip(expected, digests):
+        if actual != digest:
+            log(f"Хеш не совпадает: {f}")
+            errors += 1
+    if errors:
+        return 1
+    log(f"Хеши совпадают ({algo}, файлов: {len(expected)})")
+    return 0
 
-    path = Path(args.path)
-    t = args.type
 
+def verify_one(path: Path, t: str, mode: str, pg_restore: str, workers: int = 1, check_crc: bool = True) -> int:
+    """Проверка одного артефакта выбранным режимом."""
+    if mode != "tool":
+        return verify_manifest(path, mode == "full", workers)
     if t in ("pg", "postgres"):
-        return verify_pg(path, args.pg_restore)
+        return verify_pg(path, pg_restore, workers)
     if t == "mysql":
-        return verify_mysql(path)
+        return verify_mysql(path, workers)
     if t in ("mongo", "mongodb"):
-        return verify_mongo(path)
+        return verify_mongo(path, workers)
     if t == "redis":
-        return verify_redis(path)
+        return verify_redis(path, check_crc, workers)
     return 1
 
 
+def artifact_key(path: Path) -> list[int]:
+    """Ключ кеша: (устройство, inode, размер, mtime_ns); для каталога — суммарный размер и последний mtime файлов."""
+    st = path.stat()
+    size, mtime = st.st_size, st.st_mtime_ns
+    if path.is_dir():
+        for f in path.rglob("*"):
+            fst = f.stat()
+            size += fst.st_size
+            mtime = max(mtime, fst.st_mtime_ns)
+    return [st.st_dev, st.st_ino, size, mtime]
+
+
+def _verify_timed(path: str, t: str, mode: str, pg_restore: str, check_crc: bool) -> tuple[int, float]:
+    """Для пула процессов: (код, секунды)."""
+    started = time.monotonic()
+    code = verify_one(Path(path), t, mode, pg_restore, check_crc=check_crc)
+    return code, time.monotonic() - started
+
+
+def verify_dir(directory: Path, mode: str, pg_restore: str, jobs: int, use_cache: bool, check_crc: bool = True) -> int:
+    """Проверка всех артефактов каталога параллельно, с кешем успешных результатов. Сводка — JSON в stdout."""
+    if not directory.is_dir():
+        log(f"Каталог не найден: {directory}")
+        return 1
+    cache_file = directory / CACHE_NAME
+    cache: dict = {}
+    if use_cache and cache_file.is_file():
+        try:
+            cache = json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            cache = {}
+
+    # Проверка без CRC слабее полной: в кеше это отдельный режим
+    cache_mode = mode if check_crc or mode != "tool" else "tool-nocrc"
+    started = time.monotonic()
+    results = []
+    pending = {}
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for f in sorted(directory.iterdir()):
+            t = catalog.artifact_type(f.name)
+            if t is None or f.name.startswith(".") or f.name.endswith(SIDECAR_SUFFIX):
+                continue
+            try:
+                key = artifact_key(f)
+            except OSError as e:
+                results.append({"name": f.name, "type": t, "status": "failed", "seconds": 0.0, "error": str(e)})
+                continue
+            cached = cache.get(f.name)
+            if use_cache and cached and cached.get("key") == key and cache_mode in cached.get("modes", []):
+                results.append({"name": f.name, "type": t, "status": "cached", "seconds": 0.0})
+                continue
+            pending[f.name] = (t, key, pool.submit(_verify_timed, str(f), t, mode, pg_restore, check_crc))
+
+        for name, (t, key, fut) in pending.items():
+            code, seconds = fut.result()
+            ok = code == 0
+            results.append({"name": name, "type": t, "status": "ok" if ok else "failed", "seconds": round(seconds, 3)})
+            if ok:
+                prev = cache.get(name, {})
+                modes = prev.get("modes", []) if prev.get("key") == key else []
+                cache[name] = {"key": key, "modes": sorted(set(modes) | {cache_mode}), "verified": time.time()}
+            else:
+                cache.pop(name, None)
+
+    if use_cache:
+        # Записи об удалённых артефактах не храним
+        present = {r["name"] for r in results}
+        cache = {k: v for k, v in cache.items() if k in present}
+        tmp = cache_file.with_name(cache_file.name + ".tmp")
+        tmp.write_text(json.dumps(cache))
+        os.replace(tmp, cache_file)
+
+    results.sort(key=lambda r: r["name"])
+    failed = sum(1 for r in results if r["status"] == "failed")
+    summary = {
+        "dir": str(directory),
+        "mode": mode,
+        "total": len(results),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "cached": sum(1 for r in results if r["status"] == "cached"),
+        "failed": failed,
+        "seconds": round(time.monotonic() - started, 3),
+        "artifacts": results,
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Проверка целостности бэкапов")
+    parser.add_argument("--type", "-t", default=None, choices=["pg", "postgres", "mysql", "mongo", "mongodb", "redis"],
+                        help="Тип бэкапа")
+    parser.add_argument("--path", "-p", default=None, help="Путь к файлу или каталогу бэкапа")
+    parser.add_argument("--dir", default=None, help="Проверить все артефакты каталога (тип — по префиксу имени)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="Процессов проверки для --dir")
+    parser.add_argument("--no-cache", action="store_true", help="--dir: не использовать кеш проверенных артефактов")
+    parser.add_argument("--pg-restore", default="pg_restore", help="Путь к pg_restore (для типа pg)")
+    parser.add_argument("--mode", "-m", choices=["tool", "fast", "full"], default="tool",
+                        help="tool — инструментом СУБД; fast — по манифесту; full — пересчёт хешей")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Потоков хеширования (--mode full) / процессов CRC64 (redis) и коллекций (mongo)")
+    parser.add_argument("--no-crc", action="store_true", help="redis: только структура RDB, без CRC64")
+    args = parser.parse_args()
+
+    if args.dir:
+        return verify_dir(Path(args.dir), args.mode, args.pg_restore, args.jobs, not args.no_cache, not args.no_crc)
+    if not args.path or not args.type:
+        parser.error("укажите --type и --path или --dir")
+    return verify_one(Path(args.path), args.type, args.mode, args.pg_restore, args.workers, not args.no_crc)
+
+
 if __name__ == "__main__":
     sys.exit(main())
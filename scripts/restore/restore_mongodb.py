@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 """
-Восстановление MongoDB из дампа (каталог mongodump).
+Восстановление MongoDB из дампа: каталог mongodump или архив backup_mongodb.py --archive
+(mongo_<дата>.archive[.gz|.zst|.lz4]) — распаковывается на лету и подаётся в stdin mongorestore --archive;
+прогресс (процент сжатого файла, МБ/с, ETA) — раз в --progress-interval секунд.
 Переменные: MONGODB_URI или MONGODB_HOST, MONGODB_PORT.
 Использование:
   python3 restore_mongodb.py --backup /path/to/mongo_YYYY-MM-DD_HH-MM [--drop] [--gzip]
+  python3 restore_mongodb.py --backup /path/to/mongo_YYYY-MM-DD_HH-MM.archive.zst [--drop] [--parallel-collections 8]
 """
 from __future__ import annotations
 
@@ -11,8 +14,18 @@ import argparse
 import os
 import subprocess
 import sys
+import time
 from pathlib import Path
 
+# Метрики запуска и кодеки — общие модули скриптов бэкапа
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backup"))
+import backup_codecs as codecs
+import backup_metrics as metrics
+
+# Блок подачи архива в mongorestore; интервал строк прогресса по умолчанию, с
+PUMP_BLOCK = 1 << 20
+PROGRESS_INTERVAL = 10.0
+
 
 def run(cmd: list[str], env: dict | None = None) -> int:
     print(f"  Выполняется: {' '.join(cmd)}", file=sys.stderr)
@@ -24,20 +37,73 @@ def run(cmd: list[str], env: dict | None = None) -> int:
         return -1
 
 
+def run_archive(cmd: list[str], path: Path, progress: float = PROGRESS_INTERVAL) -> int:
+    """
+    Архив в stdin mongorestore --archive: распаковка (backup_codecs.open_stream_reader) и подача блоками.
+    Процент и ETA — по позиции в сжатом файле. Если mongorestore завершился раньше (закрыл stdin), возвращается его код.
+    """
+    print(f"  Выполняется: {' '.join(cmd)} < {path.name}", file=sys.stderr)
+    size = path.stat().st_size
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    except FileNotFoundError as e:
+        print(f"  Ошибка: {e}", file=sys.stderr)
+        return -1
+    started = last = time.monotonic()
+    total = 0
+    try:
+        with open(path, "rb") as raw, codecs.open_stream_reader(raw, codecs.detect(path)) as f:
+            while True:
+                block = f.read(PUMP_BLOCK)
+                if not block:
+                    break
+                proc.stdin.write(block)
+                total += len(block)
+                now = time.monotonic()
+                if progress > 0 and now - last >= progress:
+                    last = now
+                    offset, elapsed = raw.tell(), now - started
+                    eta = elapsed * (size - offset) / offset if offset else 0
+                    print(f"  {offset * 100 / max(size, 1):.1f}% ({offset / 1e6:.0f} из {size / 1e6:.0f} МБ файла), "
+                          f"{total / elapsed / 1e6:.1f} МБ/с, осталось ~{eta:.0f} с", file=sys.stderr)
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass
+    except (OSError, EOFError) as e:
+        print(f"  Ошибка чтения {path.name}: {e}", file=sys.stderr)
+        proc.kill()
+        proc.wait()
+        return 1
+    code = proc.wait()
+    elapsed = max(time.monotonic() - started, 1e-6)
+    metrics.add(bytes_read=size)
+    print(f"  Подано {total} байт архива, {elapsed:.1f} с, {total / elapsed / 1e6:.1f} МБ/с", file=sys.stderr)
+    return code
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Восстановление MongoDB из дампа (mongorestore)")
-    parser.add_argument("--backup", "-b", required=True, help="Путь к каталогу дампа (результат mongodump)")
+    parser.add_argument("--backup", "-b", required=True,
+                        help="Каталог дампа (mongodump) или файл архива (backup_mongodb.py --archive)")
     parser.add_argument("--drop", action="store_true", help="Удалять коллекции перед восстановлением")
     parser.add_argument("--gzip", action="store_true", help="Дамп был создан с --gzip (mongorestore --gzip)")
+    parser.add_argument("--parallel-collections", type=int, default=0,
+                        help="Коллекций одновременно (mongorestore --numParallelCollections)")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL,
+                        help=f"Архив: строка прогресса раз в N секунд (по умолчанию {PROGRESS_INTERVAL:g}; 0 — только итог)")
     parser.add_argument("--mongorestore", default="mongorestore", help="Путь к mongorestore")
     args = parser.parse_args()
 
     backup = Path(args.backup)
-    if not backup.is_dir():
-        print(f"Ошибка: каталог дампа не найден: {backup}", file=sys.stderr)
+    if not backup.exists():
+        print(f"Ошибка: дамп не найден: {backup}", file=sys.stderr)
         return 1
+    archive = backup.is_file()
+    if archive and args.gzip:
+        print("--gzip не нужен для архива: кодек определяется по имени файла", file=sys.stderr)
+        args.gzip = False
 
-    cmd = [args.mongorestore, str(backup)]
+    cmd = [args.mongorestore] + (["--archive"] if archive else [str(backup)])
     if os.environ.get("MONGODB_URI"):
         cmd.extend(["--uri", os.environ["MONGODB_URI"]])
     else:
@@ -49,9 +115,14 @@ def main() -> int:
         cmd.append("--drop")
     if args.gzip:
         cmd.append("--gzip")
+    if args.parallel_collections > 0:
+        cmd.append(f"--numParallelCollections={args.parallel_collections}")
+    # Хост для метрик — без учётных данных из URI
+    uri_host = os.environ.get("MONGODB_URI", "").split("://", 1)[-1].rsplit("@", 1)[-1].split("/", 1)[0]
+    metrics.annotate(target=uri_host or os.environ.get("MONGODB_HOST", "localhost"), artifact=backup)
 
     print("Восстановление (mongorestore)...", file=sys.stderr)
-    code = run(cmd)
+    code = run_archive(cmd, backup, args.progress_interval) if archive else run(cmd)
     if code != 0:
         return code
     print("Готово.", file=sys.stderr)
@@ -59,4 +130,4 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("restore", "mongo", main))
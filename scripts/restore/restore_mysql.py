@@ -1,47 +1,393 @@
 #!/usr/bin/env python3
 """
-Восстановление MySQL/MariaDB из дампа (.sql или .sql.gz).
+Восстановление MySQL/MariaDB из дампа (.sql, .sql.gz, .sql.zst, .sql.lz4 — кодек по суффиксу или сигнатуре) или каталога backup_mysql.py --parallel
+(схема, затем куски таблиц в порядке metadata.json, затем триггеры).
+Дамп подаётся в stdin mysql насосом: распаковка в процессе (gzip — zlib, zstd/lz4 — модуль или утилита)
+блоками по 1 МБ, запись в pipe блокируется, пока mysql не заберёт данные, — в памяти несколько МБ.
+Прогресс раз в --progress-interval секунд: МБ/с на входе mysql, процент по прочитанной части сжатого файла, ETA.
+--jobs N (файл дампа): поток разбирается на инструкции (backup_mysql_split.py) за один проход без распаковки на диск.
+Заголовок дампа (SET) выполняется в каждом соединении; схема (CREATE DATABASE, CREATE TABLE) — одним
+соединением, и перед первыми данными таблицы оно дожидается своей очереди (SELECT-метка в ответе); INSERT таблицы
+идут в «её» загрузчик из N, а когда его очередь полна — в наименее занятый (большая таблица грузится в несколько
+соединений). Представления, процедуры, события и триггеры — последними, после всех данных. В памяти — по
+очереди на загрузчик (--jobs × 16 МБ).
+--fast-load: каждое соединение начинает с SET SESSION foreign_key_checks=0, unique_checks=0, sql_log_bin=0
+(--init-command), на сервере на время восстановления innodb_flush_log_at_trx_commit=2 (SET GLOBAL); прежние
+значения возвращаются в конце, в том числе при ошибке и SIGTERM. Нужны права SYSTEM_VARIABLES_ADMIN (SUPER).
+Ускорение к последнему обычному восстановлению той же цели — в лог (журнал метрик BACKUP_METRICS_*).
 Переменные: MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PWD.
 Использование:
   python3 restore_mysql.py --backup /path/to/dump.sql.gz [--database mydb]
+  python3 restore_mysql.py --backup /backup/mysql/mysql_all_2025-02-11_12-00.dir
+  python3 restore_mysql.py --backup /backup/mysql/mysql_all_2025-02-11.sql.zst --jobs 8 --fast-load
   Если в дампе одна БД или --all-databases, --database можно не указывать.
 """
 from __future__ import annotations
 
 import argparse
-import gzip
+import json
 import os
+import queue
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 
+# Метрики запуска и кодеки — общие модули скриптов бэкапа
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backup"))
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_mysql_split as split
 
-def run(cmd: list[str], stdin=None, env: dict | None = None) -> int:
-    print(f"  Выполняется: {' '.join(cmd[:6])}{'...' if len(cmd) > 6 else ''}", file=sys.stderr)
+# Блок подачи дампа в mysql; интервал строк прогресса по умолчанию, с
+PUMP_BLOCK = 1 << 20
+PROGRESS_INTERVAL = 10.0
+# --jobs: очередь блоков на загрузчик; представления, процедуры и триггеры копятся в памяти до предела, дальше — во временном файле
+LOADER_QUEUE = 16
+LATE_SPOOL = 16 << 20
+# --fast-load: настройки сессии каждого соединения и сервера (возвращаются после восстановления)
+FAST_LOAD_SESSION = "SET SESSION foreign_key_checks = 0, unique_checks = 0, sql_log_bin = 0"
+FAST_LOAD_GLOBAL = {"innodb_flush_log_at_trx_commit": "2"}
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds} с"
+
+
+def _progress(offset: int, size: int, total: int, elapsed: float, what: str) -> None:
+    """Строка прогресса: процент и ETA — по позиции в сжатом файле, скорость — по распакованному потоку."""
+    eta = elapsed * (size - offset) / offset if offset else 0
+    print(f"  {offset * 100 / max(size, 1):.1f}% ({offset / 1e6:.0f} из {size / 1e6:.0f} МБ файла), "
+          f"{total / 1e6:.0f} МБ {what}, {total / max(elapsed, 1e-6) / 1e6:.1f} МБ/с, "
+          f"осталось ~{_duration(eta)}", file=sys.stderr)
+
+
+def run_file(cmd: list[str], path: Path, env: dict, progress: float = PROGRESS_INTERVAL) -> int:
+    """
+    Один файл дампа в stdin mysql: распаковка (backup_codecs.open_stream_reader) и подача блоками.
+    (Объект gzip.open в stdin передать нельзя: subprocess берёт его fileno(), т.е. сжатые байты.)
+    Процент и ETA — по позиции в сжатом файле; progress — интервал строк прогресса (0 — только итог).
+    """
+    print(f"  Выполняется: {' '.join(cmd[:6])}{'...' if len(cmd) > 6 else ''} < {path.name}", file=sys.stderr)
+    size = path.stat().st_size
     try:
-        r = subprocess.run(
-            cmd,
-            stdin=stdin,
-            env={**os.environ, **(env or {})},
-            timeout=7200,
-        )
-        return r.returncode
-    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, env={**os.environ, **env})
+    except FileNotFoundError as e:
         print(f"  Ошибка: {e}", file=sys.stderr)
         return -1
+    started = last = time.monotonic()
+    total = 0
+    finished = False
+    try:
+        with open(path, "rb") as raw, codecs.open_stream_reader(raw, codecs.detect(path)) as f:
+            while True:
+                block = f.read(PUMP_BLOCK)
+                if not block:
+                    finished = True
+                    break
+                proc.stdin.write(block)
+                total += len(block)
+                now = time.monotonic()
+                if progress > 0 and now - last >= progress:
+                    last = now
+                    _progress(raw.tell(), size, total, now - started, "в mysql")
+        proc.stdin.close()
+    except BrokenPipeError:
+        pass  # mysql завершился раньше — его код ниже
+    except (OSError, EOFError) as e:
+        print(f"  Ошибка чтения {path.name}: {e}", file=sys.stderr)
+        proc.kill()
+        proc.wait()
+        return 1
+    code = proc.wait()
+    elapsed = max(time.monotonic() - started, 1e-6)
+    metrics.add(bytes_read=size)
+    print(f"  Подано {total / 1e6:.1f} МБ за {_duration(elapsed)}, {total / elapsed / 1e6:.1f} МБ/с", file=sys.stderr)
+    if code == 0 and not finished:
+        print(f"Ошибка: mysql завершился, не дочитав {path.name}", file=sys.stderr)
+        return 1
+    return code
+
+
+def _use(db: str) -> bytes:
+    return b"USE `" + db.encode().replace(b"`", b"``") + b"`;\n"
+
+
+class _Loader:
+    """Соединение mysql для данных: блоки копятся в ограниченной очереди, поток пишет их в stdin."""
+
+    def __init__(self, cmd: list[str], env: dict) -> None:
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, env=env)
+        self.queue: queue.Queue = queue.Queue(maxsize=LOADER_QUEUE)
+        self.db = None
+        self.sent = 0
+        self.broken = False
+        self._buf: list[bytes] = []
+        self._buf_size = 0
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+        self._thread.start()
+
+    def _pump(self) -> None:
+        try:
+            while (block := self.queue.get()) is not None:
+                self.proc.stdin.write(block)
+            self.proc.stdin.close()
+        except OSError:
+            self.broken = True  # mysql завершился (ошибка в данных) — очередь дальше только вычерпывается
+            while self.queue.get() is not None:
+                pass
+
+    def write(self, data: bytes) -> None:
+        self._buf.append(data)
+        self._buf_size += len(data)
+        self.sent += len(data)
+        if self._buf_size >= PUMP_BLOCK:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buf:
+            self.queue.put(b"".join(self._buf))
+            self._buf, self._buf_size = [], 0
+
+    def close(self) -> int:
+        self.flush()
+        self.queue.put(None)
+        self._thread.join()
+        return self.proc.wait()
+
+
+def _pick(loaders: list[_Loader], current: _Loader | None) -> _Loader:
+    """Загрузчик таблицы, пока его очередь не полна; иначе — наименее занятый."""
+    if current is not None and not current.queue.full():
+        return current
+    return min(loaders, key=lambda l: (l.queue.qsize(), l.sent))
+
+
+def _sync(proc: subprocess.Popen, n: int) -> bool:
+    """Дождаться, пока соединение схемы выполнит всё отправленное: SELECT-метка и её строка в ответе."""
+    token = f"restore-sync-{n}".encode()
+    proc.stdin.write(b"SELECT '" + token + b"';\n")
+    proc.stdin.flush()
+    while line := proc.stdout.readline():
+        if line.strip() == token:
+            return True
+    return False
+
+
+def restore_split(cmd: list[str], path: Path, env: dict, jobs: int, progress: float = PROGRESS_INTERVAL) -> int:
+    """
+    Один файл дампа в jobs соединений: схема и SET — соединением схемы, INSERT — загрузчиками,
+    представления, процедуры и триггеры — соединением схемы после всех данных. Стоп на первой ошибке.
+    """
+    size = path.stat().st_size
+    print(f"  Выполняется: {' '.join(cmd[:6])}{'...' if len(cmd) > 6 else ''} × {jobs + 1} < {path.name}", file=sys.stderr)
+    procs: list[subprocess.Popen] = []
+    try:
+        schema = subprocess.Popen([cmd[0], "--batch", "--skip-column-names", "--unbuffered"] + cmd[1:],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, env={**os.environ, **env})
+        procs.append(schema)
+        loaders = []
+        for _ in range(jobs):
+            loaders.append(_Loader(cmd, {**os.environ, **env}))
+            procs.append(loaders[-1].proc)
+    except FileNotFoundError as e:
+        print(f"  Ошибка: {e}", file=sys.stderr)
+        for p in procs:
+            p.kill()
+        return -1
+
+    late = tempfile.SpooledTemporaryFile(max_size=LATE_SPOOL)
+    late_db = None
+    tables: dict[tuple, int] = {}
+    owner: dict[tuple, _Loader] = {}
+    pending_schema = False
+    syncs = 0
+    started = last = time.monotonic()
+    total = 0
+    ok = False
+    try:
+        with open(path, "rb") as raw, codecs.open_stream_reader(raw, codecs.detect(path)) as f:
+            for dest, db, table, text in split.statements(f):
+                total += len(text)
+                if dest == split.DATA:
+                    if pending_schema:
+                        syncs += 1
+                        if not _sync(schema, syncs):
+                            print("Ошибка: соединение схемы завершилось (ошибка в DDL)", file=sys.stderr)
+                            return schema.wait() or 1
+                        pending_schema = False
+                    key = (db, table)
+                    loader = owner[key] = _pick(loaders, owner.get(key))
+                    if loader.broken:
+                        print("Ошибка: загрузчик завершился на данных", file=sys.stderr)
+                        return loader.proc.wait() or 1
+                    if db and loader.db != db:
+                        loader.write(_use(db))
+                        loader.db = db
+                    loader.write(text)
+                    tables[key] = tables.get(key, 0) + len(text)
+                elif dest == split.LATE:
+                    if db and db != late_db:
+                        late.write(_use(db))
+                        late_db = db
+                    late.write(text)
+                else:
+                    schema.stdin.write(text)
+                    pending_schema = True
+                    if dest == split.PREAMBLE:
+                        for loader in loaders:
+                            loader.write(text)
+                now = time.monotonic()
+                if progress > 0 and now - last >= progress:
+                    last = now
+                    _progress(raw.tell(), size, total, now - started, "разобрано")
+        loaded = time.monotonic()
+        codes = [loader.close() for loader in loaders]
+        failed = next((c for c in codes if c != 0), 0)
+        if failed:
+            print(f"Ошибка: загрузчик завершился с кодом {failed}", file=sys.stderr)
+            return failed
+        data_seconds = time.monotonic() - started
+        late_size = late.tell()
+        late.seek(0)
+        shutil.copyfileobj(late, schema.stdin, PUMP_BLOCK)
+        schema.stdin.close()
+        schema.stdout.read()
+        code = schema.wait()
+        ok = code == 0
+    except BrokenPipeError:
+        print("Ошибка: соединение схемы закрылось раньше конца дампа", file=sys.stderr)
+        return schema.wait() or 1
+    except (OSError, EOFError) as e:
+        print(f"  Ошибка чтения {path.name}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        late.close()
+        if not ok:
+            for p in procs:
+                if p.poll() is None:
+                    p.kill()
+            for p in procs:
+                p.wait()
+    elapsed = max(time.monotonic() - started, 1e-6)
+    metrics.add(bytes_read=size)
+    if tables:
+        (db, table), largest = max(tables.items(), key=lambda kv: kv[1])
+        name = f"{db}.{table}" if db else table
+        print(f"  Таблиц с данными {len(tables)}, крупнейшая {name} {largest / 1e6:.1f} МБ "
+              f"({largest * 100 // max(sum(tables.values()), 1)}%); загрузчики: "
+              + ", ".join(f"{loader.sent / 1e6:.1f}" for loader in loaders) + " МБ", file=sys.stderr)
+    print(f"  Подано {total / 1e6:.1f} МБ за {_duration(elapsed)}, {total / elapsed / 1e6:.1f} МБ/с "
+          f"(схема и данные {_duration(data_seconds)}, разбор до {_duration(loaded - started)}; "
+          f"представления, процедуры, триггеры {late_size / 1e3:.0f} КБ — {_duration(elapsed - data_seconds)})",
+          file=sys.stderr)
+    if code != 0:
+        print(f"Ошибка: представления, процедуры или триггеры: mysql завершился с кодом {code}", file=sys.stderr)
+    return code
+
+
+def _query(cmd: list[str], env: dict, sql: str) -> str | None:
+    """Одна инструкция через mysql -N -B -e: вывод или None (ошибка — в лог)."""
+    try:
+        r = subprocess.run(cmd[:1] + ["-N", "-B", "-e", sql] + cmd[1:], env={**os.environ, **env},
+                           capture_output=True, text=True, timeout=60)
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        print(f"  Ошибка: {e}", file=sys.stderr)
+        return None
+    if r.returncode != 0:
+        print(f"  Ошибка: {r.stderr.strip()}", file=sys.stderr)
+        return None
+    return r.stdout.strip()
+
+
+def _terminate(signum, frame) -> None:
+    raise SystemExit(128 + signum)  # SIGTERM — через finally: настройки сервера возвращаются
+
+
+@contextmanager
+def fast_load(cmd: list[str], env: dict):
+    """
+    Настройки сервера FAST_LOAD_GLOBAL на время блока; прежние значения возвращаются при любом исходе.
+    Значение блока — удалось ли их поставить (нет прав — без них не откроются и сессии с sql_log_bin = 0).
+    """
+    names = list(FAST_LOAD_GLOBAL)
+    out = _query(cmd, env, "SELECT " + ", ".join(f"@@GLOBAL.{name}" for name in names))
+    changed = out is not None and _query(
+        cmd, env, "SET " + ", ".join(f"GLOBAL {name} = {value}" for name, value in FAST_LOAD_GLOBAL.items())) is not None
+    if not changed:
+        print("Ошибка: --fast-load: настройки сервера не изменены (нужны права SYSTEM_VARIABLES_ADMIN или SUPER)",
+              file=sys.stderr)
+        yield False
+        return
+    original = dict(zip(names, out.split("\t")))
+    print("--fast-load: " + ", ".join(f"{name} {original[name]} -> {value}" for name, value in FAST_LOAD_GLOBAL.items())
+          + " (вернётся после восстановления)", file=sys.stderr)
+    previous = signal.signal(signal.SIGTERM, _terminate)
+    try:
+        yield True
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        restore = "SET " + ", ".join(f"GLOBAL {name} = {value}" for name, value in original.items())
+        if _query(cmd, env, restore) is None:
+            print(f"ВНИМАНИЕ: настройки сервера не возвращены, выполните вручную: {restore};", file=sys.stderr)
+        else:
+            print("--fast-load: возвращено " + ", ".join(f"{name} = {value}" for name, value in original.items()),
+                  file=sys.stderr)
+
+
+def restore_dir(cmd: list[str], backup: Path, env: dict, progress: float = PROGRESS_INTERVAL) -> int:
+    """Каталог --parallel: schema -> куски (mysql -D <БД>) -> triggers. Стоп на первой ошибке."""
+    meta = json.loads((backup / "metadata.json").read_text())
+    if meta.get("binlog_file"):
+        print(f"Позиция binlog снимка: {meta['binlog_file']}:{meta['binlog_position']}"
+              + (f", GTID {meta['gtid']}" if meta.get("gtid") else ""), file=sys.stderr)
+    steps = [(cmd, meta["schema"])]
+    steps += [(cmd + ["-D", c["db"]], c["file"]) for c in meta["chunks"]]
+    steps.append((cmd, meta["triggers"]))
+    for i, (step_cmd, name) in enumerate(steps, 1):
+        print(f"[{i}/{len(steps)}] {name}", file=sys.stderr)
+        try:
+            code = run_file(step_cmd, backup / name, env, progress)
+        except OSError as e:
+            print(f"Ошибка чтения {name}: {e}", file=sys.stderr)
+            return 1
+        if code != 0:
+            return code
+    return 0
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Восстановление MySQL/MariaDB из дампа")
-    parser.add_argument("--backup", "-b", required=True, help="Путь к .sql или .sql.gz")
+    parser.add_argument("--backup", "-b", required=True, help="Путь к .sql, .sql.gz (.zst, .lz4) или каталогу --parallel")
     parser.add_argument("--database", "-d", default=None, help="Целевая БД (опционально; для дампа одной БД можно не указывать)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Файл дампа: разобрать по таблицам и грузить в N соединений (схема — первой, триггеры и представления — последними)")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="Без проверок FK и уникальности, без binlog в сессиях, innodb_flush_log_at_trx_commit=2 на время восстановления")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL,
+                        help=f"Строка прогресса раз в N секунд (по умолчанию {PROGRESS_INTERVAL:g}; 0 — только итог)")
     parser.add_argument("--mysql", default="mysql", help="Путь к mysql")
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs: 1 и больше")
 
     backup = Path(args.backup)
     if not backup.exists():
         print(f"Ошибка: бэкап не найден: {backup}", file=sys.stderr)
         return 1
+    if backup.is_dir() and args.jobs > 1:
+        print("Ошибка: --jobs разбирает файл дампа; каталог --parallel восстанавливается по кускам", file=sys.stderr)
+        return 1
 
     cmd = [args.mysql]
     if os.environ.get("MYSQL_HOST"):
@@ -52,23 +398,33 @@ def main() -> int:
         cmd.extend(["-u", os.environ["MYSQL_USER"]])
     if args.database:
         cmd.extend([args.database])
+    metrics.annotate(target=f"{os.environ.get('MYSQL_HOST', 'localhost')}/{args.database or 'all'}", artifact=backup,
+                     profile="fast-load" if args.fast_load else None)
 
     env = os.environ.copy()
     if os.environ.get("MYSQL_PWD") or os.environ.get("MYSQL_PASSWORD"):
         env["MYSQL_PWD"] = os.environ.get("MYSQL_PWD") or os.environ.get("MYSQL_PASSWORD", "")
 
-    if backup.suffix == ".gz" or backup.name.endswith(".sql.gz"):
-        print("Распаковка и восстановление (gunzip | mysql)...", file=sys.stderr)
-        try:
-            with gzip.open(backup, "rb") as f:
-                code = run(cmd, stdin=f, env=env)
-        except OSError as e:
-            print(f"Ошибка чтения gzip: {e}", file=sys.stderr)
+    if backup.is_dir() and args.database:
+        print("Ошибка: каталог --parallel восстанавливается в исходные БД, --database не поддерживается", file=sys.stderr)
+        return 1
+    with fast_load(cmd, env) if args.fast_load else nullcontext(True) as ready:
+        if not ready:
             return 1
-    else:
-        print("Восстановление из .sql (mysql < file)...", file=sys.stderr)
-        with open(backup, "rb") as f:
-            code = run(cmd, stdin=f, env=env)
+        load_cmd = cmd[:1] + [f"--init-command={FAST_LOAD_SESSION}"] + cmd[1:] if args.fast_load else cmd
+        if backup.is_dir():
+            code = restore_dir(load_cmd, backup, env, args.progress_interval)
+        else:
+            print(f"Восстановление из {backup.name}" + (f" в {args.jobs} соединений" if args.jobs > 1 else "") + "...",
+                  file=sys.stderr)
+            try:
+                if args.jobs > 1:
+                    code = restore_split(load_cmd, backup, env, args.jobs, args.progress_interval)
+                else:
+                    code = run_file(load_cmd, backup, env, args.progress_interval)
+            except OSError as e:
+                print(f"Ошибка чтения {backup}: {e}", file=sys.stderr)
+                return 1
 
     if code != 0:
         return code
@@ -77,4 +433,4 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("restore", "mysql", main))
@@ -2,18 +2,51 @@
 """
 Восстановление PostgreSQL из бэкапа (формат custom .dump или directory).
 Опционально: создание БД (createdb), очистка объектов перед восстановлением (--clean).
+--jobs N|auto: восстановление по фазам — pre-data (схема) одним процессом, затем данные в N заданий
+(pg_restore --section=data -j N), затем индексы и ограничения в N заданий (--section=post-data -j N)
+с поднятым maintenance_work_mem (PGOPTIONS). Без --clean: pg_restore чистит только объекты своей секции —
+параллельно восстанавливают в пустую БД (--create-db). auto — число заданий по CPU и TOC архива: заданий для данных
+не больше, чем помещается «самых крупных таблиц» в объём данных (для directory — по размерам файлов),
+для post-data — не больше числа индексов и ограничений. Время каждой фазы — в лог (оценка RTO).
+--fast-load: сессии pg_restore с synchronous_commit=off и поднятым maintenance_work_mem (PGOPTIONS) и
+pg_restore --disable-triggers для данных. Настройки живут только в сессиях восстановления — на сервере ничего
+не меняется, возвращать нечего. Ускорение к последнему обычному восстановлению той же БД — в лог (журнал метрик).
 Переменные: PGHOST, PGPORT, PGUSER, PGPASSWORD.
 Использование:
   python3 restore_postgres.py --backup /path/to/file.dump --database mydb [--create-db] [--clean]
+  python3 restore_postgres.py --backup /backup/pg/pg_mydb_2025-02-11_01-00.dir -d mydb --create-db --jobs auto
+  python3 restore_postgres.py --backup /backup/pg/pg_mydb_2025-02-11.dump -d mydb --jobs 16 --maintenance-work-mem 2GB
+  python3 restore_postgres.py --backup /backup/pg/pg_mydb_2025-02-11.dump -d mydb --clean --fast-load
 """
 from __future__ import annotations
 
 import argparse
+import math
 import os
+import re
 import subprocess
 import sys
+import time
 from pathlib import Path
 
+# Метрики запуска — общий модуль скриптов бэкапа
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backup"))
+import backup_metrics as metrics
+from backup_common import run_capture
+
+# Записи TOC (pg_restore -l): "<id>; <oid> <oid> <ТИП> <схема> <имя> <владелец>"
+TOC_RE = re.compile(r"^(\d+); \d+ \d+ (.+)$")
+DATA_TYPES = ("TABLE DATA", "BLOBS", "BLOB DATA", "LARGE OBJECTS")
+POST_DATA_TYPES = ("INDEX", "CONSTRAINT", "FK CONSTRAINT", "MATERIALIZED VIEW DATA", "TRIGGER", "RULE", "POLICY")
+# Файл данных записи TOC в архиве directory: <id>.dat[.gz|.zst|.lz4]
+DATA_FILE_RE = re.compile(r"^(\d+)\.dat(?:\.\w+)?$")
+# maintenance_work_mem для post-data (auto): доля RAM хоста на все задания, пределы на одно задание
+MAINTENANCE_RAM_SHARE = 0.25
+MAINTENANCE_MIN_MB = 64
+MAINTENANCE_MAX_MB = 8192
+# --fast-load: настройки каждой сессии pg_restore (вдобавок к maintenance_work_mem)
+FAST_LOAD_SETTINGS = ("synchronous_commit=off",)
+
 
 def run(cmd: list[str], env: dict | None = None) -> int:
     print(f"  Выполняется: {' '.join(cmd)}", file=sys.stderr)
@@ -25,6 +58,114 @@ def run(cmd: list[str], env: dict | None = None) -> int:
         return -1
 
 
+def read_toc(pg_restore: str, backup: Path) -> list[tuple[int, str]] | None:
+    """Записи TOC архива: (id, тип). None — pg_restore -l не прочитал архив."""
+    code, out = run_capture([pg_restore, "-l", str(backup)], timeout=600)
+    if code != 0:
+        return None
+    entries = []
+    for line in out.splitlines():
+        m = TOC_RE.match(line)
+        if m:
+            rest = m.group(2)
+            kind = next((t for t in sorted(DATA_TYPES + POST_DATA_TYPES, key=len, reverse=True)
+                         if rest.startswith(t + " ")), rest.split(" ", 1)[0])
+            entries.append((int(m.group(1)), kind))
+    return entries
+
+
+def data_sizes(backup: Path) -> dict[int, int]:
+    """Размеры данных записей TOC по файлам архива directory; для custom размеров нет — {}."""
+    if not backup.is_dir():
+        return {}
+    sizes = {}
+    for f in backup.iterdir():
+        m = DATA_FILE_RE.match(f.name)
+        if m:
+            sizes[int(m.group(1))] = f.stat().st_size
+    return sizes
+
+
+def plan_jobs(toc: list[tuple[int, str]], sizes: dict[int, int], cpus: int) -> tuple[int, int, str]:
+    """
+    (задания для данных, задания для post-data, пояснение). Данные: одна таблица грузится одним заданием,
+    поэтому заданий больше, чем объём / крупнейшая таблица, не нужно — лишние простаивают, пока грузится она.
+    Post-data: по индексам и ограничениям, не больше CPU.
+    """
+    data = [i for i, kind in toc if kind in DATA_TYPES]
+    post = [i for i, kind in toc if kind in POST_DATA_TYPES]
+    data_jobs = min(cpus, max(1, len(data)))
+    note = f"таблиц с данными {len(data)}"
+    known = [sizes[i] for i in data if i in sizes]
+    if known and max(known) > 0:
+        total, largest = sum(known), max(known)
+        data_jobs = min(data_jobs, max(1, math.ceil(total / largest)))
+        note += f", {total / 1e6:.1f} МБ, крупнейшая {largest / 1e6:.1f} МБ ({largest * 100 // max(total, 1)}%)"
+    post_jobs = min(cpus, max(1, len(post)))
+    note += f", индексов и ограничений {len(post)}, CPU {cpus}"
+    return data_jobs, post_jobs, note
+
+
+def maintenance_mem(value: str, jobs: int) -> str | None:
+    """maintenance_work_mem на задание: auto — доля RAM хоста на jobs заданий; 0/off — не менять."""
+    if value in ("0", "off", "none"):
+        return None
+    if value != "auto":
+        return value
+    try:
+        ram = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError):
+        return None
+    mb = int(ram * MAINTENANCE_RAM_SHARE / max(1, jobs) / 2**20)
+    return f"{min(max(mb, MAINTENANCE_MIN_MB), MAINTENANCE_MAX_MB)}MB"
+
+
+def _session(settings: list[str]) -> dict | None:
+    """Окружение с настройками сессии: PGOPTIONS из окружения плюс -c name=value."""
+    if not settings:
+        return None
+    return {"PGOPTIONS": " ".join([os.environ.get("PGOPTIONS", "")] + [f"-c {s}" for s in settings]).strip()}
+
+
+def restore_phased(args: argparse.Namespace, cmd_base: list[str], opts: list[str], backup: Path) -> int:
+    """pre-data -> data (-j) -> post-data (-j, maintenance_work_mem). Время фаз — в лог."""
+    cpus = os.cpu_count() or 1
+    if args.jobs == "auto":
+        toc = read_toc(args.pg_restore, backup)
+        if toc is None:
+            print("Ошибка: pg_restore -l не прочитал оглавление архива", file=sys.stderr)
+            return 1
+        data_jobs, post_jobs, note = plan_jobs(toc, data_sizes(backup), cpus)
+        print(f"Оглавление: {note} -> заданий: данные {data_jobs}, индексы {post_jobs}", file=sys.stderr)
+    else:
+        data_jobs = post_jobs = int(args.jobs)
+    mem = maintenance_mem(args.maintenance_work_mem, post_jobs)
+    fast = list(FAST_LOAD_SETTINGS) if args.fast_load else []
+
+    phases = [
+        ("pre-data", opts, fast),
+        ("data", opts + (["--disable-triggers"] if args.fast_load else []) + ["-j", str(data_jobs)], fast),
+        ("post-data", opts + ["-j", str(post_jobs)], fast + ([f"maintenance_work_mem={mem}"] if mem else [])),
+    ]
+    timings = []
+    started = time.monotonic()
+    for name, extra, settings in phases:
+        print(f"Фаза {name}" + (f", заданий: {extra[-1]}" if "-j" in extra else "")
+              + "".join(f", {s}" for s in settings) + "...", file=sys.stderr)
+        t0 = time.monotonic()
+        code = run(cmd_base + [f"--section={name}"] + extra + [str(backup)], _session(settings))
+        timings.append((name, time.monotonic() - t0))
+        if code != 0:
+            print(f"Ошибка: фаза {name} завершилась с кодом {code} через {timings[-1][1]:.1f} с", file=sys.stderr)
+            return code
+    total = time.monotonic() - started
+    size = sum(f.stat().st_size for f in backup.rglob("*") if f.is_file()) if backup.is_dir() else backup.stat().st_size
+    data_seconds = dict(timings)["data"]
+    print("Время фаз: " + ", ".join(f"{name} {sec:.1f} с" for name, sec in timings)
+          + f"; всего {total:.1f} с (RTO), данные {size / max(data_seconds, 1e-6) / 1e6:.1f} МБ/с архива", file=sys.stderr)
+    return 0
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Восстановление PostgreSQL из бэкапа (pg_restore)")
     parser.add_argument("--backup", "-b", required=True, help="Путь к файлу .dump (custom) или каталогу (directory format)")
@@ -32,9 +173,22 @@ def main() -> int:
     parser.add_argument("--create-db", action="store_true", help="Создать БД перед восстановлением (createdb)")
     parser.add_argument("--clean", action="store_true", help="Удалить объекты перед восстановлением (pg_restore --clean)")
     parser.add_argument("--no-owner", action="store_true", default=True, help="Не восстанавливать владельцев (по умолчанию включено)")
+    parser.add_argument("--jobs", "-j", default="1",
+                        help="Восстановление по фазам с pg_restore -j N; auto — по CPU и оглавлению архива; 1 — одним pg_restore")
+    parser.add_argument("--maintenance-work-mem", default="auto",
+                        help="--jobs, --fast-load: maintenance_work_mem для индексов (напр. 2GB; auto — 1/4 RAM хоста на задания; 0 — не менять)")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="synchronous_commit=off и maintenance_work_mem в сессиях pg_restore, --disable-triggers для данных")
     parser.add_argument("--pg-restore", default="pg_restore", help="Путь к pg_restore")
     parser.add_argument("--createdb", default="createdb", help="Путь к createdb")
     args = parser.parse_args()
+    if args.jobs != "auto" and not (args.jobs.isdigit() and int(args.jobs) >= 1):
+        parser.error("--jobs: число заданий (1 и больше) или auto")
+    # pg_restore --clean удаляет только объекты выбранной секции: DROP TABLE в pre-data упрётся во внешние ключи
+    # из post-data, которые никто не удалил
+    if args.clean and args.jobs != "1":
+        parser.error("--clean с --jobs не работает (pg_restore чистит только свою секцию): "
+                     "пересоздайте БД (dropdb, затем --create-db) или восстановите с --jobs 1")
 
     backup = Path(args.backup)
     if not backup.exists():
@@ -42,6 +196,8 @@ def main() -> int:
         return 1
 
     db = args.database
+    metrics.annotate(target=f"{os.environ.get('PGHOST', 'localhost')}:{os.environ.get('PGPORT', '5432')}/{db}", artifact=backup,
+                     profile="fast-load" if args.fast_load else None)
     cmd_base = [args.pg_restore, "-d", db]
     if os.environ.get("PGHOST"):
         cmd_base.extend(["-h", os.environ["PGHOST"]])
@@ -64,14 +220,21 @@ def main() -> int:
             # БД может уже существовать
             print("  (createdb завершился с ошибкой; продолжаем восстановление)", file=sys.stderr)
 
-    cmd = cmd_base + [str(backup)]
-    if args.clean:
-        cmd.insert(cmd.index("-d") + 2, "--clean")
-    if args.no_owner:
-        cmd.insert(cmd.index("-d") + 2, "--no-owner")
+    opts = (["--no-owner"] if args.no_owner else []) + (["--clean"] if args.clean else [])
+    if args.jobs != "1":
+        code = restore_phased(args, cmd_base, opts, backup)
+        if code != 0:
+            return code
+        print("Готово.", file=sys.stderr)
+        return 0
 
-    print("Восстановление...", file=sys.stderr)
-    code = run(cmd)
+    settings = []
+    if args.fast_load:
+        mem = maintenance_mem(args.maintenance_work_mem, 1)
+        settings = list(FAST_LOAD_SETTINGS) + ([f"maintenance_work_mem={mem}"] if mem else [])
+        opts = opts + ["--disable-triggers"]
+    print("Восстановление" + "".join(f", {s}" for s in settings) + "...", file=sys.stderr)
+    code = run(cmd_base + opts + [str(backup)], _session(settings))
     if code != 0:
         return code
     print("Готово.", file=sys.stderr)
@@ -79,4 +242,4 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(metrics.run_main("restore", "pg", main))
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Восстановление PostgreSQL на момент времени (PITR) из архива backup_pg_wal.py: базовая копия
+(pg_base_<дата>.tar.zst) распаковывается на лету в пустой каталог данных, в postgresql.auto.conf пишутся
+restore_command (backup_pg_wal.py fetch) и цель восстановления, создаётся recovery.signal (PostgreSQL 12+).
+Базовая копия выбирается сама: последняя, законченная до цели (--target-time) или согласованная до неё
+(--target-lsn); без цели — последняя, WAL проигрывается до конца архива. Перед распаковкой проверяется,
+что WAL в архиве идёт без пропусков от начала копии (до цели, если это LSN).
+Физическая копия backup_postgres.py --physical (каталог pg_phys_<дата>.dir, --base без --archive) самодостаточна:
+base.tar — в каталог данных, <oid>.tar — в каталоги табличных пространств из tablespace_map, pg_wal.tar — в pg_wal;
+сервер при старте проигрывает WAL копии до согласованности.
+Сервер не запускается, если не указан --start (pg_ctl start): проигрывание WAL идёт при старте.
+Использование:
+  python3 restore_postgres_pitr.py --archive /backup/pg-wal --pgdata /var/lib/postgresql/16/main \\
+      --target-time "2025-02-11 14:30:00+03" [--target-action promote|pause|shutdown] [--start]
+  python3 restore_postgres_pitr.py --archive /backup/pg-wal --pgdata /srv/pg --target-lsn 16/B374D848
+  python3 restore_postgres_pitr.py --archive /backup/pg-wal --pgdata /srv/pg --base /backup/pg-wal/pg_base_2025-02-10_01-00.tar.zst
+  python3 restore_postgres_pitr.py --pgdata /srv/pg --base /backup/pg/pg_phys_2025-02-11_01-00.dir
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import tarfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Архив WAL, кодеки и метрики — общие модули скриптов бэкапа
+BACKUP_DIR = Path(__file__).resolve().parent.parent / "backup"
+sys.path.insert(0, str(BACKUP_DIR))
+import backup_codecs as codecs
+import backup_metrics as metrics
+import backup_pg_physical as physical
+import backup_pg_wal as wal
+from backup_common import read_sidecar
+
+
+def run(cmd: list[str], env: dict | None = None) -> int:
+    print(f"  Выполняется: {' '.join(cmd)}", file=sys.stderr)
+    try:
+        r = subprocess.run(cmd, env={**os.environ, **(env or {})}, timeout=3600)
+        return r.returncode
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        print(f"  Ошибка: {e}", file=sys.stderr)
+        return -1
+
+
+def parse_time(value: str) -> float:
+    """Время цели -> epoch (без часового пояса — местное время, как у recovery_target_time на этом хосте)."""
+    value = value.strip()
+    if len(value) > 3 and value[-3] in "+-" and value[-2:].isdigit():
+        value += ":00"  # 2025-02-11 14:30:00+03 -> +03:00
+    return datetime.fromisoformat(value).timestamp()
+
+
+def choose_base(archive: Path, target_time: float | None, target_lsn: int | None) -> tuple[Path, dict] | None:
+    """Последняя базовая копия, законченная до цели (по времени окончания или по LSN согласованности)."""
+    chosen = None
+    for path, manifest in wal.list_bases(archive):
+        if target_time is not None and manifest.get("finished", 0) > target_time:
+            continue
+        if target_lsn is not None and wal.parse_lsn(manifest.get("end_lsn") or manifest["start_lsn"]) > target_lsn:
+            continue
+        chosen = (path, manifest)
+    return chosen
+
+
+def check_wal(archive: Path, manifest: dict, target_lsn: int | None) -> int:
+    """
+    WAL от начала копии без пропусков: до цели (LSN) — обязательно, иначе — до конца архива (пропуск дальше
+    точки согласованности копии только сокращает достижимое время, об этом предупреждение).
+    """
+    size = wal.segment_size(archive)
+    have = {wal.segment_number(n, size) for n in wal.list_archived(archive) if wal.SEGMENT_RE.match(n)}
+    spool = archive / wal.SPOOL_DIR
+    if spool.is_dir():
+        have |= {wal.segment_number(p.name[:24], size) for p in spool.iterdir() if wal.SEGMENT_RE.match(p.name[:24])}
+    first = wal.segment_number(manifest["start_segment"], size)
+    consistent = wal.parse_lsn(manifest.get("end_lsn") or manifest["start_lsn"]) // size
+    last = target_lsn // size if target_lsn is not None else max(have, default=first)
+    for segno in range(first, max(last, consistent) + 1):
+        if segno not in have:
+            where = wal.format_lsn(segno * size)
+            if segno <= consistent or target_lsn is not None:
+                print(f"Ошибка: в архиве нет WAL с {where} — копия не восстановится до цели", file=sys.stderr)
+                return 1
+            print(f"Внимание: в архиве нет WAL с {where} — проигрывание остановится там", file=sys.stderr)
+            return 0
+    print(f"WAL в архиве: с {manifest['start_segment']}, сегментов до цели {last - first + 1}", file=sys.stderr)
+    return 0
+
+
+def extract(base: Path, pgdata: Path) -> int:
+    """Распаковка tar базовой копии в pgdata на лету (кодек по суффиксу)."""
+    started = time.monotonic()
+    # tar-фильтр: права и владельцы как в копии, без абсолютных путей и выхода за каталог (Python 3.11.4+)
+    kwargs = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    total = 0
+    try:
+        with codecs.open_reader(base) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+            for member in tar:
+                tar.extract(member, pgdata, **kwargs)
+                total += member.size
+    except (OSError, tarfile.TarError) as e:
+        print(f"Ошибка распаковки {base.name}: {e}", file=sys.stderr)
+        return 1
+    os.chmod(pgdata, 0o700)
+    elapsed = max(time.monotonic() - started, 1e-6)
+    metrics.add(bytes_read=base.stat().st_size, bytes_written=total)
+    print(f"Распаковано {total / 1e6:.1f} МБ за {elapsed:.1f} с ({total / elapsed / 1e6:.1f} МБ/с)", file=sys.stderr)
+    return 0
+
+
+def _tablespace_map(pgdata: Path) -> dict[str, Path]:
+    """
+    oid -> каталог табличного пространства из tablespace_map: строки "<oid> <путь>", обратная косая черта
+    в пути экранирует следующий символ (в том числе перевод строки) — разбор как у read_tablespace_map сервера.
+    """
+    path = pgdata / "tablespace_map"
+    if not path.exists():
+        return {}
+    result = {}
+    line, escaped = [], False
+    for ch in path.read_text() + "\n":
+        if escaped:
+            line.append(ch)
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch in "\r\n":
+            oid, _, location = "".join(line).partition(" ")
+            if location:
+                result[oid] = Path(location)
+            line = []
+        else:
+            line.append(ch)
+    return result
+
+
+def extract_physical(base: Path, pgdata: Path) -> int:
+    """
+    Физическая копия pg_phys_<дата>.dir: base.tar — в pgdata, pg_wal.tar — в pgdata/pg_wal, <oid>.tar — в каталог
+    табличного пространства из tablespace_map (не существует или пустой; ссылки pg_tblspc сервер создаст при старте).
+    """
+    tars = physical.list_tars(base)
+    if "base" not in tars:
+        print(f"Ошибка: в {base} нет base.tar", file=sys.stderr)
+        return 1
+    if extract(tars.pop("base"), pgdata) != 0:
+        return 1
+    locations = _tablespace_map(pgdata)
+    wal_tar = tars.pop("pg_wal", None)
+    for oid, tar in tars.items():
+        location = locations.get(oid)
+        if location is None:
+            print(f"Ошибка: табличного пространства {oid} нет в tablespace_map", file=sys.stderr)
+            return 1
+        if location.exists() and any(location.iterdir()):
+            print(f"Ошибка: каталог табличного пространства {location} не пустой", file=sys.stderr)
+            return 1
+        location.mkdir(mode=0o700, parents=True, exist_ok=True)
+        print(f"Табличное пространство {oid} -> {location}", file=sys.stderr)
+        if extract(tar, location) != 0:
+            return 1
+    if wal_tar is not None:
+        (pgdata / "pg_wal").mkdir(mode=0o700, exist_ok=True)
+        if extract(wal_tar, pgdata / "pg_wal") != 0:
+            return 1
+    return 0
+
+
+def write_recovery(pgdata: Path, archive: Path, args: argparse.Namespace) -> None:
+    """restore_command и цель — в postgresql.auto.conf (читается последним), recovery.signal — режим восстановления."""
+    fetch = " ".join([shlex.quote(sys.executable), shlex.quote(str(BACKUP_DIR / "backup_pg_wal.py")), "fetch",
+                      "--dest", shlex.quote(str(archive.resolve())), "%f", "%p"])
+    settings = {"restore_command": fetch, "recovery_target_timeline": "latest"}
+    if args.target_time:
+        settings["recovery_target_time"] = args.target_time
+    elif args.target_lsn:
+        settings["recovery_target_lsn"] = args.target_lsn
+    elif args.target_immediate:
+        settings["recovery_target"] = "immediate"
+    if args.target_time or args.target_lsn or args.target_immediate:
+        settings["recovery_target_action"] = args.target_action
+        settings["recovery_target_inclusive"] = "off" if args.exclusive else "on"
+    lines = [f"\n# restore_postgres_pitr.py {datetime.now():%Y-%m-%d %H:%M}"]
+    lines += [f"{key} = '{value.replace(chr(39), chr(39) * 2)}'" for key, value in settings.items()]
+    with open(pgdata / "postgresql.auto.conf", "a") as f:
+        f.write("\n".join(lines) + "\n")
+    (pgdata / "recovery.signal").touch()
+    for key, value in settings.items():
+        print(f"  {key} = {value}", file=sys.stderr)
+
+
+def start(args: argparse.Namespace, pgdata: Path) -> int:
+    """pg_ctl start при --start (проигрывание WAL — при старте), иначе подсказка."""
+    if args.start:
+        print("Запуск сервера (проигрывание WAL)...", file=sys.stderr)
+        code = run([args.pg_ctl, "-D", str(pgdata), "-l", str(pgdata / "pitr_recovery.log"), "start"])
+        if code != 0:
+            return code
+    else:
+        print(f"Готово. Запуск: pg_ctl -D {pgdata} start", file=sys.stderr)
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Восстановление PostgreSQL на момент времени (базовая копия + WAL)")
+    parser.add_argument("--archive", default=None,
+                        help="Каталог архива backup_pg_wal.py (--dest там); не нужен для --base pg_phys_*.dir")
+    parser.add_argument("--pgdata", required=True, help="Каталог данных (не существует или пустой)")
+    parser.add_argument("--base", default=None,
+                        help="Базовая копия (по умолчанию — последняя до цели) или каталог pg_phys_*.dir (--physical)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--target-time", default=None, help="Время цели (recovery_target_time), напр. '2025-02-11 14:30:00+03'")
+    target.add_argument("--target-lsn", default=None, help="LSN цели (recovery_target_lsn), напр. 16/B374D848")
+    target.add_argument("--target-immediate", action="store_true", help="Только до согласованности копии")
+    parser.add_argument("--target-action", choices=["promote", "pause", "shutdown"], default="promote",
+                        help="Что делать по достижении цели (recovery_target_action)")
+    parser.add_argument("--exclusive", action="store_true", help="Остановиться перед целью (recovery_target_inclusive = off)")
+    parser.add_argument("--start", action="store_true", help="Запустить сервер (pg_ctl start) после подготовки")
+    parser.add_argument("--pg-ctl", default="pg_ctl", help="Путь к pg_ctl")
+    args = parser.parse_args()
+    physical_copy = bool(args.base) and Path(args.base).is_dir()
+    if physical_copy and (args.archive or args.target_time or args.target_lsn or args.target_immediate):
+        parser.error("физическая копия (pg_phys_*.dir) восстанавливается до конца своего WAL: "
+                     "--archive и --target-* с ней не сочетаются")
+    if not physical_copy and not args.archive:
+        parser.error("нужен --archive (без него — только --base pg_phys_*.dir)")
+
+    pgdata = Path(args.pgdata)
+    if pgdata.exists() and any(pgdata.iterdir()):
+        print(f"Ошибка: {pgdata} не пустой — PITR восстанавливается только в пустой каталог", file=sys.stderr)
+        return 1
+    try:
+        target_time = parse_time(args.target_time) if args.target_time else None
+        target_lsn = wal.parse_lsn(args.target_lsn) if args.target_lsn else None
+    except ValueError as e:
+        print(f"Ошибка: неверная цель: {e}", file=sys.stderr)
+        return 1
+
+    if physical_copy:
+        base = Path(args.base)
+        if not (base / physical.MANIFEST).exists():
+            print(f"Ошибка: в {base} нет {physical.MANIFEST} — это не копия backup_postgres.py --physical",
+                  file=sys.stderr)
+            return 1
+        metrics.annotate(target=str(pgdata), artifact=base)
+        pgdata.mkdir(mode=0o700, parents=True, exist_ok=True)
+        print(f"Распаковка физической копии {base.name} в {pgdata}...", file=sys.stderr)
+        if extract_physical(base, pgdata) != 0:
+            return 1
+        return start(args, pgdata)
+
+    archive = Path(args.archive)
+    if args.base:
+        base = Path(args.base)
+        manifest = read_sidecar(base) or {}
+        if "start_lsn" not in manifest:
+            print(f"Ошибка: у {base} нет манифеста базовой копии (backup_pg_wal.py base)", file=sys.stderr)
+            return 1
+    else:
+        chosen = choose_base(archive, target_time, target_lsn)
+        if chosen is None:
+            print("Ошибка: нет базовой копии, законченной до цели", file=sys.stderr)
+            return 1
+        base, manifest = chosen
+    metrics.annotate(target=str(pgdata), artifact=base)
+    print(f"Базовая копия {base.name}: начало {manifest['start_lsn']}, линия времени {manifest.get('timeline', 1)}",
+          file=sys.stderr)
+    if check_wal(archive, manifest, target_lsn) != 0:
+        return 1
+
+    pgdata.mkdir(mode=0o700, parents=True, exist_ok=True)
+    print(f"Распаковка в {pgdata}...", file=sys.stderr)
+    if extract(base, pgdata) != 0:
+        return 1
+    write_recovery(pgdata, archive, args)
+    return start(args, pgdata)
+
+
+if __name__ == "__main__":
+    sys.exit(metrics.run_main("restore", "pg", main))
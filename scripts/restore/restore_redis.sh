@@ -4,6 +4,7 @@
 # Использование:
 #   ./restore_redis.sh --backup /backup/redis/redis_2025-02-11.rdb [--rdb-path /var/lib/redis/dump.rdb] [--restart]
 #   --restart  выполнить systemctl restart redis-server (или redis)
+# Сжатый бэкап (.rdb.zst, .rdb.lz4, .rdb.gz — backup_redis.py --codec) распаковывается по суффиксу.
 
 set -e
 
@@ -66,8 +67,22 @@ if [[ -f "$RDB_PATH" ]]; then
   mv "$RDB_PATH" "$SAVE"
 fi
 
-echo "Копирование бэкапа в $RDB_PATH"
-cp "$BACKUP" "$RDB_PATH"
+case "$BACKUP" in
+  *.zst) DECOMPRESS=(zstd -q -d -c) ;;
+  *.lz4) DECOMPRESS=(lz4 -q -d -c) ;;
+  *.gz)  DECOMPRESS=(gzip -d -c) ;;
+  *)     DECOMPRESS=() ;;
+esac
+if [[ ${#DECOMPRESS[@]} -gt 0 ]]; then
+  echo "Распаковка бэкапа в $RDB_PATH (${DECOMPRESS[0]})"
+  # Во временный файл рядом: обрыв распаковки не оставит Redis обрезанный dump.rdb
+  "${DECOMPRESS[@]}" "$BACKUP" > "${RDB_PATH}.tmp"
+  mv "${RDB_PATH}.tmp" "$RDB_PATH"
+else
+  echo "Копирование бэкапа в $RDB_PATH"
+  # reflink, где ФС поддерживает (btrfs/XFS); иначе GNU cp сам использует copy_file_range
+  cp --reflink=auto "$BACKUP" "$RDB_PATH"
+fi
 chown redis:redis "$RDB_PATH" 2>/dev/null || true
 chmod 660 "$RDB_PATH" 2>/dev/null || true
 